@@ -1,6 +1,24 @@
+import functools
+import itertools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
 import boto3
 from botocore.exceptions import NoCredentialsError, PartialCredentialsError
 
+# S3 limits of a multipart upload: parts of at least 5 MB (but the last one), at most 10000 parts
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+MAX_PARTS = 10000
+
+S3_PART_SIZE = int(os.getenv("S3_PART_SIZE", str(8 * 1024 * 1024)))
+
+# parts uploaded at the same time
+S3_UPLOAD_WORKERS = int(os.getenv("S3_UPLOAD_WORKERS", "4"))
+
+S3_PART_RETRIES = int(os.getenv("S3_PART_RETRIES", "3"))
+
 def s3_single_upload(local_file_path, bucket_name, object_name):
     s3 = boto3.resource('s3')
     
@@ -11,28 +29,87 @@ def s3_single_upload(local_file_path, bucket_name, object_name):
         print(e)
         return False
 
-def s3_multipart_upload(file_path, bucket_name, object_key, region_name=None):
+def _iter_parts(source, part_size):
+    """
+    Yields the content of `source` in chunks of `part_size` bytes (the last one may be shorter).
+    `source` is a local file path, a binary (or text) file-like object, or an iterable of
+    bytes / str chunks of any size, e.g. a generator streaming an export.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as file:
+            yield from _iter_parts(file, part_size)
+        return
+
+    if hasattr(source, 'read'):
+        # a socket, pipe or GzipFile may return less than asked: its reads are buffered like
+        # the chunks of an iterable, S3 rejects parts under 5 MB but the last one
+        file = source
+        source = iter(lambda: file.read(part_size) or None, None)
+
+    buffer = bytearray()
+    for chunk in source:
+        buffer += chunk.encode() if isinstance(chunk, str) else chunk
+        while len(buffer) >= part_size:
+            yield bytes(buffer[:part_size])
+            del buffer[:part_size]
+    if buffer:
+        yield bytes(buffer)
+
+
+def _upload_part(s3, bucket_name, object_key, upload_id, part_number, body, retries, backoff):
+    """
+    Uploads one part, retried `retries` times with exponential backoff.
+    Returns its {'PartNumber', 'ETag'} entry of the completion request.
+    """
+    for attempt in range(retries + 1):
+        try:
+            response = s3.upload_part(Bucket=bucket_name, Key=object_key, UploadId=upload_id,
+                                      PartNumber=part_number, Body=body)
+            return {'PartNumber': part_number, 'ETag': response['ETag']}
+        except (NoCredentialsError, PartialCredentialsError):
+            raise
+        except Exception as e:
+            if attempt == retries:
+                raise
+            print(f"Retrying part {part_number} of {object_key} ({attempt + 1}/{retries}): {e}")
+            time.sleep(backoff * 2 ** attempt)
+
+
+def s3_multipart_upload(file_path, bucket_name, object_key, region_name=None, part_size=S3_PART_SIZE,
+                        max_workers=S3_UPLOAD_WORKERS, retries=S3_PART_RETRIES, backoff=1.0, s3=None):
     """
-    Performs an S3 multipart upload for a specified local file.
+    Performs a parallel S3 multipart upload of a local file, a file-like object or a generator.
 
     Parameters:
-    - file_path: Local file path to upload
+    - file_path: Local file path, binary file-like object or iterable of bytes chunks to upload,
+      read as it is uploaded (a streamed export needs no temporary file)
     - bucket_name: S3 bucket name
     - object_key: Key to assign to the S3 object
     - region_name (optional): AWS region name
+    - part_size (optional): Size of the parts in bytes, at least 5 MB (S3 minimum)
+    - max_workers (optional): Parts uploaded at the same time, at most `max_workers` parts are held in memory
+    - retries (optional): Attempts of a failed part before the upload is aborted, with `backoff` seconds
+      doubled per attempt
+    - s3 (optional): boto3 S3 client to use
 
     Returns:
-    - None if the upload is successful, raises an exception otherwise.
+    - The response of the completion (of put_object when the source fits in one part),
+      raises an exception otherwise, after aborting the upload.
     """
 
-    # Create an S3 client
-    s3 = boto3.client('s3', region_name=region_name)
+    if part_size < MIN_PART_SIZE:
+        raise ValueError(f"part_size must be at least {MIN_PART_SIZE} bytes (S3 minimum), got {part_size}")
 
-    # Set the multipart threshold to 8 MB (minimum allowed by S3)
-    multipart_threshold = 8 * 1024 * 1024
+    # Create an S3 client, low-level clients are thread safe
+    s3 = s3 or boto3.client('s3', region_name=region_name)
 
-    # Set the multipart chunk size to 8 MB (minimum allowed by S3)
-    multipart_chunksize = 8 * 1024 * 1024
+    parts_iter = _iter_parts(file_path, part_size)
+    first_part = next(parts_iter, b'')
+    second_part = next(parts_iter, None)
+
+    # a single part needs no multipart upload
+    if second_part is None:
+        return s3.put_object(Bucket=bucket_name, Key=object_key, Body=first_part)
 
     # Create a multipart upload request
     response = s3.create_multipart_upload(
@@ -42,54 +119,59 @@ def s3_multipart_upload(file_path, bucket_name, object_key, region_name=None):
 
     upload_id = response['UploadId']
 
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    in_flight = set()
     try:
-        # Perform the multipart upload
-        with open(file_path, 'rb') as file:
-            part_number = 1
-            parts = []
-
-            while True:
-                # Read a chunk of the file
-                chunk = file.read(multipart_chunksize)
+        parts = []
+        upload = functools.partial(_upload_part, s3, bucket_name, object_key, upload_id,
+                                   retries=retries, backoff=backoff)
 
-                # Break if we reached the end of the file
-                if not chunk:
-                    break
+        for part_number, chunk in enumerate(itertools.chain([first_part, second_part], parts_iter), start=1):
+            if part_number > MAX_PARTS:
+                raise ValueError(f"{object_key} needs more than {MAX_PARTS} parts, increase part_size")
 
-                # Upload the chunk as a part
-                response = s3.upload_part(
-                    Bucket=bucket_name,
-                    Key=object_key,
-                    UploadId=upload_id,
-                    PartNumber=part_number,
-                    Body=chunk
-                )
+            # bounded read-ahead, a part is only read once a worker is free
+            if len(in_flight) >= max_workers:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                parts.extend(future.result() for future in done)
 
-                # Append the part information to the list
-                parts.append({'PartNumber': part_number, 'ETag': response['ETag']})
+            in_flight.add(executor.submit(upload, part_number=part_number, body=chunk))
 
-                part_number += 1
+        done, in_flight = wait(in_flight)
+        parts.extend(future.result() for future in done)
 
         # Complete the multipart upload
         response = s3.complete_multipart_upload(
             Bucket=bucket_name,
             Key=object_key,
             UploadId=upload_id,
-            MultipartUpload={'Parts': parts}
+            MultipartUpload={'Parts': sorted(parts, key=lambda part: part['PartNumber'])}
         )
 
-        print("Multipart upload successful.")
-        print(response)
-
     except (NoCredentialsError, PartialCredentialsError) as e:
         print(f"Credentials error: {e}")
+        _abort(s3, bucket_name, object_key, upload_id, in_flight)
         raise e
-    except Exception as e:
+    except BaseException as e:
         print(f"Error during multipart upload: {e}")
+        _abort(s3, bucket_name, object_key, upload_id, in_flight)
         raise e
     finally:
-        # Clean up in case of an exception
+        executor.shutdown(wait=True)
+
+    print(f"Multipart upload of {object_key} successful ({len(parts)} parts).")
+    return response
+
+
+def _abort(s3, bucket_name, object_key, upload_id, in_flight):
+    # parts still uploading would be stored after the abort
+    for future in in_flight:
+        future.cancel()
+    wait(in_flight)
+    try:
         s3.abort_multipart_upload(Bucket=bucket_name, Key=object_key, UploadId=upload_id)
+    except Exception as e:
+        print(f"Could not abort multipart upload {upload_id} of {object_key}: {e}")
 
 # # usage:
 # file_path = '/path/to/your/file.txt'
@@ -99,4 +181,4 @@ def s3_multipart_upload(file_path, bucket_name, object_key, region_name=None):
 # aws_secret_access_key = 'your-secret-access-key'
 # region_name = 'your-region'
 
-# s3_multipart_upload(file_path, bucket_name, object_key, aws_access_key_id, aws_secret_access_key, region_name)
+# s3_multipart_upload(file_path, bucket_name, object_key, region_name=region_name)
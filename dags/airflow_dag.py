@@ -35,11 +35,13 @@ def execute_load_stations(*args, **kwargs):
 
 def execute_extract_station_data(*args, **kwargs):
     logger.info("Executing extract_station_data task")
-    ingest_extract_station_data()
+    # retries of the same run skip the stations already done
+    ingest_extract_station_data(run_id=kwargs.get("run_id"))
 
 def execute_load_station_data(*args, **kwargs):
     logger.info("Executing load_station_data task")
-    ingest_load_station_data()
+    # retries of the same run skip the stations already done
+    ingest_load_station_data(run_id=kwargs.get("run_id"))
 
 def execute_create_dimension_tables(*args, **kwargs):
     logger.info("Executing create_dimension_tables task")
@@ -0,0 +1,163 @@
+import configparser
+import gzip
+import os
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+# the tests needing postgres run against the [TEST_DB_HOST] section of TEST_DB_CONFIG,
+# a throwaway database: its public schema is dropped before every test
+TEST_DB_CONFIG = os.path.abspath(os.getenv("TEST_DB_CONFIG", "tmp/config.ini"))
+TEST_DB_HOST = os.getenv("TEST_DB_HOST", "test")
+
+
+def station_file(station_id, start="1990-01-01", days=10, element="TMAX", value=100) -> bytes:
+    """
+    Gzipped by_station csv of `days` daily `element` rows of a station, valued value, value + 1, ..
+    """
+    
+    import pandas as pd
+    
+    dates = pd.date_range(start, periods=days, freq="D")
+    rows = "".join(f"{station_id},{date:%Y%m%d},{element},{value + i},,,E,\n" for i, date in enumerate(dates))
+    return gzip.compress(rows.encode())
+
+
+class StationServer:
+    """StationServer
+
+    Local HTTP stand-in of the station files host. Serves `files`
+    ({path: body}, open-ended `Range: bytes=N-` requests answered with
+    206), answers `errors` ({path: status}) instead when set, after
+    sleeping `delay` seconds. Records the paths and headers of the
+    requests and the most requests in flight at once, overall and per
+    Host header.
+    """
+
+    def __init__(self) -> None:
+        self.files = {}
+        self.errors = {}
+        self.delay = 0.0
+        self.requests = []
+        self.headers = []
+        self.max_in_flight = 0
+        self.max_in_flight_per_host = defaultdict(int)
+        self._in_flight = defaultdict(int)
+        self._lock = threading.Lock()
+        
+        stand_in = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stand_in._serve(self)
+            
+            def log_message(self, *args):
+                pass
+        
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def url(self, path, host="127.0.0.1") -> str:
+        return f"http://{host}:{self.port}{path}"
+
+    def _serve(self, request) -> None:
+        host = request.headers.get("Host")
+        with self._lock:
+            self.requests.append(request.path)
+            self.headers.append(dict(request.headers))
+            self._in_flight[host] += 1
+            self.max_in_flight = max(self.max_in_flight, sum(self._in_flight.values()))
+            self.max_in_flight_per_host[host] = max(self.max_in_flight_per_host[host], self._in_flight[host])
+        try:
+            time.sleep(self.delay)
+            status = self.errors.get(request.path)
+            body = self.files.get(request.path)
+            if status is None and body is None:
+                status = 404
+            if status:
+                request.send_response(status)
+                request.send_header("Content-Length", "0")
+                request.end_headers()
+                return
+            
+            offset = 0
+            byte_range = request.headers.get("Range", "")
+            if byte_range.startswith("bytes=") and byte_range.endswith("-"):
+                offset = int(byte_range[len("bytes="):-1])
+            request.send_response(206 if offset else 200)
+            if offset:
+                request.send_header("Content-Range", f"bytes {offset}-{len(body) - 1}/{len(body)}")
+            request.send_header("Content-Length", str(len(body) - offset))
+            request.end_headers()
+            request.wfile.write(body[offset:])
+        finally:
+            with self._lock:
+                self._in_flight[host] -= 1
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def station_server():
+    server = StationServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    # the tasks read and write under the relative tmp/ directory
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "tmp").mkdir()
+    
+    from weather_pipeline.transform.result_cache import result_cache
+    result_cache.clear()
+    return tmp_path
+
+
+@pytest.fixture(scope="session")
+def _db_handler():
+    config = configparser.ConfigParser()
+    config.read(TEST_DB_CONFIG)
+    if TEST_DB_HOST not in config:
+        pytest.skip(f"No [{TEST_DB_HOST}] database in {TEST_DB_CONFIG} (TEST_DB_CONFIG / TEST_DB_HOST)")
+    
+    from weather_pipeline.db_handler import DbHandler
+    return DbHandler(config_file=TEST_DB_CONFIG, host=TEST_DB_HOST)
+
+
+@pytest.fixture
+def db_handler(_db_handler, workdir):
+    from weather_pipeline.load.observations import ObservationsStore
+    from weather_pipeline.load.versions import DataVersions
+    _db_handler.execute_batch(["DROP SCHEMA public CASCADE;", "CREATE SCHEMA public;"])
+    # the versions table and the observations partitions went with the schema
+    DataVersions.clear()
+    ObservationsStore._partitions.clear()
+    return _db_handler
+
+
+@pytest.fixture(scope="session")
+def _tasks_module():
+    # the module creates its DbHandler from the relative tmp/config.ini on import
+    cwd = os.getcwd()
+    os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    try:
+        from weather_pipeline import tasks
+    finally:
+        os.chdir(cwd)
+    return tasks
+
+
+@pytest.fixture
+def tasks(_tasks_module, db_handler, monkeypatch):
+    monkeypatch.setattr(_tasks_module, "db_handler", db_handler)
+    return _tasks_module
@@ -0,0 +1,52 @@
+import pandas as pd
+
+from weather_pipeline.load import Loader
+from weather_pipeline.transform import Transform
+from weather_pipeline.transform.climatology import Climatology
+from weather_pipeline.transform.summaries import SummaryRegistry
+
+COLUMNS = [("station_ID", "VARCHAR"), ("DATE", "DATE"), ("value", "REAL")]
+
+
+def _load(db_handler, station_id, start, days, value):
+    data = pd.DataFrame({"station_ID": station_id, "DATE": pd.date_range(start, periods=days, freq="D"),
+                         "value": float(value)})
+    Loader(db_handler).load_csv_to_db(data, "TMAX", COLUMNS, method="copy", key_columns=["station_ID", "DATE"])
+    registry = SummaryRegistry(db_handler)
+    registry.create()
+    registry.mark_dirty(station_id, {"TMAX": set(data["DATE"].dt.year)})
+
+
+def _means(db_handler):
+    return {station_id: mean for station_id, mean in db_handler.execute_query(
+        "SELECT station_id, AVG(mean) FROM climatology_tmax GROUP BY station_id;")}
+
+
+def test_baseline_only_rebuilds_the_stations_changed_inside_the_period(db_handler):
+    for station_id, value in (("GM000000001", 10), ("GM000000002", 20)):
+        _load(db_handler, station_id, "1990-01-01", 2 * 365, value)
+    climatology = Climatology(db_handler, start_year=1990, end_year=1991, window=3)
+    
+    assert climatology.refresh() == 2 * 365
+    assert climatology.is_fresh()
+    assert _means(db_handler) == {"GM000000001": 10, "GM000000002": 20}
+    
+    # new rows after the reference period leave the baseline fresh
+    _load(db_handler, "GM000000001", "2005-01-01", 10, 50)
+    assert climatology.is_fresh()
+    
+    _load(db_handler, "GM000000002", "1990-01-01", 2 * 365, 30)
+    assert not climatology.is_fresh()
+    assert climatology.refresh() == 365
+    assert _means(db_handler) == {"GM000000001": 10, "GM000000002": 30}
+
+
+def test_anomaly_templates_build_their_baseline(db_handler):
+    _load(db_handler, "GM000000001", "1990-01-01", 365, 10)
+    transform = Transform(db_handler, summaries=False, cache=False)
+    transform.climatology = Climatology(db_handler, start_year=1990, end_year=1990)
+    
+    rows = list(transform.run("temp_anomalies"))
+    
+    assert len(rows) == 365 and {row[2] for row in rows} == {"Normal"}
+    assert transform.climatology.is_fresh()
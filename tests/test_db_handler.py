@@ -0,0 +1,36 @@
+import re
+
+import pytest
+from sqlalchemy.exc import DataError
+
+
+def _count(db_handler, table):
+    return list(db_handler.execute_query(f"SELECT count(*) FROM {table};"))[0][0]
+
+
+def test_batch_is_rolled_back_as_a_whole(db_handler):
+    db_handler.execute_query("CREATE TABLE t (n INT);")
+    
+    assert db_handler.execute_batch(["INSERT INTO t VALUES (1), (2);", "INSERT INTO t VALUES (3);"]) == [2, 1]
+    with pytest.raises(DataError):
+        db_handler.execute_batch(["INSERT INTO t VALUES (4);", "INSERT INTO t VALUES ('not a number');"])
+    
+    assert _count(db_handler, "t") == 3
+
+
+def test_results_are_fetched_in_chunks_from_a_server_side_cursor(db_handler):
+    rows = db_handler.stream_results("SELECT n FROM generate_series(1, 10) AS n", chunk_size=4)
+    assert [next(rows) for _ in range(6)] == [(n,) for n in range(1, 7)]
+    
+    # the backend serving the stream is still holding the rest of the result
+    fetch = [row[0] for row in db_handler.execute_query("""SELECT query FROM pg_stat_activity
+                                                           WHERE query LIKE 'FETCH FORWARD %%';""")]
+    assert len(fetch) == 1 and int(re.match(r"FETCH FORWARD (\d+)", fetch[0]).group(1)) <= 4
+    assert list(rows) == [(n,) for n in range(7, 11)]
+
+
+def test_dataframes_are_streamed_chunk_size_rows_at_a_time(db_handler):
+    chunks = list(db_handler.stream_dataframes("SELECT n FROM generate_series(1, 10) AS n", chunk_size=4))
+    
+    assert [len(df) for df in chunks] == [4, 4, 2]
+    assert [n for df in chunks for n in df["n"]] == list(range(1, 11))
@@ -0,0 +1,64 @@
+import requests
+
+from weather_pipeline.extract import Extractor
+from weather_pipeline.extract.downloader import ConcurrentDownloader
+
+from conftest import station_file
+
+
+def _jobs(station_server, station_ids, hosts=("127.0.0.1",), retries=0):
+    session = requests.Session()
+    for i, station_id in enumerate(station_ids):
+        url = station_server.url(f"/{station_id}.csv.gz", host=hosts[i % len(hosts)])
+        source = Extractor(source_type="web", source_url=url, temp_location=f"tmp/{station_id}.csv.gz",
+                           session=session, retries=retries, backoff=0).init()
+        yield station_id, url, lambda source=source: source.get(raise_errors=True)
+
+
+def _serve(station_server, station_ids):
+    for station_id in station_ids:
+        station_server.files[f"/{station_id}.csv.gz"] = station_file(station_id)
+
+
+def test_downloads_are_bounded_by_max_workers(workdir, station_server):
+    station_ids = [f"GM{i:09d}" for i in range(12)]
+    _serve(station_server, station_ids)
+    station_server.delay = 0.3
+    
+    report = ConcurrentDownloader(max_workers=3, per_host_limit=8).run(_jobs(station_server, station_ids))
+    
+    assert sorted(report.succeeded) == station_ids
+    assert station_server.max_in_flight == 3
+    assert all((workdir / "tmp" / f"{station_id}.csv.gz").exists() for station_id in station_ids)
+
+
+def test_downloads_are_bounded_per_host(workdir, station_server):
+    station_ids = [f"GM{i:09d}" for i in range(12)]
+    _serve(station_server, station_ids)
+    station_server.delay = 0.3
+    
+    report = ConcurrentDownloader(max_workers=8, per_host_limit=2).run(
+        _jobs(station_server, station_ids, hosts=("127.0.0.1", "localhost")))
+    
+    assert sorted(report.succeeded) == station_ids
+    assert set(station_server.max_in_flight_per_host.values()) == {2}
+    assert station_server.max_in_flight == 4
+
+
+def test_failures_are_collected_per_station(workdir, station_server):
+    station_ids = [f"GM{i:09d}" for i in range(6)]
+    _serve(station_server, station_ids)
+    station_server.errors["/GM000000001.csv.gz"] = 404
+    station_server.errors["/GM000000004.csv.gz"] = 500
+    
+    report = ConcurrentDownloader(max_workers=4, per_host_limit=4).run(
+        _jobs(station_server, station_ids, retries=1))
+    
+    assert sorted(report.succeeded) == ["GM000000000", "GM000000002", "GM000000003", "GM000000005"]
+    assert sorted(report.failed) == ["GM000000001", "GM000000004"]
+    assert report.failed["GM000000001"].response.status_code == 404
+    assert report.failed["GM000000004"].response.status_code == 500
+    # a server error is retried, a missing file is not
+    assert station_server.requests.count("/GM000000001.csv.gz") == 1
+    assert station_server.requests.count("/GM000000004.csv.gz") == 2
+    assert not (workdir / "tmp" / "GM000000001.csv.gz").exists()
@@ -0,0 +1,124 @@
+import hashlib
+
+import pytest
+import requests
+
+from weather_pipeline.extract import Extractor
+from weather_pipeline.extract.extractor import read_checksums
+from weather_pipeline.extract.session import create_session
+from weather_pipeline.extract.manifest import DownloadManifest, DOWNLOADED, NOT_MODIFIED
+
+from conftest import station_file
+
+PATH = "/GM000000001.csv.gz"
+
+BODY = station_file("GM000000001", days=2000)
+
+
+def _source(station_server, **kwargs):
+    return Extractor(source_type="web", source_url=station_server.url(PATH), temp_location="tmp/GM000000001.csv.gz",
+                     session=requests.Session(), retries=0, **kwargs).init()
+
+
+def test_partial_file_resumes_with_if_range(workdir, station_server):
+    station_server.files[PATH] = BODY
+    manifest = DownloadManifest("tmp/manifest.json")
+    manifest.update(station_server.url(PATH), partial_validator='"v1"')
+    (workdir / "tmp" / "GM000000001.csv.gz.part").write_bytes(BODY[:1000])
+    
+    assert _source(station_server, manifest=manifest).get(raise_errors=True) == DOWNLOADED
+    
+    assert station_server.headers[0]["Range"] == "bytes=1000-"
+    assert station_server.headers[0]["If-Range"] == '"v1"'
+    assert (workdir / "tmp" / "GM000000001.csv.gz").read_bytes() == BODY
+
+
+@pytest.mark.parametrize("with_manifest", [False, True], ids=["no-manifest", "no-validator"])
+def test_partial_file_without_validator_is_downloaded_again(workdir, station_server, with_manifest):
+    station_server.files[PATH] = BODY
+    # left over by an earlier version of the remote file
+    (workdir / "tmp" / "GM000000001.csv.gz.part").write_bytes(b"x" * 1000)
+    manifest = DownloadManifest("tmp/manifest.json") if with_manifest else None
+    
+    assert _source(station_server, manifest=manifest).get(raise_errors=True) == DOWNLOADED
+    
+    assert "Range" not in station_server.headers[0]
+    assert (workdir / "tmp" / "GM000000001.csv.gz").read_bytes() == BODY
+
+
+def test_checksum_mismatch_fails_the_download(workdir, station_server):
+    station_server.files[PATH] = BODY
+    
+    with pytest.raises(IOError, match="Checksum mismatch"):
+        _source(station_server, checksum="0" * 64).get(raise_errors=True)
+    
+    assert not (workdir / "tmp" / "GM000000001.csv.gz").exists()
+    assert not (workdir / "tmp" / "GM000000001.csv.gz.part").exists()
+
+
+def test_server_errors_are_retried_by_the_source_only(workdir, station_server):
+    station_server.errors[PATH] = 503
+    source = Extractor(source_type="web", source_url=station_server.url(PATH), temp_location="tmp/GM000000001.csv.gz",
+                       session=create_session(retries=2), retries=2, backoff=0).init()
+    
+    with pytest.raises(requests.HTTPError):
+        source.get(raise_errors=True)
+    
+    # one request per attempt of the source, the session does not retry them again
+    assert station_server.requests == [PATH] * 3
+
+
+def test_published_checksums_are_verified(tasks, db_handler, station_server):
+    station_server.files[PATH] = BODY
+    station_server.files["/GM000000002.csv.gz"] = station_file("GM000000002")
+    db_handler.execute_query("CREATE TABLE stations (id VARCHAR, latitude REAL, longitude REAL);")
+    db_handler.execute_query("INSERT INTO stations (id) VALUES ('GM000000001'), ('GM000000002');")
+    with open("tmp/SHA256SUMS", "w") as fp:
+        fp.write(f"{hashlib.sha256(BODY).hexdigest()}  GM000000001.csv.gz\n")
+        fp.write(f"{'0' * 64}  by_station/GM000000002.csv.gz\n")
+    
+    assert read_checksums("tmp/SHA256SUMS")["GM000000002.csv.gz"] == "0" * 64
+    
+    report = tasks.ingest_extract_station_data(url_template=station_server.url("/{station_id}.csv.gz"),
+                                               checksums="tmp/SHA256SUMS")
+    
+    assert report.succeeded == ["GM000000001"]
+    assert list(report.failed) == ["GM000000002"]
+
+
+def test_station_archive_framing_is_checked(tasks, workdir, station_server):
+    station_server.files[PATH] = BODY
+    station_server.files["/GM000000002.csv.gz"] = b"<html>maintenance</html>"
+    url_template = station_server.url("/{station_id}.csv.gz")
+    
+    tasks._download_station("GM000000001", url_template, None, decompress=False)
+    with pytest.raises(IOError, match="not a gzip file"):
+        tasks._download_station("GM000000002", url_template, None, decompress=False)
+
+
+def test_station_extraction_writes_the_manifest_once(tasks, db_handler, station_server, monkeypatch):
+    station_ids = [f"GM00000000{i}" for i in range(1, 7)]
+    for station_id in station_ids:
+        station_server.files[f"/{station_id}.csv.gz"] = station_file(station_id)
+    db_handler.execute_query("CREATE TABLE stations (id VARCHAR, latitude REAL, longitude REAL);")
+    db_handler.execute_query("INSERT INTO stations (id) VALUES " + ", ".join(f"('{s}')" for s in station_ids))
+    saves = []
+    save = DownloadManifest._save
+    monkeypatch.setattr(DownloadManifest, "_save", lambda self: saves.append(self.path) or save(self))
+    
+    report = tasks.ingest_extract_station_data(url_template=station_server.url("/{station_id}.csv.gz"))
+    
+    assert sorted(report.succeeded) == station_ids
+    assert len(saves) == 1
+    manifest = DownloadManifest.cached(tasks.EXTRACT_MANIFEST)
+    assert all(manifest.entry(station_server.url(f"/{s}.csv.gz"))["status"] == DOWNLOADED for s in station_ids)
+
+
+def test_cached_manifest_is_read_again_once_changed(workdir):
+    DownloadManifest("tmp/manifest.json").update("http://a", status=DOWNLOADED)
+    
+    cached = DownloadManifest.cached("tmp/manifest.json")
+    assert DownloadManifest.cached("tmp/manifest.json") is cached
+    
+    DownloadManifest("tmp/manifest.json").update("http://b", status=NOT_MODIFIED)
+    assert DownloadManifest.cached("tmp/manifest.json").is_unchanged("http://b")
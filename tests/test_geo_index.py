@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from weather_pipeline.transform import geo_index
+from weather_pipeline.transform.geo_index import GeoIndex, haversine_km
+
+
+@pytest.mark.parametrize("kd_tree", [True, False], ids=["kd-tree", "brute-force"])
+def test_nearest_stations_match_the_haversine_ranking(monkeypatch, kd_tree):
+    if not kd_tree:
+        monkeypatch.setattr(geo_index, "cKDTree", None)
+    rng = np.random.default_rng(0)
+    station_lats, station_lons = rng.uniform(-90, 90, 500), rng.uniform(-180, 180, 500)
+    # the nearest stations of the last city are across the antimeridian
+    city_lats = np.append(rng.uniform(-90, 90, 50), 0.0)
+    city_lons = np.append(rng.uniform(-180, 180, 50), 179.9)
+    station_lats[:2], station_lons[:2] = 0.0, [-179.95, 179.5]
+    index = GeoIndex([f"S{i:03d}" for i in range(500)], station_lats, station_lons)
+    
+    distances, ids = index.query(city_lats, city_lons, k=3)
+    
+    matrix = haversine_km(city_lats[:, None], city_lons[:, None], station_lats, station_lons)
+    expected = np.argsort(matrix, axis=1)[:, :3]
+    assert (ids == index.ids[expected]).all()
+    assert distances == pytest.approx(np.take_along_axis(matrix, expected, axis=1))
+    assert list(ids[-1, :2]) == ["S000", "S001"]
+
+
+def test_table_index_is_cached_until_the_table_changes(db_handler, monkeypatch):
+    db_handler.execute_batch([
+        "CREATE TABLE stations (id VARCHAR, latitude REAL, longitude REAL);",
+        "INSERT INTO stations VALUES ('GM01', 52.5, 13.4), ('FR01', 48.9, 2.4), ('XX01', NULL, NULL);",
+    ])
+    built = []
+    init = GeoIndex.__init__
+    monkeypatch.setattr(GeoIndex, "__init__", lambda self, *args, **kwargs: 
+                        built.append(args[0]) or init(self, *args, **kwargs))
+    
+    index = GeoIndex.from_table(db_handler, "stations", cache_dir="tmp/geo_index")
+    assert sorted(index.ids) == ["FR01", "GM01"]
+    assert index.nearest([51.0], [10.0])[1][0] == "GM01"
+    
+    GeoIndex.from_table(db_handler, "stations", cache_dir="tmp/geo_index")
+    assert len(built) == 1
+    
+    db_handler.execute_query("INSERT INTO stations VALUES ('GM02', 51.0, 10.1);")
+    assert GeoIndex.from_table(db_handler, "stations", cache_dir="tmp/geo_index").nearest([51.0], [10.0])[1][0] == "GM02"
+    assert len(built) == 2
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from weather_pipeline.load import Loader
+
+COLUMNS = [("id", "VARCHAR"), ("name", "VARCHAR"), ("value", "REAL")]
+
+# separators, quotes, newlines and missing values of the station / city metadata
+ROWS = [("GM000000001", "Berlin, Tempelhof", 1.5), ("US000000002", 'New "York"', None),
+        ("FR000000003", "multi\nline", -2.0), ("IT000000004", None, 0.0)]
+
+
+def _table(db_handler, table):
+    return sorted(tuple(row) for row in db_handler.execute_query(f"SELECT id, name, value FROM {table};"))
+
+
+def test_copy_loads_the_rows_an_insert_loads(db_handler):
+    loader = Loader(db_handler)
+    
+    assert loader.load_list_to_db(ROWS, "copied", COLUMNS, method="copy") == len(ROWS)
+    loader.load_list_to_db(ROWS, "inserted", COLUMNS, method="insert")
+    
+    assert _table(db_handler, "copied") == _table(db_handler, "inserted") == sorted(ROWS, key=lambda row: row[0])
+
+
+def test_copy_loads_missing_values_of_a_frame_as_null(db_handler):
+    data = pd.DataFrame({"id": ["GM000000001", "US000000002"], "name": ["a,b", None], "value": [1.5, np.nan]})
+    
+    Loader(db_handler).load_csv_to_db(data, "copied", COLUMNS, method="copy")
+    
+    assert _table(db_handler, "copied") == [("GM000000001", "a,b", 1.5), ("US000000002", None, None)]
+
+
+@pytest.mark.parametrize("method", ["copy", "insert"])
+def test_upsert_keeps_one_row_per_key(db_handler, method):
+    loader = Loader(db_handler)
+    
+    loader.load_list_to_db(ROWS, "stations", COLUMNS, method=method, key_columns=["id"])
+    loader.load_list_to_db([("GM000000001", "Berlin", 3.0)], "stations", COLUMNS, method=method, key_columns=["id"])
+    
+    rows = _table(db_handler, "stations")
+    assert len(rows) == len(ROWS) and ("GM000000001", "Berlin", 3.0) in rows
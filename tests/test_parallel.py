@@ -0,0 +1,34 @@
+import os
+
+from weather_pipeline.load import parallel
+
+from conftest import TEST_DB_CONFIG, TEST_DB_HOST
+
+BACKEND_PID = "SELECT pg_backend_pid()"
+
+
+def test_forked_worker_does_not_reuse_the_parent_connections(db_handler):
+    # a single pooled connection, the one the parent checks out again below
+    db_handler.engine.dispose()
+    parent_pid = db_handler.execute_query(BACKEND_PID).scalar()
+    read_fd, write_fd = os.pipe()
+    
+    child = os.fork()
+    if child == 0:
+        try:
+            parallel._init_worker(TEST_DB_CONFIG, TEST_DB_HOST)
+            # the pool of the inherited handler starts over as well
+            pids = {db_handler.execute_query(BACKEND_PID).scalar(),
+                    parallel._worker_loader.db_handler.execute_query(BACKEND_PID).scalar()}
+            os.write(write_fd, ",".join(map(str, pids)).encode())
+        finally:
+            os._exit(0)
+    
+    os.close(write_fd)
+    with os.fdopen(read_fd) as pipe:
+        child_pids = pipe.read()
+    os.waitpid(child, 0)
+    
+    assert child_pids and str(parent_pid) not in child_pids.split(",")
+    # the connection of the parent is still open and usable
+    assert db_handler.execute_query(BACKEND_PID).scalar() == parent_pid
@@ -0,0 +1,49 @@
+from weather_pipeline.db_handler import DbHandler
+from weather_pipeline.profiling import QueryProfiler
+from weather_pipeline.transform import Transform
+
+from conftest import TEST_DB_CONFIG, TEST_DB_HOST
+
+PARAMS = dict(table="TMAX", start_year=2000, end_year=2000)
+
+
+def _profiled_handler(db_handler, tmp_path):
+    db_handler.execute_batch(["CREATE TABLE tmax (station_id VARCHAR, date DATE, value REAL);",
+                              """INSERT INTO tmax SELECT 'GM00000000' || s, DATE '2000-01-01' + d, d
+                                 FROM generate_series(1, 3) s, generate_series(0, 99) d;"""])
+    handler = DbHandler(config_file=TEST_DB_CONFIG, host=TEST_DB_HOST)
+    handler.profiler = QueryProfiler(explain=True, sink="file", path=tmp_path / "profiles.jsonl")
+    return handler
+
+
+def test_every_report_entry_point_is_profiled_by_template(db_handler, tmp_path):
+    handler = _profiled_handler(db_handler, tmp_path)
+    transform = Transform(handler, summaries=False, cache=False)
+    
+    transform.run("monthly_avg_by_station", **PARAMS)
+    assert len(list(transform.stream("monthly_avg_by_station", chunk_size=7, **PARAMS))) == 12
+    assert transform.export("monthly_avg_by_station", tmp_path / "report.csv", **PARAMS) == 12
+    assert transform.export("monthly_avg_by_station", tmp_path / "report.ndjson", format="ndjson", **PARAMS) == 12
+    handler.execute_batch(["UPDATE tmax SET value = value + 1 WHERE value < 10;"])
+    
+    records = [record for record in handler.profiler.load() if record["template"] == "monthly_avg_by_station"]
+    assert len(records) == 4
+    for record in records:
+        assert record["rows"] == 12
+        assert record["params"] == PARAMS
+        assert record["plan_signature"] is not None
+    batch = [record for record in handler.profiler.load() if record["template"] is None and record["rows"] == 30]
+    assert batch and batch[0]["plan"] is None
+
+
+def test_run_id_is_read_when_the_statement_runs(db_handler, tmp_path, monkeypatch):
+    handler = _profiled_handler(db_handler, tmp_path)
+    # Airflow only exports the run once the task executes, after the DAG (and the handler) was imported
+    monkeypatch.setenv("AIRFLOW_CTX_DAG_RUN_ID", "scheduled__2024-01-01")
+    handler.execute_query("SELECT count(*) FROM tmax;")
+    monkeypatch.setenv("AIRFLOW_CTX_DAG_RUN_ID", "scheduled__2024-01-02")
+    handler.execute_query("SELECT count(*) FROM tmax;")
+    
+    assert len(handler.profiler.load("scheduled__2024-01-01")) == 1
+    assert len(handler.profiler.load("scheduled__2024-01-02")) == 1
+    assert handler.profiler.compare("scheduled__2024-01-01", slowdown=1000) == []
@@ -0,0 +1,16 @@
+from weather_pipeline.transform.result_cache import ResultCache
+
+
+def test_memory_lru_is_bounded_in_bytes(workdir):
+    cache = ResultCache(max_entries=10, cache_dir="tmp/result_cache", max_memory_bytes=3000)
+    
+    for key in ("a", "b", "c"):
+        cache.put(key, b"x" * 1000)
+    cache.put("big", b"x" * 5000)
+    
+    stats = cache.stats()
+    # "a" evicted for "c", "big" never held in memory but still cached on disk
+    assert stats["memory_entries"] == 2 and stats["memory_bytes"] <= 3000
+    assert cache.get("big") == b"x" * 5000
+    assert cache.get("a") == b"x" * 1000
+    assert cache.stats()["disk_hits"] == 2
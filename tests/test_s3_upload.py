@@ -0,0 +1,114 @@
+import io
+import os
+
+import pytest
+
+boto3 = pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+
+from aws_tasks.s3_upload import MIN_PART_SIZE, s3_multipart_upload
+
+BUCKET = "test-bucket"
+
+DATA = os.urandom(2 * MIN_PART_SIZE + 12345)
+
+
+class ShortReader(io.RawIOBase):
+    """Binary file-like returning at most `max_read` bytes per read, like a socket or a pipe."""
+
+    def __init__(self, data, max_read) -> None:
+        self._data = io.BytesIO(data)
+        self._max_read = max_read
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        return self._data.read(min(size, self._max_read) if size >= 0 else self._max_read)
+
+
+class FailingPart:
+    """S3 client whose upload of `part_number` always fails."""
+
+    def __init__(self, s3, part_number) -> None:
+        self._s3 = s3
+        self._part_number = part_number
+        self.attempts = 0
+
+    def __getattr__(self, name):
+        return getattr(self._s3, name)
+
+    def upload_part(self, **kwargs):
+        if kwargs["PartNumber"] == self._part_number:
+            self.attempts += 1
+            raise ConnectionError("connection reset")
+        return self._s3.upload_part(**kwargs)
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    for name, value in [("AWS_ACCESS_KEY_ID", "testing"), ("AWS_SECRET_ACCESS_KEY", "testing"),
+                        ("AWS_DEFAULT_REGION", "us-east-1")]:
+        monkeypatch.setenv(name, value)
+    with moto.mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def _body(s3, key):
+    return s3.get_object(Bucket=BUCKET, Key=key)["Body"].read()
+
+
+def _write(path):
+    path.write_bytes(DATA)
+    return str(path)
+
+
+def _small_chunks(data, size=64 * 1024):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+@pytest.mark.parametrize("make_source", [
+    pytest.param(lambda tmp_path: _write(tmp_path / "data.bin"), id="path"),
+    pytest.param(lambda tmp_path: ShortReader(DATA, max_read=1024 * 1024), id="short-reads"),
+    pytest.param(lambda tmp_path: _small_chunks(DATA), id="generator"),
+])
+def test_multipart_upload(s3, tmp_path, make_source):
+    response = s3_multipart_upload(make_source(tmp_path), BUCKET, "data.bin", part_size=MIN_PART_SIZE,
+                                   max_workers=2, s3=s3)
+    
+    assert response["ResponseMetadata"]["HTTPStatusCode"] == 200
+    assert _body(s3, "data.bin") == DATA
+    assert not s3.list_multipart_uploads(Bucket=BUCKET).get("Uploads")
+
+
+def test_keyword_file_path(s3, tmp_path):
+    s3_multipart_upload(file_path=_write(tmp_path / "data.bin"), bucket_name=BUCKET, object_key="data.bin",
+                        part_size=MIN_PART_SIZE, s3=s3)
+    
+    assert _body(s3, "data.bin") == DATA
+
+
+def test_single_part_upload(s3):
+    s3_multipart_upload(io.BytesIO(b"small"), BUCKET, "small.bin", s3=s3)
+    
+    assert _body(s3, "small.bin") == b"small"
+
+
+def test_failing_part_aborts_upload(s3):
+    client = FailingPart(s3, part_number=2)
+    
+    with pytest.raises(ConnectionError):
+        s3_multipart_upload(_small_chunks(DATA), BUCKET, "data.bin", part_size=MIN_PART_SIZE, retries=2,
+                            backoff=0, s3=client)
+    
+    assert client.attempts == 3
+    assert not s3.list_multipart_uploads(Bucket=BUCKET).get("Uploads")
+    assert "Contents" not in s3.list_objects_v2(Bucket=BUCKET)
+
+
+def test_part_size_below_s3_minimum(s3):
+    with pytest.raises(ValueError):
+        s3_multipart_upload(io.BytesIO(DATA), BUCKET, "data.bin", part_size=MIN_PART_SIZE - 1, s3=s3)
@@ -0,0 +1,33 @@
+import pandas as pd
+
+from weather_pipeline.load.station_reader import read_station_chunks
+
+from conftest import station_file
+
+
+def _write(path, *bodies):
+    # gzip members read back to back, one per element
+    path.write_bytes(b"".join(bodies))
+    return str(path)
+
+
+def test_station_file_is_parsed_chunk_by_chunk(workdir):
+    path = _write(workdir / "GM000000001.csv.gz", station_file("GM000000001", days=10))
+    
+    chunks = list(read_station_chunks(path, chunksize=3, columns=["ID", "DATE", "DATA_VALUE"]))
+    
+    assert [len(chunk) for chunk in chunks] == [3, 3, 3, 1]
+    assert list(chunks[0].columns) == ["ID", "DATE", "DATA_VALUE"]
+    assert chunks[0]["DATE"].iloc[0] == pd.Timestamp("1990-01-01")
+    assert str(chunks[0]["ID"].dtype) == "category" and str(chunks[0]["DATA_VALUE"].dtype) == "int32"
+
+
+def test_only_the_requested_elements_are_kept(workdir):
+    path = _write(workdir / "GM000000001.csv.gz", station_file("GM000000001", days=4, element="TMAX"),
+                  station_file("GM000000001", days=6, element="PRCP"), station_file("GM000000001", days=2, element="TMIN"))
+    
+    chunks = list(read_station_chunks(path, chunksize=4, columns=["ID", "DATE", "DATA_VALUE"], elements=["TMAX", "TMIN"]))
+    
+    # the chunk of PRCP rows only is not yielded, ELEMENT is parsed for the filter but not returned
+    assert [len(chunk) for chunk in chunks] == [4, 2]
+    assert list(chunks[1].columns) == ["ID", "DATE", "DATA_VALUE"]
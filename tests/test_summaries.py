@@ -0,0 +1,107 @@
+import decimal
+
+import pytest
+
+from weather_pipeline.load import Loader
+from weather_pipeline.load.watermarks import WatermarkStore
+from weather_pipeline.transform import Transform
+from weather_pipeline.transform.summaries import SummaryRegistry, ROLLUP_TABLE
+
+from conftest import station_file
+
+STATION_IDS = ["GM000000001", "GM000000002"]
+
+SERVED = [
+    ("monthly_avg_by_station", dict(table="TMAX", start_year=1990, end_year=2000)),
+    ("monthly_temp_variation", {}),
+    ("yearly_max_by_station", {}),
+]
+
+
+def _rows(result):
+    def value(column):
+        return float(column) if isinstance(column, (int, float, decimal.Decimal)) else column
+    return sorted(tuple(value(column) for column in row) for row in result)
+
+
+def _assert_cube_matches_raw(db_handler):
+    cube = Transform(db_handler, summaries=True, cache=False)
+    raw = Transform(db_handler, summaries=False, cache=False)
+    for query_name, kwargs in SERVED:
+        assert ROLLUP_TABLE in cube.query(query_name, **kwargs)
+        
+        served, expected = _rows(cube.run(query_name, **kwargs)), _rows(raw.run(query_name, **kwargs))
+        
+        assert expected, query_name
+        assert [row[:-1] for row in served] == [row[:-1] for row in expected], query_name
+        assert [row[-1] for row in served] == pytest.approx([row[-1] for row in expected]), query_name
+
+
+def _load_station_storage(tasks, db_handler, start, days):
+    # 'station' storage: one table per station, TMAX is only written by the dimension build
+    for i, station_id in enumerate(STATION_IDS):
+        path = f"tmp/{station_id}.csv.gz"
+        with open(path, "wb") as fp:
+            fp.write(station_file(station_id, start=start, days=days, value=100 * i))
+        tasks._load_station_chunks(Loader(db_handler), station_id, path, storage="station", incremental=True)
+
+
+def test_cube_follows_incremental_station_storage_loads(tasks, db_handler, monkeypatch):
+    monkeypatch.setattr(tasks, "STATION_STORAGE", "station")
+    db_handler.execute_query("CREATE TABLE stations (id VARCHAR, latitude REAL, longitude REAL);")
+    db_handler.execute_query("INSERT INTO stations (id) VALUES " +
+                             ", ".join(f"('{station_id}')" for station_id in STATION_IDS))
+    WatermarkStore(db_handler).create()
+    SummaryRegistry(db_handler).create()
+    
+    _load_station_storage(tasks, db_handler, start="1995-01-01", days=4 * 365)
+    tasks.transform_create_dimention_tables(mode="SQL", incremental=True)
+    _assert_cube_matches_raw(db_handler)
+    
+    # incremental load of 1999 - 2000, a report runs before the dimension build
+    _load_station_storage(tasks, db_handler, start="1995-01-01", days=6 * 365)
+    Transform(db_handler, cache=False).run("yearly_max_by_station")
+    tasks.transform_create_dimention_tables(mode="SQL", incremental=True)
+    
+    _assert_cube_matches_raw(db_handler)
+    assert max(row[1] for row in Transform(db_handler, cache=False).run("yearly_max_by_station")) == 2000
+
+
+def test_cube_follows_incremental_element_storage_loads(tasks, db_handler):
+    WatermarkStore(db_handler).create()
+    SummaryRegistry(db_handler).create()
+    
+    for days in (4 * 365, 6 * 365):
+        for i, station_id in enumerate(STATION_IDS):
+            path = f"tmp/{station_id}.csv.gz"
+            with open(path, "wb") as fp:
+                fp.write(station_file(station_id, start="1995-01-01", days=days, value=100 * i))
+            tasks._load_station_chunks(Loader(db_handler), station_id, path, storage="element", incremental=True)
+        tasks.transform_refresh_summaries(elements=["TMAX"])
+        
+        _assert_cube_matches_raw(db_handler)
+
+
+def test_rollup_refresh_only_rebuilds_the_dirty_partitions(tasks, db_handler):
+    WatermarkStore(db_handler).create()
+    registry = SummaryRegistry(db_handler)
+    registry.create()
+    
+    def load(station_id, days):
+        path = f"tmp/{station_id}.csv.gz"
+        with open(path, "wb") as fp:
+            fp.write(station_file(station_id, start="1995-01-01", days=days))
+        tasks._load_station_chunks(Loader(db_handler), station_id, path, storage="element", incremental=True)
+    
+    for station_id in STATION_IDS:
+        load(station_id, 365 + 366)
+    assert registry.refresh_rollup("TMAX") == 2 * 24
+    
+    # 1997 of the first station
+    load(STATION_IDS[0], 2 * 365 + 366)
+    assert not registry.is_rollup_fresh("TMAX")
+    assert registry.query("yearly_max_by_station", auto_refresh=False) is None
+    
+    assert registry.refresh_rollup("TMAX") == 12
+    assert registry.is_rollup_fresh("TMAX")
+    _assert_cube_matches_raw(db_handler)
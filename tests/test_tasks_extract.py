@@ -0,0 +1,56 @@
+import os
+
+from conftest import station_file
+
+STATION_IDS = ["GM000000001", "GM000000002", "GM000000003"]
+
+
+def _create_stations(db_handler, station_ids):
+    db_handler.execute_query("CREATE TABLE stations (id VARCHAR, latitude REAL, longitude REAL, "
+                             "elevation REAL, name VARCHAR);")
+    db_handler.execute_query("INSERT INTO stations (id, latitude, longitude) VALUES " +
+                             ", ".join(f"('{station_id}', 50.0, 10.0)" for station_id in station_ids))
+
+
+def test_failed_station_is_kept_and_retried_by_the_same_run(tasks, db_handler, station_server):
+    _create_stations(db_handler, STATION_IDS)
+    for station_id in STATION_IDS:
+        station_server.files[f"/{station_id}.csv.gz"] = station_file(station_id)
+    station_server.errors["/GM000000003.csv.gz"] = 404
+    url_template = station_server.url("/{station_id}.csv.gz")
+    
+    report = tasks.ingest_extract_station_data(url_template=url_template, run_id="run-1")
+    
+    assert sorted(report.succeeded) == ["GM000000001", "GM000000002"]
+    assert list(report.failed) == ["GM000000003"]
+    assert sorted(row[0] for row in db_handler.execute_query("SELECT id FROM stations;")) == STATION_IDS
+    
+    # the retry of the run only downloads the failed station
+    del station_server.errors["/GM000000003.csv.gz"]
+    station_server.requests.clear()
+    report = tasks.ingest_extract_station_data(url_template=url_template, run_id="run-1")
+    
+    assert station_server.requests == ["/GM000000003.csv.gz"]
+    assert report.succeeded == ["GM000000003"]
+    assert sorted(report.skipped) == ["GM000000001", "GM000000002"]
+    assert not report.failed
+    assert os.path.exists("tmp/GM000000003.csv.gz")
+
+
+def test_failed_station_is_not_retried_once_unlisted(tasks, db_handler, station_server):
+    _create_stations(db_handler, STATION_IDS)
+    for station_id in STATION_IDS:
+        station_server.files[f"/{station_id}.csv.gz"] = station_file(station_id)
+    station_server.errors["/GM000000003.csv.gz"] = 404
+    url_template = station_server.url("/{station_id}.csv.gz")
+    
+    tasks.ingest_extract_station_data(url_template=url_template, run_id="run-1")
+    # the load reads the stations table, an unlisted station would be downloaded for nothing
+    db_handler.execute_query("DELETE FROM stations WHERE id = 'GM000000003';")
+    del station_server.errors["/GM000000003.csv.gz"]
+    station_server.requests.clear()
+    
+    report = tasks.ingest_extract_station_data(url_template=url_template, run_id="run-2")
+    
+    assert "/GM000000003.csv.gz" not in station_server.requests
+    assert "GM000000003" not in report.succeeded
@@ -0,0 +1,177 @@
+import functools
+
+import pandas as pd
+import pytest
+
+from weather_pipeline.checkpoints import CheckpointStore
+from weather_pipeline.extract.manifest import DownloadManifest, NOT_MODIFIED
+from weather_pipeline.load import Loader
+from weather_pipeline.load.watermarks import WatermarkStore
+from weather_pipeline.transform import Transform
+from weather_pipeline.transform.summaries import SummaryRegistry
+
+from conftest import station_file
+
+
+def _cities(db_handler):
+    return sorted(row[0] for row in db_handler.execute_query("SELECT city FROM cities;"))
+
+
+def test_unchanged_cities_are_loaded_again_after_a_failed_load(tasks, db_handler, monkeypatch):
+    with open("tmp/cities.csv", "w") as fp:
+        fp.write("city,lat,lng\nBerlin,52.52,13.40\nMunich,48.14,11.58\n")
+    # the last extraction found the file not modified
+    DownloadManifest(tasks.EXTRACT_MANIFEST).update(tasks.cities_csv_url, status=NOT_MODIFIED, checksum="c1")
+    
+    def interrupted(*args, **kwargs):
+        raise ConnectionError("server closed the connection unexpectedly")
+    with monkeypatch.context() as patch:
+        patch.setattr(Loader, "load_csv_to_db", interrupted)
+        with pytest.raises(ConnectionError):
+            tasks.ingest_load_cities()
+    assert CheckpointStore(db_handler).failed(tasks.LOAD_CITIES_TASK) == [tasks.cities_csv_url]
+    
+    tasks.ingest_load_cities()
+    assert _cities(db_handler) == ["Berlin", "Munich"]
+    
+    # completed for this content: skipped from now on
+    db_handler.execute_query("DELETE FROM cities;")
+    tasks.ingest_load_cities()
+    assert _cities(db_handler) == []
+
+
+def _create_stores(db_handler):
+    WatermarkStore(db_handler).create()
+    SummaryRegistry(db_handler).create()
+
+
+def _write_station(station_id, **kwargs):
+    path = f"tmp/{station_id}.csv.gz"
+    with open(path, "wb") as fp:
+        fp.write(station_file(station_id, **kwargs))
+    return path
+
+
+def test_station_is_loaded_one_chunk_at_a_time(tasks, db_handler, monkeypatch):
+    _create_stores(db_handler)
+    loader = Loader(db_handler)
+    loaded = []
+    load_csv_to_db = loader.load_csv_to_db
+    monkeypatch.setattr(loader, "load_csv_to_db", lambda data, *args, **kwargs: 
+                        loaded.append(len(data)) or load_csv_to_db(data, *args, **kwargs))
+    
+    tasks._load_station_chunks(loader, "GM000000001", _write_station("GM000000001", days=10), chunksize=4,
+                               storage="element", incremental=False)
+    
+    assert loaded == [4, 4, 2]
+    assert db_handler.execute_query("SELECT count(*) FROM tmax;").scalar() == 10
+
+
+def test_observations_queries_only_scan_the_partitions_of_their_years(tasks, db_handler):
+    _create_stores(db_handler)
+    for station_id in ("GM000000001", "GM000000002"):
+        tasks._load_station_chunks(Loader(db_handler), station_id, 
+                                   _write_station(station_id, start="2000-01-01", days=3 * 366),
+                                   storage="observations", incremental=True)
+    Transform(db_handler, summaries=False).run("element_view_from_observations", element="TMAX")
+    
+    plan = "\n".join(row[0] for row in db_handler.execute_query("""EXPLAIN SELECT max(value) FROM tmax
+                                                                   WHERE date >= '2001-01-01'
+                                                                   AND date < '2002-01-01';"""))
+    
+    assert "observations_tmax_2001" in plan
+    assert not any(f"observations_tmax_{year}" in plan for year in (2000, 2002, 2003))
+    assert db_handler.execute_query("SELECT count(*) FROM observations_tmax_2001;").scalar() == 2 * 365
+
+
+def test_incremental_load_keys_a_table_created_without_primary_key(tasks, db_handler):
+    # TMAX as created by the full loads: no key, the same rows loaded twice
+    db_handler.execute_batch(["CREATE TABLE tmax (station_id VARCHAR, date DATE, value REAL);",
+                              """INSERT INTO tmax SELECT 'GM000000001', DATE '1990-01-01' + d, d
+                                 FROM generate_series(0, 4) d, generate_series(1, 2) copies;"""])
+    _create_stores(db_handler)
+    
+    path = _write_station("GM000000001", days=10)
+    tasks._load_station_chunks(Loader(db_handler), "GM000000001", path, storage="element", incremental=True)
+    
+    rows = list(db_handler.execute_query("SELECT date, value FROM tmax ORDER BY date;"))
+    assert len(rows) == 10
+    assert [value for _, value in rows] == [100 + i for i in range(10)]
+    assert db_handler.execute_query("""SELECT count(*) FROM pg_index 
+                                       WHERE indrelid = 'tmax'::regclass AND indisprimary;""").scalar() == 1
+
+
+def test_watermarks_are_kept_per_storage(tasks, db_handler):
+    _create_stores(db_handler)
+    path = _write_station("GM000000001", days=10)
+    
+    tasks._load_station_chunks(Loader(db_handler), "GM000000001", path, storage="element", incremental=True)
+    # switching storage loads the whole station again into the new one
+    tasks._load_station_chunks(Loader(db_handler), "GM000000001", path, storage="station", incremental=True)
+    
+    assert db_handler.execute_query("SELECT count(*) FROM gm000000001;").scalar() == 10
+    assert WatermarkStore(db_handler, storage="station").get("GM000000001") == \
+        WatermarkStore(db_handler, storage="element").get("GM000000001")
+
+
+def test_watermarks_of_earlier_loads_are_migrated(db_handler):
+    db_handler.execute_batch(["""CREATE TABLE load_watermarks (station_id VARCHAR, element VARCHAR, last_date DATE NOT NULL,
+                                     updated_at TIMESTAMP NOT NULL DEFAULT now(), PRIMARY KEY (station_id, element));""",
+                              "INSERT INTO load_watermarks VALUES ('GM000000001', 'TMAX', '2000-01-01');"])
+    
+    store = WatermarkStore(db_handler, storage="element")
+    store.create()
+    
+    assert store.get("GM000000001") == {}
+    store.advance("GM000000001", {"TMAX": pd.Timestamp("2001-01-01")})
+    assert store.get("GM000000001") == {"TMAX": pd.Timestamp("2001-01-01")}
+
+
+def test_sql_dimension_build_reads_the_station_tables_in_batches(tasks, db_handler, monkeypatch):
+    monkeypatch.setattr(tasks, "STATION_STORAGE", "station")
+    station_ids = [f"GM00000000{i}" for i in range(1, 6)]
+    db_handler.execute_query("CREATE TABLE stations (id VARCHAR, latitude REAL, longitude REAL);")
+    db_handler.execute_query("INSERT INTO stations (id) VALUES " + ", ".join(f"('{s}')" for s in station_ids))
+    _create_stores(db_handler)
+    for station_id in station_ids:
+        tasks._load_station_chunks(Loader(db_handler), station_id, _write_station(station_id, days=10), 
+                                   storage="station", incremental=True)
+    
+    batches = []
+    execute_batch = db_handler.execute_batch
+    def spy(queries):
+        batches.append(list(queries))
+        return execute_batch(queries)
+    monkeypatch.setattr(db_handler, "execute_batch", spy)
+    
+    tasks.transform_create_dimention_tables(mode="SQL", incremental=False, batch_size=2)
+    
+    build = next(queries for queries in batches if any(query.startswith("TRUNCATE TMAX") for query in queries))
+    inserts = [query for query in build if "INSERT INTO TMAX" in query]
+    assert [query.count("UNION ALL") + 1 for query in inserts] == [2, 2, 1]
+    assert db_handler.execute_query("SELECT count(*) FROM tmax;").scalar() == 50
+
+
+def test_unchanged_station_is_loaded_again_after_a_failed_load(tasks, db_handler, monkeypatch):
+    db_handler.execute_query("CREATE TABLE stations (id VARCHAR, latitude REAL, longitude REAL);")
+    db_handler.execute_query("INSERT INTO stations (id) VALUES ('GM000000001');")
+    _write_station("GM000000001", days=10)
+    url_template = "http://stations.test/{station_id}.csv.gz"
+    DownloadManifest(tasks.EXTRACT_MANIFEST).update(url_template.format(station_id="GM000000001"), 
+                                                    status=NOT_MODIFIED, checksum="c1")
+    load = functools.partial(tasks.ingest_load_station_data, mode="STREAM", processes=1, checkpoints=False,
+                             url_template=url_template)
+    
+    def interrupted(*args, **kwargs):
+        raise ConnectionError("server closed the connection unexpectedly")
+    with monkeypatch.context() as patch:
+        patch.setattr(tasks, "_load_station_chunks", interrupted)
+        assert list(load().failed) == ["GM000000001"]
+    
+    assert load().succeeded == ["GM000000001"]
+    assert load().skipped == ["GM000000001"]
+
+
+def test_dms_load_mode_is_refused(tasks, db_handler):
+    with pytest.raises(NotImplementedError):
+        tasks.ingest_load_station_data(mode="DMS")
@@ -0,0 +1,105 @@
+import json
+import time
+
+import pandas as pd
+import pytest
+
+from weather_pipeline.load import Loader
+from weather_pipeline.transform import Transform, sql_queries
+from weather_pipeline.transform.export import export_ndjson
+
+
+def _create_tables(db_handler):
+    db_handler.execute_batch([
+        "CREATE TABLE cities (city VARCHAR PRIMARY KEY, latitude REAL, longitude REAL);",
+        "CREATE TABLE stations (id VARCHAR, latitude REAL, longitude REAL, elevation REAL, name VARCHAR);",
+        "CREATE TABLE tmax (station_id VARCHAR, date DATE, value REAL, PRIMARY KEY (station_id, date));",
+    ])
+
+
+def _nearest(db_handler, city):
+    return [row[0] for row in db_handler.execute_query(f"""SELECT station_id FROM city_nearest_stations
+                                                            WHERE city = '{city}' ORDER BY station_rank;""")]
+
+
+def test_city_nearest_stations_only_ranks_stations_reporting_tmax(tasks, db_handler):
+    _create_tables(db_handler)
+    db_handler.execute_batch([
+        "INSERT INTO cities VALUES ('Berlin', 52.5, 13.4);",
+        # GM00 is the closest station but has no TMAX rows
+        "INSERT INTO stations (id, latitude, longitude) VALUES " +
+        ", ".join(f"('GM{i:02d}', {52.5 + i * 0.1}, 13.4)" for i in range(8)) + ";",
+        "INSERT INTO tmax VALUES " + ", ".join(f"('GM{i:02d}', DATE '2000-01-01', {i})" for i in range(1, 8)) + ";",
+    ])
+    
+    assert tasks.transform_city_nearest_stations(k=5)
+    assert _nearest(db_handler, "Berlin") == ["GM01", "GM02", "GM03", "GM04", "GM05"]
+    
+    # nothing changed
+    assert not tasks.transform_city_nearest_stations(k=5)
+    
+    # a station starting to report TMAX changes the candidates
+    db_handler.execute_query("INSERT INTO tmax VALUES ('GM00', DATE '2000-01-01', 0);")
+    assert tasks.transform_city_nearest_stations(k=5)
+    assert _nearest(db_handler, "Berlin") == ["GM00", "GM01", "GM02", "GM03", "GM04"]
+
+
+@pytest.mark.parametrize("primary_key", [None, ["station_ID", "DATE"]], ids=["full-load", "incremental"])
+@pytest.mark.parametrize("query_name, kwargs", [
+    ("monthly_avg_by_station", dict(table="TMAX", start_year=1990, end_year=2000)),
+    ("monthly_temp_variation", {}),
+    ("temp_trends_by_station", {}),
+])
+def test_date_range_templates_use_the_date_index(tasks, db_handler, query_name, kwargs, primary_key):
+    Loader(db_handler).create_table_if_not_exists("TMAX", tasks.DIMENSION_COL_TYPES, primary_key=primary_key)
+    # five stations over 1900 - 2020, loaded like the pipeline does: station by station, each its whole history
+    db_handler.execute_query("""INSERT INTO tmax
+                                SELECT 'GM' || lpad(s::text, 9, '0'), d::date, random() * 300
+                                FROM generate_series(DATE '1900-01-01', DATE '2020-12-31', interval '1 day') d,
+                                     generate_series(1, 5) s
+                                ORDER BY s, d;""")
+    Loader(db_handler).create_indexes("TMAX", tasks.DIMENSION_INDEXES, primary_key=primary_key)
+    db_handler.execute_query("ANALYZE tmax;")
+    
+    # the raw template, not its rollup
+    plan = Transform(db_handler, summaries=False, cache=False).explain(query_name, analyze=True, **kwargs)
+    
+    assert "Seq Scan" not in plan
+    assert "Bitmap Index Scan on tmax_date_btree" in plan or "Index Scan using tmax_date_btree" in plan
+    # only the pages of the date range are read, a BRIN over interleaved stations reads them all
+    assert "Rows Removed by Index Recheck" not in plan
+
+
+def test_ndjson_chunks_end_their_last_line(db_handler, workdir, monkeypatch):
+    to_json = pd.DataFrame.to_json
+    # as written by the pandas versions without a newline after the last row
+    monkeypatch.setattr(pd.DataFrame, "to_json", lambda df, *args, **kwargs: to_json(df, *args, **kwargs).rstrip("\n"))
+    
+    assert export_ndjson(db_handler, "SELECT n FROM generate_series(1, 5) AS n", workdir / "rows.ndjson",
+                         chunk_size=2) == 5
+    
+    lines = (workdir / "rows.ndjson").read_text().splitlines()
+    assert [json.loads(line) for line in lines] == [{"n": n} for n in range(1, 6)]
+
+
+def test_batch_queries_run_concurrently(db_handler, monkeypatch):
+    monkeypatch.setattr(sql_queries, "sleepy", "SELECT {n} AS n FROM pg_sleep({seconds})", raising=False)
+    transform = Transform(db_handler, summaries=False)
+    assert list(transform.run("sleepy", n=0, seconds=0)) == [(0,)]
+    queries = [("sleepy", dict(n=n, seconds=1)) for n in range(1, 4)] + [("sleepy", dict(n=0, seconds=0))]
+    
+    start = time.perf_counter()
+    results = [(kwargs, list(result)) for _, kwargs, result in transform.run_batch(queries, max_workers=3)]
+    elapsed = time.perf_counter() - start
+    
+    # the cached result first, then the three sleeps side by side
+    assert results[0] == (dict(n=0, seconds=0), [(0,)])
+    assert sorted(rows[0][0] for _, rows in results[1:]) == [1, 2, 3]
+    assert elapsed < 2
+
+
+def test_failing_batch_query_raises(db_handler):
+    transform = Transform(db_handler, summaries=False)
+    
+    with pytest.raises(Exception, match="tmax"):
+        list(transform.run_batch([("yearly_max_by_station", {})]))
@@ -0,0 +1,77 @@
+import pandas as pd
+import pytest
+
+from weather_pipeline.db_handler import DbHandler
+from weather_pipeline.load import Loader
+from weather_pipeline.load.versions import DataVersions
+from weather_pipeline.transform import Transform
+
+from conftest import TEST_DB_CONFIG, TEST_DB_HOST
+
+COLUMNS = [("station_ID", "VARCHAR"), ("DATE", "DATE"), ("value", "REAL")]
+
+
+def _rows(value, dates=("2000-01-01", "2000-01-02")):
+    return pd.DataFrame({"station_ID": "GM000000001", "DATE": pd.to_datetime(list(dates)), "value": value})
+
+
+def test_loads_bump_the_version_of_their_table(db_handler):
+    versions = DataVersions(db_handler)
+    assert versions.get(["TMAX"]) == {"tmax": "0"}
+    
+    Loader(db_handler).load_csv_to_db(_rows(1.0), "TMAX", COLUMNS, method="copy", key_columns=["station_ID", "DATE"])
+    first = versions.get(["TMAX"])["tmax"]
+    Loader(db_handler).load_csv_to_db(_rows(2.0), "TMAX", COLUMNS, method="copy", key_columns=["station_ID", "DATE"])
+    second = versions.get(["TMAX"])["tmax"]
+    
+    assert first != "0" and second != first
+    assert first.split()[0] == second.split()[0]
+
+
+def test_failed_load_keeps_the_version(db_handler):
+    loader = Loader(db_handler)
+    loader.load_csv_to_db(_rows(1.0), "TMAX", COLUMNS, method="copy")
+    before = loader.versions.get(["TMAX"])
+    
+    with pytest.raises(Exception):
+        loader.load_csv_to_db(_rows("not a number"), "TMAX", COLUMNS, method="copy")
+    
+    assert loader.versions.get(["TMAX"]) == before
+
+
+def test_cached_results_follow_the_loads_of_other_processes(db_handler):
+    loader = Loader(db_handler)
+    loader.load_csv_to_db(_rows(1.0), "TMAX", COLUMNS, method="copy")
+    transform = Transform(db_handler, summaries=False)
+    assert len(list(transform.run("yearly_max_by_station"))) == 1
+    
+    # the handler of another process, sharing nothing but the database
+    other = DbHandler(config_file=TEST_DB_CONFIG, host=TEST_DB_HOST)
+    Loader(other).load_csv_to_db(_rows(5.0, dates=("2001-01-01",)), "TMAX", COLUMNS, method="copy")
+    
+    assert len(list(transform.run("yearly_max_by_station"))) == 2
+
+
+def test_versions_are_read_once_per_ttl(db_handler, monkeypatch):
+    Loader(db_handler).load_csv_to_db(_rows(1.0), "TMAX", COLUMNS, method="copy")
+    statements = []
+    execute_query = db_handler.execute_query
+    monkeypatch.setattr(db_handler, "execute_query", lambda query, *args, **kwargs:
+                        statements.append(query) or execute_query(query, *args, **kwargs))
+    
+    first = DataVersions(db_handler, ttl=60).get(["TMAX"])
+    assert DataVersions(db_handler, ttl=60).get(["TMAX"]) == first
+    assert len(statements) == 1 and "CREATE" not in statements[0]
+    
+    # the writes of the process are seen at once, the versions expire after the ttl
+    DataVersions(db_handler).bump("TMAX")
+    assert DataVersions(db_handler, ttl=60).get(["TMAX"]) != first
+    DataVersions(db_handler, ttl=0).get(["TMAX"])
+    assert len(statements) == 4
+
+
+def test_tables_are_the_relations_read(db_handler):
+    transform = Transform(db_handler, summaries=False)
+    
+    assert transform.tables("monthly_temp_variation") == ["tmax"]
+    assert transform.tables("avg_tmax_top5_stations_by_city") == ["cities", "city_nearest_stations", "tmax"]
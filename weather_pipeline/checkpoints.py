@@ -0,0 +1,95 @@
+from weather_pipeline.utils import _get_logger
+
+CHECKPOINTS_TABLE = "pipeline_checkpoints"
+
+# status of a (task, key) checkpoint
+DONE = "done"
+FAILED = "failed"
+
+
+class CheckpointStore:
+    """CheckpointStore
+
+    Completion record of the per-station work of the pipeline tasks,
+    kept in the `pipeline_checkpoints` table: one row per (task, key)
+    with the status of the last attempt, the hash of the content it
+    processed (e.g. the sha256 of the station file) and the run it
+    belongs to. A re-run (or an Airflow retry) skips the keys already
+    done for the same content and only redoes the failed or changed ones.
+
+    Methods:
+    -------
+    completed(task, run_id, key)
+    Returns {key: content_hash} of the keys done by the task, only
+    those done during `run_id` / the one `key` when given.
+
+    failed(task)
+    Returns the keys whose last attempt by the task failed.
+
+    is_done(completed, key, content_hash)
+    True when `key` is in `completed` with the same, known, content hash.
+
+    mark_done(task, key, content_hash, run_id)
+    Records the key as done for this content.
+
+    mark_failed(task, key, error, run_id)
+    Records the key as failed, it is picked up again by the next run.
+    """
+
+    def __init__(self, db_handler) -> None:
+        self.logger = _get_logger(name=__name__)
+        self.db_handler = db_handler
+
+    def create(self) -> None:
+        self.db_handler.execute_query(f"""CREATE TABLE IF NOT EXISTS {CHECKPOINTS_TABLE} (
+                                              task VARCHAR,
+                                              key VARCHAR,
+                                              status VARCHAR NOT NULL,
+                                              content_hash VARCHAR,
+                                              run_id VARCHAR,
+                                              error TEXT,
+                                              updated_at TIMESTAMP NOT NULL DEFAULT now(),
+                                              PRIMARY KEY (task, key));""")
+
+    def completed(self, task, run_id=None, key=None) -> dict:
+        run_filter = f"AND run_id = {self._literal(run_id)}" if run_id else ""
+        key_filter = f"AND key = {self._literal(key)}" if key is not None else ""
+        result = self.db_handler.execute_query(f"""SELECT key, content_hash FROM {CHECKPOINTS_TABLE}
+                                                   WHERE task = {self._literal(task)} AND status = '{DONE}' 
+                                                       {run_filter} {key_filter};""")
+        return {key: content_hash for key, content_hash in result}
+
+    def failed(self, task) -> list:
+        result = self.db_handler.execute_query(f"""SELECT key FROM {CHECKPOINTS_TABLE}
+                                                   WHERE task = {self._literal(task)} AND status = '{FAILED}'
+                                                   ORDER BY key;""")
+        return [row[0] for row in result]
+
+    @staticmethod
+    def is_done(completed, key, content_hash) -> bool:
+        # without a hash there is no telling whether the content changed
+        return content_hash is not None and completed.get(key) == content_hash
+
+    def mark_done(self, task, key, content_hash=None, run_id=None) -> None:
+        self._upsert(task, key, DONE, content_hash, run_id, error=None)
+
+    def mark_failed(self, task, key, error=None, run_id=None) -> None:
+        self._upsert(task, key, FAILED, None, run_id, error=str(error) if error is not None else None)
+
+    def _upsert(self, task, key, status, content_hash, run_id, error) -> None:
+        values = ", ".join(self._literal(value) for value in (task, key, status, content_hash, run_id, error))
+        self.db_handler.execute_query(f"""INSERT INTO {CHECKPOINTS_TABLE} (task, key, status, content_hash, run_id, error)
+                                          VALUES ({values})
+                                          ON CONFLICT (task, key) DO UPDATE
+                                          SET status = EXCLUDED.status,
+                                              content_hash = EXCLUDED.content_hash,
+                                              run_id = EXCLUDED.run_id,
+                                              error = EXCLUDED.error,
+                                              updated_at = now();""")
+
+    @staticmethod
+    def _literal(value) -> str:
+        if value is None:
+            return "NULL"
+        # error messages may quote sql, `%` is escaped for the DBAPI paramstyle
+        return "'" + str(value).replace("'", "''").replace("%", "%%") + "'"
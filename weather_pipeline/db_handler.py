@@ -1,14 +1,66 @@
 # db_handler.py
+import time
+import weakref
 from contextlib import contextmanager
 # from config.config import DATABASE_CONFIG  # Import your database configuration from the config file
 import configparser
   
+import pandas as pd
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
 
+from weather_pipeline.profiling import QueryProfiler
+from weather_pipeline.config import DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, \
+    DB_POOL_PRE_PING, DB_STREAM_CHUNK_SIZE, PROFILE_QUERIES
+
 
 class DbHandler:
-    def __init__(self, config_file='tmp/config.ini', host='default'):
+    """DbHandler
+
+    Pooled access to the postgres database of the config file. The
+    engine keeps up to `pool_size` (+ `max_overflow` under load)
+    connections open, checks them with a ping before handing them out
+    (`pool_pre_ping`) and recycles them after `pool_recycle` seconds.
+    With `profile` every statement of execute_query, execute_batch and
+    the streams is recorded by a QueryProfiler (`profiler`), as well as
+    the driver level statements run in a `profiled` block (COPY).
+
+    Methods:
+    -------
+    execute_query(query, values)
+    Runs a statement in its own transaction. The rows of a SELECT are
+    fetched before the connection goes back to the pool.
+
+    execute_batch(queries)
+    Runs several statements in a single transaction.
+
+    stream_results(query, values, chunk_size)
+    Iterates over the rows of a query through a server-side cursor,
+    `chunk_size` rows held in memory at a time.
+
+    stream_dataframes(query, values, chunk_size)
+    Same as stream_results, as DataFrames of `chunk_size` rows.
+
+    raw_cursor()
+    DBAPI cursor for driver level operations (COPY).
+
+    profiled(query, values, returns_rows)
+    Context manager recording the statement run inside it with the
+    profiler, the block sets the number of rows on the yielded dict.
+
+    dispose_inherited()
+    Drops, without closing them, the pooled connections of every
+    DbHandler of the process. Called first thing in a forked child,
+    whose pools hold the sockets of the parent's connections.
+    """
+
+    # every DbHandler of the process, for dispose_inherited
+    _instances = weakref.WeakSet()
+
+    def __init__(self, config_file='tmp/config.ini', host='default', pool_size:int=DB_POOL_SIZE, 
+                 max_overflow:int=DB_MAX_OVERFLOW, pool_timeout:float=DB_POOL_TIMEOUT, 
+                 pool_recycle:int=DB_POOL_RECYCLE, pool_pre_ping:bool=DB_POOL_PRE_PING, 
+                 profile:bool=PROFILE_QUERIES):
         config = configparser.ConfigParser()
         config.read(config_file)
         print(config.sections())
@@ -20,20 +72,128 @@ class DbHandler:
         
         db_url = f'postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}'
 
-        self.engine = create_engine(db_url)
+        self.engine = create_engine(db_url, pool_size=pool_size, max_overflow=max_overflow, 
+                                    pool_timeout=pool_timeout, pool_recycle=pool_recycle, 
+                                    pool_pre_ping=pool_pre_ping)
         self.Session = sessionmaker(bind=self.engine)
+        self.profiler = QueryProfiler() if profile else None
+        DbHandler._instances.add(self)
+
+    @classmethod
+    def dispose_inherited(cls) -> None:
+        # close=False: the connections stay open for the parent, the child opens its own on first use
+        for handler in list(cls._instances):
+            handler.engine.dispose(close=False)
 
     def create_session(self):
         return self.Session()
 
-    def execute_query(self, query, values=None):
-        with self.engine.connect() as connection:
+    @contextmanager
+    def raw_cursor(self):
+        """
+        DBAPI (psycopg2) cursor on a pooled connection, for driver level
+        operations such as COPY. Commits on success, rolls back on error.
+        """
+        connection = self.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
             try:
-                print(type(values), len(values))
-            except:
-                pass
+                yield cursor
+            finally:
+                cursor.close()
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+
+    @contextmanager
+    def profiled(self, query, values=None, returns_rows=True):
+        """
+        Times the statement run inside the block and records it with the profiler, when
+        profiling, under the label current when the block started. The block sets the
+        number of rows it read or wrote as `stats["rows"]` on the yielded dict.
+        """
+        stats = {"rows": None}
+        profiler = getattr(self, "profiler", None)
+        label = profiler.label() if profiler is not None else None
+        start = time.perf_counter()
+        yield stats
+        if profiler is not None:
+            profiler.record(self, query, values, time.perf_counter() - start, stats["rows"],
+                            returns_rows=returns_rows, label=label)
+
+    def execute_batch(self, queries):
+        """
+        Executes the queries one after another in a single transaction,
+        rolled back as a whole if any of them fails.
+        Returns the number of rows affected by each query.
+        """
+        row_counts = []
+        with self.engine.begin() as connection:
+            for query in queries:
+                # not explained, a plan of the batch statements would run them on the state before the batch
+                with self.profiled(query, returns_rows=False) as stats:
+                    stats["rows"] = connection.execute(query).rowcount
+                row_counts.append(stats["rows"])
+        return row_counts
+
+    def execute_query(self, query, values=None):
+        profiler = getattr(self, "profiler", None)
+        start = time.perf_counter()
+        with self.engine.begin() as connection:
             result = connection.execute(query, values)
-        return result
+            if result.returns_rows:
+                # buffered, the result stays readable once the connection is back in the pool
+                frozen = result.freeze()
+        
+        if not result.returns_rows:
+            if profiler is not None:
+                profiler.record(self, query, values, time.perf_counter() - start, result.rowcount, returns_rows=False)
+            return result
+        if profiler is not None:
+            profiler.record(self, query, values, time.perf_counter() - start, len(frozen.data))
+        return frozen()
+
+    @contextmanager
+    def _streamed(self, query, values, chunk_size):
+        # a server-side (named) cursor only sends `chunk_size` rows per round trip,
+        # profiled from the execution to the last row read
+        with self.profiled(query, values) as stats, self.engine.connect() as connection:
+            result = connection.execution_options(stream_results=True, max_row_buffer=chunk_size) \
+                .execute(query, values)
+            stats["rows"] = 0
+            try:
+                yield result, stats
+            finally:
+                result.close()
+
+    def stream_results(self, query, values=None, chunk_size:int=DB_STREAM_CHUNK_SIZE):
+        """
+        Yields the rows of the query one by one, fetched `chunk_size` at a time
+        from a server-side cursor, so memory does not grow with the result size.
+        """
+        with self._streamed(query, values, chunk_size) as (result, stats):
+            for rows in result.partitions(chunk_size):
+                stats["rows"] += len(rows)
+                yield from rows
+
+    def stream_dataframes(self, query, values=None, chunk_size:int=DB_STREAM_CHUNK_SIZE):
+        """
+        Yields the result of the query as DataFrames of at most `chunk_size` rows,
+        read from a server-side cursor. An empty result yields one empty DataFrame
+        with the result columns.
+        """
+        with self._streamed(query, values, chunk_size) as (result, stats):
+            columns = list(result.keys())
+            empty = True
+            for rows in result.partitions(chunk_size):
+                empty = False
+                stats["rows"] += len(rows)
+                yield pd.DataFrame(rows, columns=columns)
+            if empty:
+                yield pd.DataFrame([], columns=columns)
 
 
 # class DbHandler:
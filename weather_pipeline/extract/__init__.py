@@ -1,10 +1,12 @@
 from weather_pipeline.utils import _get_logger
 from weather_pipeline.extract.extractor import webSource
+from weather_pipeline.extract.session import get_session, request_stats
 
 class Extractor:
     """    
     Extractor driver Factory class that provides the drivers at runtime
-    based on which type of driver is requested.
+    based on which type of driver is requested. Every driver shares
+    the process-wide pooled HTTP session unless a `session` is given.
     
     Method:
     ------
@@ -14,6 +16,7 @@ class Extractor:
     
     def __init__(self, source_type, **kwargs):
         self.logger = _get_logger(name=__name__)
+        kwargs.setdefault("session", get_session())
         if source_type == "web":
             self.driver = webSource(**kwargs)
         else:
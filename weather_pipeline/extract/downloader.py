@@ -0,0 +1,89 @@
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit
+
+from weather_pipeline.utils import _get_logger
+from weather_pipeline.extract.manifest import NOT_MODIFIED
+
+
+class DownloadReport:
+    """DownloadReport
+
+    Outcome of a batch of downloads, keyed by the job key
+    (e.g. the station id).
+
+    Attributes:
+    ----------
+    succeeded (list): keys of the jobs that downloaded new content.
+    skipped (list): keys of the jobs whose source was not modified.
+    failed (dict): key -> exception raised by the job.
+    """
+
+    def __init__(self) -> None:
+        self.succeeded = []
+        self.skipped = []
+        self.failed = {}
+
+    def record(self, key, status) -> None:
+        if status == NOT_MODIFIED:
+            self.skipped.append(key)
+        else:
+            self.succeeded.append(key)
+
+    def __repr__(self) -> str:
+        return f"DownloadReport(succeeded={len(self.succeeded)}, skipped={len(self.skipped)}, " \
+            f"failed={len(self.failed)})"
+
+
+class ConcurrentDownloader:
+    """ConcurrentDownloader
+
+    Runs many downloads on a bounded thread pool. The total number of
+    in-flight jobs is capped by `max_workers` and the number of jobs
+    talking to the same host is capped by `per_host_limit`.
+    A failing job never stops the batch, its exception is collected
+    in the returned DownloadReport.
+
+    Methods:
+    -------
+    run(jobs)
+    Executes the jobs and returns a DownloadReport.
+        Params:
+        1. jobs (iterable): (key, url, callable) triples, the callable
+           performs the download of `url`, takes no argument and
+           returns the download status of webSource.get.
+    """
+
+    def __init__(self, max_workers:int=8, per_host_limit:int=4) -> None:
+        self.logger = _get_logger(name=__name__)
+        self.max_workers = max_workers
+        self.per_host_limit = per_host_limit
+
+        self._hosts_lock = threading.Lock()
+        self._host_slots = defaultdict(lambda: threading.BoundedSemaphore(self.per_host_limit))
+
+    def _host_slot(self, url:str) -> threading.BoundedSemaphore:
+        with self._hosts_lock:
+            return self._host_slots[urlsplit(url).netloc]
+
+    def _run_job(self, url, job) -> str:
+        with self._host_slot(url):
+            return job()
+
+    def run(self, jobs) -> DownloadReport:
+        report = DownloadReport()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self._run_job, url, job): key for key, url, job in jobs}
+
+            for future in as_completed(futures):
+                key = futures[future]
+                try:
+                    report.record(key, future.result())
+                except Exception as e:
+                    self.logger.error(f"Download job failed: {key} => {e}")
+                    report.failed[key] = e
+
+        self.logger.info(f"Downloads finished: {report}")
+        return report
@@ -1,9 +1,29 @@
 import abc
+import gzip
+import hashlib
+import os
+import time
 import requests
 from tqdm import tqdm
 from pathlib import Path
 
 from weather_pipeline.utils import _get_logger
+from weather_pipeline.config import EXTRACT_RETRIES, EXTRACT_BACKOFF, EXTRACT_CONNECT_TIMEOUT, EXTRACT_READ_TIMEOUT
+from weather_pipeline.extract.manifest import DOWNLOADED, NOT_MODIFIED, FAILED
+
+
+def read_checksums(path) -> dict:
+    """
+    Reads a published digest listing in the `sha256sum` format ('<sha256>  <file name>' per line)
+    into {file name: sha256}, to be passed as the `checksum` of the downloads.
+    """
+    checksums = {}
+    with open(path) as fp:
+        for line in fp:
+            if line.strip():
+                digest, name = line.split(maxsplit=1)
+                checksums[name.strip().lstrip("*").rsplit("/", 1)[-1]] = digest.lower()
+    return checksums
 
 
 class BaseSource(metaclass=abc.ABCMeta):
@@ -29,20 +49,46 @@ class webSource(BaseSource):
     """webSource
     
     Deriver from BaseSource, implements extraction from web as 
-    source.
+    source. When a DownloadManifest is given (`manifest` kwarg), the
+    request is made conditional on the ETag / Last-Modified of the
+    previous download and the body is skipped on 304 Not Modified.
+    
+    The body is written to `<temp_location>.part` and renamed once its
+    size (and `checksum` kwarg, a sha256, when given) has been verified.
+    A failed transfer is retried `retries` times with exponential
+    `backoff`, resuming the partial file with a HTTP Range request
+    conditional (If-Range) on the ETag / Last-Modified recorded in the
+    manifest. Without a manifest record the transfer starts over.
+    
+    Requests go through the `session` kwarg (a requests.Session, the
+    Extractor factory passes the shared pooled session) with a
+    (connect, read) `timeout`.
     
     Methods:
     -------
-    get(chunk_size)
+    get(chunk_size, raise_errors)
     Responsible to fetch data from web as chunk.
         Params:
         1. chunk_size (INT): Default 1024. chunk_size to read and write. 
+        2. raise_errors (BOOL): Default False. Re-raise download errors
+           after logging them instead of swallowing them.
+        Returns the download status: DOWNLOADED, NOT_MODIFIED or FAILED.
+    
+    stream()
+    Opens the source and returns its body as a binary file-like, gunzipped
+    on the fly when the url ends with '.gz'. Nothing is written to disk.
     """
     
     def __init__(self, **kwargs) -> None:
         super().__init__(_name = __name__)
         self.source = kwargs.get("source_url", None)
         self.temp_destination = kwargs.get("temp_location", None)
+        self.manifest = kwargs.get("manifest", None)
+        self.checksum = kwargs.get("checksum", None)
+        self.retries = kwargs.get("retries", EXTRACT_RETRIES)
+        self.backoff = kwargs.get("backoff", EXTRACT_BACKOFF)
+        self.session = kwargs.get("session", None) or requests.Session()
+        self.timeout = kwargs.get("timeout", (EXTRACT_CONNECT_TIMEOUT, EXTRACT_READ_TIMEOUT))
         
         if self.temp_destination is None:
             filename = self.source.rsplit('/')[-1]
@@ -58,17 +104,138 @@ class webSource(BaseSource):
     def filepath(self):
         return self.temp_destination
     
-    def get(self, chunk_size:int=1024) -> None:
-        try:
-            self.logger.info(f"Beginning to download, file at {self.source}" \
-                f" :: {self.temp_destination}")
-            
-            response = requests.get(self.source, stream=True)
-            self.temp_destination.parent.mkdir(parents=True, exist_ok=True)
+    @property
+    def partpath(self):
+        return self.temp_destination.with_name(self.temp_destination.name + ".part")
+    
+    def get(self, chunk_size:int=1024, raise_errors:bool=False) -> str:
+        self.logger.info(f"Beginning to download, file at {self.source}" \
+            f" :: {self.temp_destination}")
+        
+        for attempt in range(self.retries + 1):
+            try:
+                return self._fetch(chunk_size)
             
-            with open(self.temp_destination, "wb") as fl:
-                for chunk in tqdm(response.raw.stream(chunk_size, decode_content=True)):
-                    fl.write(chunk)
+            except Exception as e:
+                if attempt < self.retries and self._is_retryable(e):
+                    delay = self.backoff * 2 ** attempt
+                    self.logger.warning(f"Download attempt {attempt + 1} failed: {self.source} => {e}, " \
+                        f"retrying in {delay}s")
+                    time.sleep(delay)
+                    continue
+                
+                self.logger.error(f"Failed to download file: {self.source} => {e}")
+                if self.manifest is not None:
+                    self.manifest.update(self.source, status=FAILED)
+                if raise_errors:
+                    raise
+                return FAILED
+    
+    def stream(self):
+        self.logger.info(f"Streaming file at {self.source}")
+        
+        response = self.session.get(self.source, stream=True, timeout=self.timeout)
+        response.raise_for_status()
+        response.raw.decode_content = True
+        
+        if self.source.endswith(".gz"):
+            return gzip.GzipFile(fileobj=response.raw, mode="rb")
+        return response.raw
+    
+    @staticmethod
+    def _is_retryable(error) -> bool:
+        # client errors (404, 403, ..) will not go away by asking again
+        if isinstance(error, requests.HTTPError) and error.response is not None:
+            return error.response.status_code >= 500
+        return True
+    
+    @staticmethod
+    def _expected_size(response, offset):
+        content_range = response.headers.get("Content-Range")
+        if content_range and "/" in content_range:
+            total = content_range.rsplit("/", 1)[1]
+            return int(total) if total.isdigit() else None
+        
+        content_length = response.headers.get("Content-Length")
+        return offset + int(content_length) if content_length is not None else None
+    
+    def _fetch(self, chunk_size:int) -> str:
+        offset = self.partpath.stat().st_size if self.partpath.exists() else 0
+        
+        # byte offsets only make sense on the body as stored on the server
+        headers = {"Accept-Encoding": "identity"}
+        if offset:
+            partial = self.manifest.entry(self.source) if self.manifest is not None else None
+            if partial and partial.get("partial_validator"):
+                headers["Range"] = f"bytes={offset}-"
+                headers["If-Range"] = partial["partial_validator"]
+            else:
+                # nothing tells whether the partial file still belongs to the remote file
+                self.logger.info(f"No validator for {self.partpath}, downloading {self.source} from scratch")
+                self.partpath.unlink()
+                offset = 0
+        if not offset and self.manifest is not None:
+            headers.update(self.manifest.conditional_headers(self.source, self.temp_destination))
+        
+        response = self.session.get(self.source, stream=True, headers=headers, timeout=self.timeout)
+        
+        if response.status_code == 304:
+            response.close()
+            self.logger.info(f"Not modified since last download, keeping {self.temp_destination}")
+            self.manifest.update(self.source, status=NOT_MODIFIED)
+            return NOT_MODIFIED
+        
+        if response.status_code == 416:
+            # the partial file does not belong to the remote file anymore
+            response.close()
+            self.partpath.unlink()
+            raise IOError(f"Range not satisfiable for {self.partpath}, restarting from scratch")
+        
+        response.raise_for_status()
+        
+        if response.status_code != 206:
+            # range ignored or remote file changed since the partial download
+            offset = 0
+        elif offset:
+            self.logger.info(f"Resuming download of {self.source} at byte {offset}")
+        
+        expected_size = self._expected_size(response, offset)
+        
+        if offset == 0 and self.manifest is not None:
+            self.manifest.update(self.source, partial_validator=response.headers.get("ETag") \
+                                 or response.headers.get("Last-Modified"))
+        
+        self.partpath.parent.mkdir(parents=True, exist_ok=True)
+        
+        checksum = hashlib.sha256()
+        if offset:
+            with open(self.partpath, "rb") as fl:
+                for chunk in iter(lambda: fl.read(1024 * 1024), b""):
+                    checksum.update(chunk)
+        
+        size = offset
+        with open(self.partpath, "ab" if offset else "wb") as fl:
+            for chunk in tqdm(response.raw.stream(chunk_size, decode_content=True)):
+                fl.write(chunk)
+                checksum.update(chunk)
+                size += len(chunk)
+        
+        if expected_size is not None and size != expected_size:
+            raise IOError(f"Incomplete download of {self.source}: {size} of {expected_size} bytes")
+        
+        if self.checksum is not None and checksum.hexdigest() != self.checksum:
+            self.partpath.unlink()
+            raise IOError(f"Checksum mismatch for {self.source}: {checksum.hexdigest()} != {self.checksum}")
+        
+        os.replace(self.partpath, self.temp_destination)
         
-        except Exception as e:
-            self.logger.error(f"Failed to download file: {self.source} => {e}")
\ No newline at end of file
+        if self.manifest is not None:
+            self.manifest.update(self.source, 
+                                 etag=response.headers.get("ETag"),
+                                 last_modified=response.headers.get("Last-Modified"),
+                                 size=size,
+                                 checksum=checksum.hexdigest(),
+                                 path=str(self.temp_destination),
+                                 partial_validator=None,
+                                 status=DOWNLOADED)
+        return DOWNLOADED
\ No newline at end of file
@@ -0,0 +1,129 @@
+import json
+import os
+import threading
+from pathlib import Path
+
+from weather_pipeline.utils import _get_logger
+
+# status of the last download attempt of an url
+DOWNLOADED = "downloaded"
+NOT_MODIFIED = "not_modified"
+FAILED = "failed"
+
+
+class DownloadManifest:
+    """DownloadManifest
+
+    On-disk record of every url fetched by a webSource, stored as json
+    next to the downloaded files. For each url it keeps the ETag,
+    Last-Modified, size, sha256 checksum, local path and the status
+    of the last download, which lets sources send conditional requests
+    and lets the load steps skip files that did not change.
+
+    The manifest is shared between threads and written to disk
+    atomically, at every update or, with `autosave=False`, only by
+    flush: a task updating the records of thousands of urls writes the
+    file once instead of once per update.
+
+    Methods:
+    -------
+    entry(url)
+    Returns the stored record of the url or None.
+
+    conditional_headers(url, destination)
+    Returns If-None-Match / If-Modified-Since headers for the url,
+    only when the local copy is still present and complete.
+
+    update(url, **fields)
+    Merges the fields into the record of the url and saves the manifest
+    (with `autosave`).
+
+    flush()
+    Saves the manifest when it has updates not written yet.
+
+    is_unchanged(url)
+    True when the last download of the url answered 304 Not Modified.
+
+    cached(path)
+    Read-only manifest of the path shared by the callers of the process,
+    read again only when the file changed on disk.
+    """
+
+    # cached manifests of the process, {path: ((mtime, size), manifest)}
+    _cache = {}
+    _cache_lock = threading.Lock()
+
+    def __init__(self, path:str="tmp/download_manifest.json", autosave:bool=True) -> None:
+        self.logger = _get_logger(name=__name__)
+        self.path = Path(path)
+        self.autosave = autosave
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._dirty = False
+
+        if self.path.exists():
+            try:
+                with open(self.path) as fp:
+                    self._entries = json.load(fp)
+            except ValueError as e:
+                self.logger.warning(f"Ignoring unreadable manifest {self.path} => {e}")
+
+    def entry(self, url:str):
+        with self._lock:
+            entry = self._entries.get(url)
+            return dict(entry) if entry is not None else None
+
+    def conditional_headers(self, url:str, destination) -> dict:
+        entry = self.entry(url)
+        destination = Path(destination)
+
+        if entry is None or not destination.exists():
+            return {}
+        if entry.get("size") is not None and destination.stat().st_size != entry["size"]:
+            return {}
+
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def update(self, url:str, **fields) -> None:
+        with self._lock:
+            self._entries.setdefault(url, {}).update(fields)
+            self._dirty = True
+            if self.autosave:
+                self._save()
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._dirty:
+                self._save()
+
+    @classmethod
+    def cached(cls, path:str="tmp/download_manifest.json") -> "DownloadManifest":
+        path = Path(path)
+        try:
+            stat = path.stat()
+            mtime = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            mtime = None
+        with cls._cache_lock:
+            cached_mtime, manifest = cls._cache.get(str(path), (None, None))
+            if manifest is None or cached_mtime != mtime:
+                manifest = cls(path)
+                cls._cache[str(path)] = (mtime, manifest)
+            return manifest
+
+    def is_unchanged(self, url:str) -> bool:
+        entry = self.entry(url)
+        return entry is not None and entry.get("status") == NOT_MODIFIED
+
+    def _save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w") as fp:
+            json.dump(self._entries, fp, indent=1)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
@@ -0,0 +1,118 @@
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from weather_pipeline.utils import _get_logger
+from weather_pipeline.config import EXTRACT_POOL_CONNECTIONS, EXTRACT_POOL_MAXSIZE, EXTRACT_HTTP_RETRIES
+
+logger = _get_logger(name=__name__)
+
+
+class RequestStats:
+    """RequestStats
+
+    Thread-safe latency counters of the requests made through the
+    shared session, overall and per host. The latency is the time
+    between sending the request and parsing the response headers,
+    so it includes the TCP/TLS handshake whenever a new connection
+    had to be opened.
+
+    Methods:
+    -------
+    record(response)
+    Adds the latency of a response to the counters.
+
+    snapshot()
+    Returns the counters as a dict: requests, total_seconds,
+    avg_seconds, max_seconds and the same figures per host.
+
+    reset()
+    Clears all the counters.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._hosts = {}
+
+    def record(self, response, *args, **kwargs) -> None:
+        host = urlsplit(response.url).netloc
+        seconds = response.elapsed.total_seconds()
+
+        with self._lock:
+            counters = self._hosts.setdefault(host, {"requests": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+            counters["requests"] += 1
+            counters["total_seconds"] += seconds
+            counters["max_seconds"] = max(counters["max_seconds"], seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            hosts = {host: dict(counters, avg_seconds=counters["total_seconds"] / counters["requests"])
+                     for host, counters in self._hosts.items()}
+
+        requests_count = sum(c["requests"] for c in hosts.values())
+        total_seconds = sum(c["total_seconds"] for c in hosts.values())
+        return {
+            "requests": requests_count,
+            "total_seconds": total_seconds,
+            "avg_seconds": total_seconds / requests_count if requests_count else 0.0,
+            "max_seconds": max((c["max_seconds"] for c in hosts.values()), default=0.0),
+            "hosts": hosts,
+        }
+
+
+request_stats = RequestStats()
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def create_session(pool_connections:int=EXTRACT_POOL_CONNECTIONS, pool_maxsize:int=EXTRACT_POOL_MAXSIZE,
+                   retries:int=EXTRACT_HTTP_RETRIES) -> requests.Session:
+    """
+    Creates a requests session with keep-alive connection pools of `pool_maxsize`
+    connections for up to `pool_connections` hosts, retrying failed connections `retries` times.
+    Error answers (5xx, ..) are returned as is, the sources retry them with their own backoff.
+    Every response is recorded in `request_stats`.
+    """
+
+    retry = Retry(total=retries, backoff_factor=0.5, status=0, allowed_methods=("GET", "HEAD"))
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry)
+
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.hooks["response"].append(request_stats.record)
+    return session
+
+
+def get_session() -> requests.Session:
+    """
+    Returns the process-wide session shared by every source, created on first use.
+    """
+
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_session()
+            logger.info(f"Created shared HTTP session (pool_maxsize={EXTRACT_POOL_MAXSIZE})")
+        return _session
+
+
+def configure_session(**kwargs) -> requests.Session:
+    """
+    Replaces the process-wide session by one created with `create_session(**kwargs)`.
+    """
+
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = create_session(**kwargs)
+        return _session
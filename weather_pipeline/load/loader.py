@@ -1,3 +1,6 @@
+import csv
+import io
+import time
 from logging import exception
 from typing import List, Optional, Tuple
 import pandas as pd
@@ -5,76 +8,313 @@ from pandas.io.parsers import read_fwf
 
 
 from sqlalchemy import create_engine
+from sqlalchemy.exc import IntegrityError, ProgrammingError
 from sqlalchemy.orm import sessionmaker
 
+from weather_pipeline.utils import _get_logger
+from weather_pipeline.config import LOADER_METHOD
+from weather_pipeline.load.versions import DataVersions
+
+
 class Loader:
+    """Loader
+    
+    Writes DataFrames or lists of rows to PostgreSQL tables, creating
+    the tables on first use.
+    
+    Methods:
+    -------
+    create_table_if_not_exists(table, columns, primary_key, partition_by)
+        An existing table without the `primary_key` (created before the
+        loads were keyed) is migrated by ensure_primary_key.
+    create_partition_if_not_exists(table, partition, bounds, partition_by)
+    
+    ensure_primary_key(table, primary_key)
+        Adds the primary key to an existing table that has none, removing the
+        duplicate keys first (the row written last is kept) and the rows with
+        a NULL key column. Checked once per table and Loader.
+    
+    create_indexes(table, indexes, primary_key)
+        Creates the declared indexes of a table, meant to be called once the
+        bulk load is done: building an index once is much cheaper than
+        maintaining it row by row during the load.
+        Params:
+        indexes (LIST): (method, columns) declarations, e.g.
+        [("btree", ["station_id", "date"]), ("btree", ["date"])].
+        primary_key (LIST): Default None. B-tree declarations on the primary
+        key columns are skipped, the key already has its index.
+    
+    load_csv_to_db(data, table_name, columns, method, key_columns, versioned)
+    load_list_to_db(rows, table_name, columns, method, key_columns)
+        Params:
+        method (STR): Default LOADER_METHOD. 'copy' streams the rows through
+        `COPY ... FROM STDIN` from an in-memory csv buffer, 'insert' sends
+        them as a parameterized multi-row INSERT.
+        key_columns (LIST): Default None. Natural key of the rows, turns the
+        load into an upsert (INSERT ... ON CONFLICT (key) DO UPDATE) so that
+        loading the same rows again does not duplicate them. Tables created
+        by the load get the key as primary key.
+        versioned (LIST): Default [table_name]. Tables whose data version
+        moves with the load, e.g. the views reading `table_name`.
+        Both return the number of rows loaded and log the rows per second.
+        Every write bumps the data version of the table (`versions`) in its
+        own transaction.
+    
+    update_from_frame(data, table_name, columns, key_columns)
+        Updates the `columns` of the existing rows of `table_name` matching the
+        `key_columns` of the DataFrame rows, in one UPDATE ... FROM a staging
+        table filled with COPY. Returns the number of rows updated.
+    """
+    
     def __init__(self, db_handler):
         self.db_handler = db_handler
+        self.logger = _get_logger(name=__name__)
+        # bumped for every table written, invalidates the cached results read from it
+        self.versions = DataVersions(db_handler)
+        # tables known to have their primary key
+        self._keyed = set()
     
-    def create_table_if_not_exists(self, table, columns):
+    def create_table_if_not_exists(self, table, columns, primary_key=None, partition_by=None):
         # Create a formatted string for column definitions
         columns_str = ', '.join([f'{name.lower()} {type}' for name, type in columns])
         
+        if primary_key:
+            columns_str += ', PRIMARY KEY ({})'.format(', '.join(key.lower() for key in primary_key))
+        
         # self.db_handler.execute_query(f"""DROP TABLE IF EXISTS {table};""")
         
         query = """CREATE TABLE IF NOT EXISTS {table} 
                     ({columns_str})""".format(table=table, columns_str=columns_str)
+        
+        if partition_by:
+            query += f" PARTITION BY {partition_by}"
 
-        self.db_handler.execute_query(query)
+        self._execute_ddl(query)
+        
+        if primary_key:
+            self.ensure_primary_key(table, primary_key)
+    
+    def ensure_primary_key(self, table, primary_key):
+        if table.lower() in self._keyed:
+            return
+        keys = [key.lower() for key in primary_key]
+        
+        with self.db_handler.raw_cursor() as cursor:
+            cursor.execute("""SELECT c.relkind, EXISTS (SELECT 1 FROM pg_index i WHERE i.indrelid = c.oid AND i.indisprimary)
+                              FROM pg_class c WHERE c.oid = to_regclass(%s)""", (table,))
+            row = cursor.fetchone()
+            # views and partitioned tables are keyed when created
+            if row is None or row[0] != "r" or row[1]:
+                self._keyed.add(table.lower())
+                return
+            
+            # re-checked under the lock, another loader process may be migrating the table as well
+            cursor.execute(f"LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE")
+            cursor.execute("""SELECT EXISTS (SELECT 1 FROM pg_index 
+                                             WHERE indrelid = to_regclass(%s) AND indisprimary)""", (table,))
+            if not cursor.fetchone()[0]:
+                cursor.execute(f"DELETE FROM {table} WHERE " + " OR ".join(f"{key} IS NULL" for key in keys))
+                dropped = cursor.rowcount
+                cursor.execute(f"""DELETE FROM {table} older USING {table} newer
+                                   WHERE {" AND ".join(f"older.{key} = newer.{key}" for key in keys)}
+                                       AND older.ctid < newer.ctid""")
+                dropped += cursor.rowcount
+                cursor.execute(f"ALTER TABLE {table} ADD PRIMARY KEY ({', '.join(keys)})")
+                if dropped:
+                    cursor.execute(self.versions.bump_query(table))
+                self.logger.info(f"Added the primary key ({', '.join(keys)}) to {table}, {dropped} rows removed")
+        self._keyed.add(table.lower())
+    
+    def create_partition_if_not_exists(self, table, partition, bounds, partition_by=None):
+        """
+        Creates `partition` as a partition of the declaratively partitioned `table`,
+        `bounds` being e.g. "FOR VALUES IN ('TMAX')" or "FOR VALUES FROM (..) TO (..)".
+        The partition can be partitioned again with `partition_by`.
+        """
+        query = f"CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {table} {bounds}"
+        
+        if partition_by:
+            query += f" PARTITION BY {partition_by}"
+        
+        self._execute_ddl(query)
+    
+    def create_indexes(self, table, indexes, primary_key=None):
+        primary_key = [key.lower() for key in primary_key] if primary_key else None
+        
+        for method, columns in indexes:
+            columns = [column.lower() for column in columns]
+            if method == "btree" and columns == primary_key:
+                continue
+            
+            index = f"{table}_{'_'.join(columns)}_{method}".lower()
+            start = time.perf_counter()
+            self._execute_ddl(f"CREATE INDEX IF NOT EXISTS {index} ON {table} USING {method} ({', '.join(columns)})")
+            self.logger.info(f"Index {index} ready in {time.perf_counter() - start:.2f}s")
+    
+    def _execute_ddl(self, query):
+        try:
+            self.db_handler.execute_query(query)
+        except (IntegrityError, ProgrammingError) as e:
+            # the relation was created concurrently by another loader process
+            if getattr(e.orig, "pgcode", None) not in ("23505", "42P07"):
+                raise
 
-    def load_csv_to_db(self, data, table_name, columns):
+    def load_csv_to_db(self, data, table_name, columns, method=LOADER_METHOD, key_columns=None, versioned=None):
 
-        self.create_table_if_not_exists(table_name, columns)
+        self.create_table_if_not_exists(table_name, columns, primary_key=key_columns)
 
         # Extract column names for the INSERT query
         columns_str = ", ".join([f'{name.lower()}' for name, _ in columns])
+        conflict_str = self._on_conflict(columns, key_columns)
+        
+        start = time.perf_counter()
+        
+        if method == "copy":
+            buffer = io.StringIO()
+            data.to_csv(buffer, header=False, index=False)
+            buffer.seek(0)
+            
+            self._copy_buffer(buffer, table_name, columns_str, key_columns, conflict_str, 
+                              versioned=versioned or [table_name])
+            
+            return self._report(table_name, len(data), start)
         
         # data.to_sql(f'{table_name}', self.db_handler.engine, if_exists='replace', index=False)
 
         # Create a formatted string for the INSERT query
         # values_str = """%s, %s, %s, %s, %s"""
         values_str = ", ".join(["%s" for _ in columns])
-        insert_query = """INSERT INTO {table_name} ({columns_str}) VALUES ({values_str})""".format(
+        insert_query = """INSERT INTO {table_name} ({columns_str}) VALUES ({values_str}){conflict_str}""".format(
             table_name=table_name,
             columns_str=columns_str,
-            values_str=values_str
+            values_str=values_str,
+            conflict_str=conflict_str
         )
 
-        print(tuple(data.iloc[i,:].astype(str).values for i in range(4)))
-
         # Execute the INSERT query
-        self.db_handler.execute_query(insert_query, 
-                                      tuple(data.iloc[i,:].astype(str).values for i in range(len(data))))
-
-        result = self.db_handler.execute_query(f"SELECT * FROM {table_name} LIMIT 10")
-        print([row for row in result])
+        self._insert_versioned(insert_query, tuple(data.iloc[i,:].astype(str).values for i in range(len(data))),
+                               versioned or [table_name])
+        self.logger.debug(f"Inserted into {table_name}, first rows: {data.head(3).values.tolist()}")
+        
+        return self._report(table_name, len(data), start)
     
-    def load_list_to_db(self, rows, table_name, columns):
+    def load_list_to_db(self, rows, table_name, columns, method=LOADER_METHOD, key_columns=None):
 
-        self.create_table_if_not_exists(table_name, columns)
+        self.create_table_if_not_exists(table_name, columns, primary_key=key_columns)
 
         # Extract column names for the INSERT query
         columns_str = ", ".join([f'{name}' for name, _ in columns])
+        conflict_str = self._on_conflict(columns, key_columns)
+        
+        start = time.perf_counter()
+        
+        if method == "copy":
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(rows)
+            buffer.seek(0)
+            
+            self._copy_buffer(buffer, table_name, columns_str, key_columns, conflict_str, 
+                              versioned=[table_name])
+            
+            return self._report(table_name, len(rows), start)
         
         # data.to_sql(f'{table_name}', self.db_handler.engine, if_exists='replace', index=False)
 
         # Create a formatted string for the INSERT query
         # values_str = """%s, %s, %s, %s, %s"""
         values_str = """, """.join(["%s" for _ in columns])
-        insert_query = """INSERT INTO {table_name} ({columns_str}) VALUES ({values_str})""".format(
+        insert_query = """INSERT INTO {table_name} ({columns_str}) VALUES ({values_str}){conflict_str}""".format(
             table_name=table_name,
             columns_str=columns_str,
-            values_str=values_str
+            values_str=values_str,
+            conflict_str=conflict_str
         )
 
         # print(tuple(data.iloc[i,:].astype(str).values for i in range(4)))
         # print([[str(element) for element in row] for row in rows])
         # Execute the INSERT query
-        self.db_handler.execute_query(insert_query, 
-                                      (tuple(row for row in rows)),)
-
-        result = self.db_handler.execute_query(f"SELECT * FROM {table_name} LIMIT 10")
-        print([row for row in result])
+        self._insert_versioned(insert_query, (tuple(row for row in rows)), [table_name])
+        self.logger.debug(f"Inserted into {table_name}, first rows: {list(rows[:3])}")
+        
+        return self._report(table_name, len(rows), start)
+    
+    def update_from_frame(self, data, table_name, columns, key_columns):
+        columns_str = ", ".join(name.lower() for name, _ in columns)
+        keys = [key.lower() for key in key_columns]
+        staging = f"{table_name}_updates"
+        
+        start = time.perf_counter()
+        
+        buffer = io.StringIO()
+        data.to_csv(buffer, header=False, index=False)
+        buffer.seek(0)
+        
+        bump_query = self.versions.bump_query(table_name)
+        with self.db_handler.raw_cursor() as cursor:
+            cursor.execute("CREATE TEMP TABLE {staging} ({columns}) ON COMMIT DROP".format(
+                staging=staging, columns=", ".join(f"{name.lower()} {type}" for name, type in columns)))
+            cursor.copy_expert(f"COPY {staging} ({columns_str}) FROM STDIN WITH (FORMAT csv)", buffer)
+            cursor.execute("""UPDATE {table} SET {updates} FROM {staging} 
+                              WHERE {matches}""".format(
+                table=table_name, staging=staging,
+                updates=", ".join(f"{name.lower()} = {staging}.{name.lower()}" 
+                                  for name, _ in columns if name.lower() not in keys),
+                matches=" AND ".join(f"{table_name}.{key} = {staging}.{key}" for key in keys)))
+            updated = cursor.rowcount
+            cursor.execute(bump_query)
+        
+        elapsed = time.perf_counter() - start
+        self.logger.info(f"Updated {updated} rows of {table_name} from {len(data)} rows in {elapsed:.2f}s")
+        return updated
+    
+    def _on_conflict(self, columns, key_columns):
+        if not key_columns:
+            return ""
+        
+        keys = [key.lower() for key in key_columns]
+        updates = [name.lower() for name, _ in columns if name.lower() not in keys]
+        
+        conflict_str = " ON CONFLICT ({})".format(", ".join(keys))
+        if not updates:
+            return conflict_str + " DO NOTHING"
+        return conflict_str + " DO UPDATE SET " + ", ".join(f"{name} = EXCLUDED.{name}" for name in updates)
+    
+    def _insert_versioned(self, insert_query, values, versioned):
+        # the rows and their data versions are committed together
+        bump_query = self.versions.bump_query(*versioned)
+        with self.db_handler.engine.begin() as connection:
+            connection.execute(insert_query, values)
+            connection.execute(bump_query)
+    
+    def _copy_buffer(self, buffer, table_name, columns_str, key_columns=None, conflict_str="", versioned=()):
+        # empty unquoted csv fields are loaded as NULL
+        bump_query = self.versions.bump_query(*versioned) if versioned else None
+        if not key_columns:
+            copy_query = f"COPY {table_name} ({columns_str}) FROM STDIN WITH (FORMAT csv)"
+            
+            with self.db_handler.raw_cursor() as cursor:
+                cursor.copy_expert(copy_query, buffer)
+                if bump_query:
+                    cursor.execute(bump_query)
+            return
+        
+        # COPY cannot upsert: copy into a staging table dropped at commit, then merge it
+        staging = f"{table_name}_staging"
+        keys_str = ", ".join(key.lower() for key in key_columns)
+        
+        with self.db_handler.raw_cursor() as cursor:
+            cursor.execute(f"CREATE TEMP TABLE {staging} (LIKE {table_name} INCLUDING DEFAULTS) ON COMMIT DROP")
+            cursor.copy_expert(f"COPY {staging} ({columns_str}) FROM STDIN WITH (FORMAT csv)", buffer)
+            cursor.execute(f"""INSERT INTO {table_name} ({columns_str})
+                               SELECT DISTINCT ON ({keys_str}) {columns_str} FROM {staging}{conflict_str}""")
+            if bump_query:
+                cursor.execute(bump_query)
+    
+    def _report(self, table_name, n_rows, start):
+        elapsed = time.perf_counter() - start
+        rate = n_rows / elapsed if elapsed > 0 else float("inf")
+        self.logger.info(f"Loaded {n_rows} rows into {table_name} in {elapsed:.2f}s ({rate:.0f} rows/s)")
+        return n_rows
 
 
 # class Loader:
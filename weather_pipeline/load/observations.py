@@ -0,0 +1,80 @@
+from weather_pipeline.utils import _get_logger
+
+OBSERVATIONS_TABLE = "observations"
+
+OBSERVATIONS_COL_TYPES = [("station_ID", "VARCHAR NOT NULL"), ("DATE", "DATE NOT NULL"),
+                          ("ELEMENT", "VARCHAR NOT NULL"), ("DATA_VALUE", "REAL")]
+
+# natural key of an observation, the partition keys have to be part of it
+OBSERVATIONS_KEY = ["ELEMENT", "station_ID", "DATE"]
+
+# created on every partition once the load is done, the primary key already covers (element, station, date)
+OBSERVATIONS_INDEXES = [("brin", ["DATE"])]
+
+
+class ObservationsStore:
+    """ObservationsStore
+
+    Single `observations` table holding the rows of every station,
+    declaratively partitioned by LIST (element) and each element
+    partition by RANGE (date) into yearly partitions:
+
+        observations
+        └── observations_tmax            FOR VALUES IN ('TMAX')
+            ├── observations_tmax_1990   FOR VALUES FROM ('1990-01-01') TO ('1991-01-01')
+            └── ...
+
+    Partitions are created on demand for the elements and years found
+    in the loaded rows, queries filtering on element and date only scan
+    the matching partitions. The partitions known to exist are cached
+    for the whole process.
+
+    Methods:
+    -------
+    load(data, upsert)
+    Loads a DataFrame of (ID, DATE, ELEMENT, DATA_VALUE) rows, DATE
+    being parsed to datetime, creating the partitions it needs. With
+    `upsert` rows already present for their key are updated in place.
+    """
+
+    # partitions created (or found) by this process
+    _partitions = set()
+
+    def __init__(self, loader) -> None:
+        self.logger = _get_logger(name=__name__)
+        self.loader = loader
+
+    def create(self) -> None:
+        if OBSERVATIONS_TABLE in self._partitions:
+            return
+        self.loader.create_table_if_not_exists(OBSERVATIONS_TABLE, OBSERVATIONS_COL_TYPES,
+                                               primary_key=OBSERVATIONS_KEY, partition_by="LIST (element)")
+        self._partitions.add(OBSERVATIONS_TABLE)
+
+    def ensure_partitions(self, element, years) -> None:
+        self.create()
+
+        element_partition = f"{OBSERVATIONS_TABLE}_{element.lower()}"
+        if element_partition not in self._partitions:
+            self.loader.create_partition_if_not_exists(OBSERVATIONS_TABLE, element_partition,
+                                                       f"FOR VALUES IN ('{element}')", partition_by="RANGE (date)")
+            self._partitions.add(element_partition)
+
+        for year in years:
+            year_partition = f"{element_partition}_{year}"
+            if year_partition in self._partitions:
+                continue
+            self.loader.create_partition_if_not_exists(element_partition, year_partition,
+                                                       f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')")
+            self._partitions.add(year_partition)
+
+    def load(self, data, upsert:bool=False) -> int:
+        years = data["DATE"].dt.year
+        for element, element_years in years.groupby(data["ELEMENT"], observed=True):
+            self.ensure_partitions(str(element), sorted(element_years.unique()))
+
+        # the TMAX / TMIN views read the partitions of their element
+        return self.loader.load_csv_to_db(data[["ID", "DATE", "ELEMENT", "DATA_VALUE"]],
+                                          table_name=OBSERVATIONS_TABLE, columns=OBSERVATIONS_COL_TYPES,
+                                          key_columns=OBSERVATIONS_KEY if upsert else None,
+                                          versioned=[OBSERVATIONS_TABLE, *data["ELEMENT"].astype(str).unique()])
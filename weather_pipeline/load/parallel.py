@@ -0,0 +1,106 @@
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from weather_pipeline.utils import _get_logger
+from weather_pipeline.db_handler import DbHandler
+from weather_pipeline.load.loader import Loader
+
+# Loader of the current worker process, bound to the worker's own engine
+_worker_loader = None
+
+
+def _init_worker(config_file, host) -> None:
+    global _worker_loader
+    # a forked worker inherits the pooled connections of the parent, sharing them would interleave
+    # both processes on one socket
+    DbHandler.dispose_inherited()
+    _worker_loader = Loader(DbHandler(config_file=config_file, host=host))
+
+
+def _run_job(job, key):
+    return job(_worker_loader, key)
+
+
+class LoadReport:
+    """LoadReport
+
+    Outcome of a batch of loads, keyed by the job key (e.g. the station id).
+
+    Attributes:
+    ----------
+    succeeded (list): keys of the jobs that loaded their data.
+    skipped (list): keys of the jobs that had nothing to load.
+    failed (dict): key -> exception raised by the job.
+    """
+
+    def __init__(self) -> None:
+        self.succeeded = []
+        self.skipped = []
+        self.failed = {}
+
+    def record(self, key, loaded) -> None:
+        if loaded:
+            self.succeeded.append(key)
+        else:
+            self.skipped.append(key)
+
+    def __repr__(self) -> str:
+        return f"LoadReport(succeeded={len(self.succeeded)}, skipped={len(self.skipped)}, " \
+            f"failed={len(self.failed)})"
+
+
+class ParallelLoader:
+    """ParallelLoader
+
+    Spreads load jobs across a pool of worker processes. Every worker
+    opens its own DbHandler (engine and connections) from the config
+    file, so nothing database related crosses process boundaries.
+    At most `max_in_flight` jobs are submitted at a time, a failing
+    job is collected in the returned LoadReport and does not stop the
+    others.
+
+    Methods:
+    -------
+    run(keys, job)
+    Calls `job(loader, key)` in the workers for every key and returns
+    a LoadReport. `job` must be picklable (a module level function or
+    a functools.partial of one) and return False when it skipped the key.
+    """
+
+    def __init__(self, processes:int, max_in_flight:int=None, config_file:str='tmp/config.ini',
+                 host:str='default') -> None:
+        self.logger = _get_logger(name=__name__)
+        self.processes = processes
+        self.max_in_flight = max_in_flight or 2 * processes
+        self.config_file = config_file
+        self.host = host
+
+    def run(self, keys, job) -> LoadReport:
+        report = LoadReport()
+        keys = iter(keys)
+
+        with ProcessPoolExecutor(max_workers=self.processes, initializer=_init_worker,
+                                 initargs=(self.config_file, self.host)) as executor:
+            in_flight = {}
+
+            def submit_next():
+                for key in keys:
+                    in_flight[executor.submit(_run_job, job, key)] = key
+                    return True
+                return False
+
+            while len(in_flight) < self.max_in_flight and submit_next():
+                pass
+
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = in_flight.pop(future)
+                    try:
+                        report.record(key, future.result() is not False)
+                    except Exception as e:
+                        self.logger.error(f"Load job failed: {key} => {e}")
+                        report.failed[key] = e
+                    submit_next()
+
+        self.logger.info(f"Loads finished: {report}")
+        return report
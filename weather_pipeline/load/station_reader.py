@@ -0,0 +1,46 @@
+from pathlib import Path
+
+import pandas as pd
+
+from weather_pipeline.config import STATION_CHUNK_SIZE
+
+# layout of the by_station/{station_id}.csv.gz files
+STATION_COLUMNS = ["ID", "DATE", "ELEMENT", "DATA_VALUE", "M-FLAG", "Q-FLAG", "S-FLAG", "OBS-TIME"]
+
+# compact dtypes, a station file repeats the same id and a handful of elements on every row
+STATION_DTYPES = {"ID": "category", "DATE": "int32", "ELEMENT": "category", "DATA_VALUE": "int32",
+                  "M-FLAG": "category", "Q-FLAG": "category", "S-FLAG": "category", "OBS-TIME": "string"}
+
+
+def read_station_chunks(source, chunksize:int=STATION_CHUNK_SIZE, columns=None, elements=None):
+    """
+    Parses a station file chunk by chunk, yielding DataFrames of at most `chunksize` rows.
+    The next chunk is only read once the caller is done with the previous one, so
+    memory stays bounded by the chunk size whatever the size of the file.
+    Args:
+        source: path of a station file, gunzipped on the fly when it ends with '.gz',
+            or a binary file-like of the uncompressed rows (e.g. webSource.stream()).
+        chunksize (int): Number of rows per chunk.
+        columns (list): Subset of STATION_COLUMNS to parse, all of them by default.
+            DATE is parsed to datetime, the other columns use STATION_DTYPES.
+        elements (list): Only keep the rows of these ELEMENT codes (e.g. ['TMAX', 'TMIN']),
+            all the rows when empty. Chunks without any matching row are not yielded.
+    """
+
+    is_path = isinstance(source, (str, Path))
+    compression = "gzip" if is_path and str(source).endswith(".gz") else None
+    columns = columns or STATION_COLUMNS
+    parsed_columns = columns if not elements or "ELEMENT" in columns else columns + ["ELEMENT"]
+
+    reader = pd.read_csv(source, header=None, names=STATION_COLUMNS, usecols=parsed_columns,
+                         dtype={col: STATION_DTYPES[col] for col in parsed_columns},
+                         chunksize=chunksize, compression=compression)
+    with reader:
+        for chunk in reader:
+            if elements:
+                chunk = chunk[chunk["ELEMENT"].isin(elements)]
+                if chunk.empty:
+                    continue
+            if "DATE" in chunk:
+                chunk = chunk.assign(DATE=pd.to_datetime(chunk["DATE"].astype(str), format="%Y%m%d"))
+            yield chunk[columns]
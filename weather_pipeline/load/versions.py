@@ -0,0 +1,114 @@
+import threading
+import time
+
+from sqlalchemy.exc import IntegrityError, ProgrammingError
+
+from weather_pipeline.config import DATA_VERSIONS_TTL
+
+VERSIONS_TABLE = "data_versions"
+
+
+class DataVersions:
+    """DataVersions
+
+    Data version counter of every table, bumped by the loaders each time
+    they write into it, in the transaction of the write: a version never
+    moves without the rows, nor the rows without the version. The
+    counters are kept in the `data_versions` table, one row per table,
+    shared by every process and host of the database. A version is
+    '{epoch} {counter}', the epoch being drawn when the row is created:
+    a wiped schema never gives back a version seen before.
+    The versions read are reused by the process for `ttl` seconds, the
+    writes of the process itself being seen at once.
+
+    Methods:
+    -------
+    get(tables)
+    Returns {table: version} of the tables, lower-cased, '0' for the
+    tables never written.
+
+    clear()
+    Forgets the versions read and the tables created by the process.
+
+    bump_query(*tables)
+    Statement moving the version of every table forward, run as the
+    last statement of the transaction writing the tables.
+
+    bump(*tables)
+    Moves the version of every table forward in its own transaction.
+    """
+
+    # databases whose versions table exists, and the versions read, {(database, table): (version, read_at)},
+    # shared by the instances of the process
+    _created = set()
+    _cache = {}
+    _lock = threading.Lock()
+
+    def __init__(self, db_handler, ttl:float=DATA_VERSIONS_TTL) -> None:
+        self.db_handler = db_handler
+        self.ttl = ttl
+        self._database = str(db_handler.engine.url)
+
+    @classmethod
+    def clear(cls) -> None:
+        with cls._lock:
+            cls._created.clear()
+            cls._cache.clear()
+
+    def create(self) -> None:
+        if self._database in self._created:
+            return
+        try:
+            self.db_handler.execute_query(f"""CREATE TABLE IF NOT EXISTS {VERSIONS_TABLE} (
+                                                  table_name VARCHAR PRIMARY KEY,
+                                                  epoch VARCHAR NOT NULL DEFAULT substr(md5(random()::text), 1, 8),
+                                                  counter BIGINT NOT NULL,
+                                                  updated_at TIMESTAMP NOT NULL DEFAULT now());""")
+        except (IntegrityError, ProgrammingError) as e:
+            # created concurrently by another loader process
+            if getattr(e.orig, "pgcode", None) not in ("23505", "42P07"):
+                raise
+        with self._lock:
+            self._created.add(self._database)
+
+    def get(self, tables) -> dict:
+        self.create()
+        now = time.monotonic()
+        versions = {}
+        with self._lock:
+            for table in {table.lower() for table in tables}:
+                version, read_at = self._cache.get((self._database, table), (None, None))
+                if version is not None and now - read_at < self.ttl:
+                    versions[table] = version
+        
+        missing = sorted({table.lower() for table in tables} - set(versions))
+        if not missing:
+            return versions
+        names_str = ", ".join(f"'{table}'" for table in missing)
+        result = self.db_handler.execute_query(f"""SELECT table_name, epoch, counter FROM {VERSIONS_TABLE}
+                                                   WHERE table_name IN ({names_str});""")
+        read = {table: "0" for table in missing}
+        read.update({table: f"{epoch} {counter}" for table, epoch, counter in result})
+        with self._lock:
+            self._cache.update({(self._database, table): (version, now) for table, version in read.items()})
+        return {**versions, **read}
+
+    def bump_query(self, *tables) -> str:
+        self.create()
+        names = sorted({table.lower() for table in tables})
+        self._forget(names)
+        # rows locked in the same order by every writer, concurrent loads cannot deadlock on them
+        values_str = ", ".join(f"('{table}', 1)" for table in names)
+        return f"""INSERT INTO {VERSIONS_TABLE} (table_name, counter) VALUES {values_str}
+                   ON CONFLICT (table_name) DO UPDATE
+                   SET counter = {VERSIONS_TABLE}.counter + 1, updated_at = now();"""
+
+    def bump(self, *tables) -> None:
+        self.db_handler.execute_query(self.bump_query(*tables))
+        self._forget(table.lower() for table in tables)
+
+    def _forget(self, tables) -> None:
+        # read again from the database by the next get of the process
+        with self._lock:
+            for table in tables:
+                self._cache.pop((self._database, table), None)
@@ -0,0 +1,77 @@
+import pandas as pd
+
+from weather_pipeline.utils import _get_logger
+from weather_pipeline.config import STATION_STORAGE
+
+WATERMARKS_TABLE = "load_watermarks"
+
+
+class WatermarkStore:
+    """WatermarkStore
+
+    Per-station, per-element high-water marks of the incremental loads:
+    the date of the last observation loaded, kept in the `load_watermarks`
+    table. Rows on or before the watermark are skipped by the next loads.
+    The marks are kept per `storage` (STATION_STORAGE): the rows loaded
+    into one storage are still missing from the others.
+
+    Methods:
+    -------
+    get(station_id)
+    Returns {element: last loaded date} of the station.
+
+    filter(data, watermarks)
+    Drops the rows of a DataFrame of (DATE, ELEMENT, ..) rows that are
+    not newer than the watermark of their element.
+
+    advance(station_id, last_dates)
+    Moves the watermarks of the station forward to {element: date},
+    never backwards.
+    """
+
+    def __init__(self, db_handler, storage:str=STATION_STORAGE) -> None:
+        self.logger = _get_logger(name=__name__)
+        self.db_handler = db_handler
+        self.storage = storage
+
+    def create(self) -> None:
+        self.db_handler.execute_query(f"""CREATE TABLE IF NOT EXISTS {WATERMARKS_TABLE} (
+                                              storage VARCHAR,
+                                              station_id VARCHAR,
+                                              element VARCHAR,
+                                              last_date DATE NOT NULL,
+                                              updated_at TIMESTAMP NOT NULL DEFAULT now(),
+                                              PRIMARY KEY (storage, station_id, element));""")
+        result = self.db_handler.execute_query(f"""SELECT 1 FROM information_schema.columns
+                                                   WHERE table_schema = current_schema()
+                                                       AND table_name = '{WATERMARKS_TABLE}' AND column_name = 'storage';""")
+        if not list(result):
+            # marks of the loads before they were kept per storage, matching no storage: loaded again, as upserts
+            self.db_handler.execute_query(f"""ALTER TABLE {WATERMARKS_TABLE}
+                                                  ADD COLUMN storage VARCHAR NOT NULL DEFAULT '',
+                                                  DROP CONSTRAINT {WATERMARKS_TABLE}_pkey,
+                                                  ADD PRIMARY KEY (storage, station_id, element);""")
+
+    def get(self, station_id) -> dict:
+        result = self.db_handler.execute_query(f"""SELECT element, last_date FROM {WATERMARKS_TABLE}
+                                                   WHERE storage = '{self.storage}' AND station_id = '{station_id}';""")
+        return {element: pd.Timestamp(last_date) for element, last_date in result}
+
+    @staticmethod
+    def filter(data, watermarks):
+        if not watermarks:
+            return data
+        since = data["ELEMENT"].astype(str).map(watermarks)
+        return data[since.isna() | (data["DATE"] > since)]
+
+    def advance(self, station_id, last_dates) -> None:
+        if not last_dates:
+            return
+        values_str = ", ".join(f"('{self.storage}', '{station_id}', '{element}', '{last_date:%Y-%m-%d}')"
+                               for element, last_date in last_dates.items())
+        self.db_handler.execute_query(f"""INSERT INTO {WATERMARKS_TABLE} (storage, station_id, element, last_date)
+                                          VALUES {values_str}
+                                          ON CONFLICT (storage, station_id, element) DO UPDATE
+                                          SET last_date = GREATEST({WATERMARKS_TABLE}.last_date, EXCLUDED.last_date),
+                                              updated_at = now();""")
+        self.logger.info(f"Watermarks of {station_id} ({self.storage}) advanced to {last_dates}")
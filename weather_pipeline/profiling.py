@@ -0,0 +1,255 @@
+import datetime
+import hashlib
+import json
+import os
+import statistics
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+from sqlalchemy import text
+
+from weather_pipeline.utils import _get_logger
+from weather_pipeline.config import PROFILE_EXPLAIN, PROFILE_SINK, PROFILE_PATH, PROFILE_SLOWDOWN
+
+PROFILES_TABLE = "query_profiles"
+
+
+def plan_signature(plan) -> str:
+    """
+    Hash of the shape of an EXPLAIN (FORMAT JSON) plan: node types, relations and
+    indexes, without the costs and timings. Changes when the planner picks another plan.
+    """
+    def shape(node):
+        children = ",".join(shape(child) for child in node.get("Plans", []))
+        return f"{node['Node Type']}({node.get('Relation Name', '')}|{node.get('Index Name', '')})[{children}]"
+
+    return hashlib.md5(shape(plan["Plan"]).encode()).hexdigest()
+
+
+class QueryProfiler:
+    """QueryProfiler
+
+    Opt-in profile of the statements run by a DbHandler (`profiler`
+    attribute): execution time and rows of every statement and, with
+    `explain`, the EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) plan of the
+    statements returning rows, with their shared buffer hits / reads.
+    The plan is captured by running the statement a second time inside
+    a transaction that is rolled back, so profiling with `explain` about
+    doubles the cost of the queries.
+
+    Records are keyed by the template and parameters set by Transform
+    (see labelled) and by the hash of the sql otherwise, and grouped by
+    `run_id`: the one given, else the Airflow run of the task executing
+    the statement (AIRFLOW_CTX_DAG_RUN_ID, only exported once the task
+    runs), else the time the profiler was created. They are appended to a
+    json lines file (`sink='file'`) or to the `query_profiles` table
+    (`sink='table'`).
+
+    Methods:
+    -------
+    labelled(template, params)
+    Context manager, the statements run inside it in the current thread
+    are recorded under the template and parameters.
+
+    record(db_handler, query, values, seconds, rows, returns_rows, label)
+    Records a statement run by the handler, under `label` (template,
+    params) when given, the label of the current thread otherwise.
+
+    load(run_id, db_handler)
+    Returns the records of the sink, of `run_id` only when given
+    (the 'table' sink reads them through `db_handler`).
+
+    compare(baseline_run_id, run_id, slowdown, db_handler)
+    Returns the regressions of a run against a previous one.
+    """
+
+    def __init__(self, explain:bool=PROFILE_EXPLAIN, sink:str=PROFILE_SINK, path=PROFILE_PATH, run_id=None) -> None:
+        if sink not in ("file", "table"):
+            raise ValueError(f"Unsupported profile sink: {sink}, expected 'file' or 'table'")
+        self.logger = _get_logger(name=__name__)
+        self.explain = explain
+        self.sink = sink
+        self.path = Path(path)
+        self._run_id = run_id
+        self._created_at = datetime.datetime.now().isoformat()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._table_created = False
+
+    @property
+    def run_id(self) -> str:
+        # read at every record: the profiler is created when the DAG is imported, before Airflow sets the run
+        return self._run_id or os.getenv("AIRFLOW_CTX_DAG_RUN_ID") or self._created_at
+
+    def label(self):
+        return getattr(self._local, "label", None)
+
+    @contextmanager
+    def labelled(self, template, params):
+        previous = getattr(self._local, "label", None)
+        self._local.label = (template, params)
+        try:
+            yield
+        finally:
+            self._local.label = previous
+
+    @staticmethod
+    def _explain(db_handler, query, values):
+        # EXPLAIN ANALYZE runs the statement, its changes are rolled back
+        with db_handler.engine.connect() as connection:
+            transaction = connection.begin()
+            try:
+                return connection.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}", values).scalar()[0]
+            finally:
+                transaction.rollback()
+
+    def record(self, db_handler, query, values, seconds, rows, returns_rows=True, label=None) -> dict:
+        template, params = label or self.label() or (None, None)
+        record = {
+            "run_id": self.run_id,
+            "template": template,
+            "params": params,
+            "query_hash": hashlib.md5(str(query).encode()).hexdigest(),
+            "recorded_at": datetime.datetime.now().isoformat(),
+            "seconds": seconds,
+            "rows": rows,
+            "shared_hit_blocks": None,
+            "shared_read_blocks": None,
+            "plan_signature": None,
+            "plan": None,
+        }
+
+        if self.explain and returns_rows:
+            try:
+                plan = self._explain(db_handler, query, values)
+            except Exception as e:
+                self.logger.warning(f"Could not explain {template or record['query_hash']} => {e}")
+            else:
+                record.update(shared_hit_blocks=plan["Plan"].get("Shared Hit Blocks"),
+                              shared_read_blocks=plan["Plan"].get("Shared Read Blocks"),
+                              plan_signature=plan_signature(plan), plan=plan)
+
+        self._write(db_handler, record)
+        self.logger.info(f"Profiled {template or record['query_hash']}: {seconds:.3f}s, {rows} rows, "
+                         f"buffers hit={record['shared_hit_blocks']} read={record['shared_read_blocks']}")
+        return record
+
+    def _write(self, db_handler, record) -> None:
+        if self.sink == "file":
+            line = json.dumps(record, default=str) + "\n"
+            with self._lock:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.path, "a") as fp:
+                    fp.write(line)
+            return
+
+        self._create_table(db_handler)
+        values = dict(record, params=json.dumps(record["params"], default=str),
+                      plan=json.dumps(record["plan"]) if record["plan"] is not None else None)
+        # written outside of execute_query, it would profile its own inserts
+        with db_handler.engine.begin() as connection:
+            connection.execute(text(f"""INSERT INTO {PROFILES_TABLE}
+                                        (run_id, template, params, query_hash, recorded_at, seconds, rows,
+                                         shared_hit_blocks, shared_read_blocks, plan_signature, plan)
+                                        VALUES (:run_id, :template, CAST(:params AS JSONB), :query_hash,
+                                                CAST(:recorded_at AS TIMESTAMP), :seconds, :rows, :shared_hit_blocks,
+                                                :shared_read_blocks, :plan_signature, CAST(:plan AS JSONB))"""), values)
+
+    def _create_table(self, db_handler) -> None:
+        if self._table_created:
+            return
+        with db_handler.engine.begin() as connection:
+            connection.execute(f"""CREATE TABLE IF NOT EXISTS {PROFILES_TABLE} (
+                                       run_id VARCHAR NOT NULL,
+                                       template VARCHAR,
+                                       params JSONB,
+                                       query_hash VARCHAR NOT NULL,
+                                       recorded_at TIMESTAMP NOT NULL,
+                                       seconds DOUBLE PRECISION NOT NULL,
+                                       rows BIGINT,
+                                       shared_hit_blocks BIGINT,
+                                       shared_read_blocks BIGINT,
+                                       plan_signature VARCHAR,
+                                       plan JSONB);""")
+        self._table_created = True
+
+    def load(self, run_id=None, db_handler=None) -> list:
+        if self.sink == "file":
+            if not self.path.exists():
+                return []
+            with open(self.path) as fp:
+                records = [json.loads(line) for line in fp if line.strip()]
+            return [record for record in records if run_id is None or record["run_id"] == run_id]
+
+        if db_handler is None:
+            raise ValueError("Loading the profiles of the 'table' sink needs a db_handler")
+        with db_handler.engine.connect() as connection:
+            result = connection.execute(text(f"""SELECT run_id, template, params, query_hash, seconds, rows,
+                                                        shared_hit_blocks, shared_read_blocks, plan_signature
+                                                 FROM {PROFILES_TABLE}
+                                                 WHERE :run_id IS NULL OR run_id = :run_id"""), {"run_id": run_id})
+            return [dict(row._mapping) for row in result]
+
+    @staticmethod
+    def _key(record):
+        if record["template"] is None:
+            return record["query_hash"]
+        return f"{record['template']}:{json.dumps(record['params'], sort_keys=True, default=str)}"
+
+    @classmethod
+    def _summarize(cls, records) -> dict:
+        groups = {}
+        for record in records:
+            groups.setdefault(cls._key(record), []).append(record)
+
+        summaries = {}
+        for key, group in groups.items():
+            blocks = [(r["shared_hit_blocks"] or 0) + (r["shared_read_blocks"] or 0)
+                      for r in group if r["shared_hit_blocks"] is not None]
+            summaries[key] = {
+                "template": group[0]["template"],
+                "params": group[0]["params"],
+                "seconds": statistics.median(r["seconds"] for r in group),
+                "blocks": max(blocks) if blocks else None,
+                "plan_signature": group[-1]["plan_signature"],
+            }
+        return summaries
+
+    @classmethod
+    def compare_records(cls, baseline, current, slowdown:float=PROFILE_SLOWDOWN, min_seconds:float=0.01) -> list:
+        """
+        Compares the records of two runs statement by statement (median time of the repeated ones).
+        A statement regressed when it got `slowdown` times slower (and at least `min_seconds` slower),
+        touched `slowdown` times more buffers or changed plan. Returns one dict per regression.
+        """
+        before = cls._summarize(baseline)
+        regressions = []
+        for key, after in cls._summarize(current).items():
+            previous = before.get(key)
+            if previous is None:
+                continue
+
+            reasons = []
+            if after["seconds"] > previous["seconds"] * slowdown and after["seconds"] - previous["seconds"] >= min_seconds:
+                reasons.append("slower")
+            if previous["blocks"] and after["blocks"] is not None and after["blocks"] > previous["blocks"] * slowdown:
+                reasons.append("more buffers")
+            if previous["plan_signature"] and after["plan_signature"] and \
+                    after["plan_signature"] != previous["plan_signature"]:
+                reasons.append("plan changed")
+
+            if reasons:
+                regressions.append({"key": key, "template": after["template"], "params": after["params"],
+                                    "reasons": reasons, "baseline_seconds": previous["seconds"],
+                                    "seconds": after["seconds"], "baseline_blocks": previous["blocks"],
+                                    "blocks": after["blocks"]})
+        return regressions
+
+    def compare(self, baseline_run_id, run_id=None, slowdown:float=PROFILE_SLOWDOWN, db_handler=None) -> list:
+        regressions = self.compare_records(self.load(baseline_run_id, db_handler),
+                                           self.load(run_id or self.run_id, db_handler), slowdown=slowdown)
+        for regression in regressions:
+            self.logger.warning(f"Query regression {regression['key']}: {', '.join(regression['reasons'])} "
+                                f"({regression['baseline_seconds']:.3f}s -> {regression['seconds']:.3f}s)")
+        return regressions
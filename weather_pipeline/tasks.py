@@ -4,15 +4,37 @@ import gzip
 import shutil
 import json
 import os
+import functools
+import itertools
+from contextlib import contextmanager
+import hashlib
 
 
-from weather_pipeline.extract import Extractor
+from weather_pipeline.extract import Extractor, request_stats
+from weather_pipeline.extract.extractor import read_checksums
+from weather_pipeline.extract.downloader import ConcurrentDownloader, DownloadReport
+from weather_pipeline.extract.manifest import DownloadManifest, NOT_MODIFIED
 from weather_pipeline.load import Loader
-from weather_pipeline.transform import Transform
+from weather_pipeline.load.station_reader import read_station_chunks
+from weather_pipeline.load.parallel import ParallelLoader, LoadReport
+from weather_pipeline.load.observations import ObservationsStore, OBSERVATIONS_TABLE, OBSERVATIONS_INDEXES
+from weather_pipeline.load.watermarks import WatermarkStore
+from weather_pipeline.load.versions import DataVersions
+from weather_pipeline.transform import Transform, sql_queries
+from weather_pipeline.transform.export import write_json_object
+from weather_pipeline.transform.geo_index import GeoIndex
+from weather_pipeline.transform.summaries import SummaryRegistry
+from weather_pipeline.transform.climatology import Climatology
+from weather_pipeline.checkpoints import CheckpointStore
 from weather_pipeline.db_handler import DbHandler
 
 from weather_pipeline.utils import _get_logger, station_url, station_data_url, cities_csv_url
-from weather_pipeline.config import LOADER_DESTINATION, LOADER_CONNECTION_STRING, S3_BUCKET, S3_DIR
+from weather_pipeline.config import LOADER_DESTINATION, LOADER_CONNECTION_STRING, S3_BUCKET, S3_DIR, \
+    EXTRACT_MODE, EXTRACT_MAX_WORKERS, EXTRACT_PER_HOST_LIMIT, EXTRACT_MANIFEST, EXTRACT_DECOMPRESS, \
+    EXTRACT_CHECKSUMS, STATION_LOAD_MODE, STATION_CHUNK_SIZE, STATION_ELEMENTS, STATION_STORAGE, \
+    STATION_LOAD_PROCESSES, STATION_LOAD_LIMIT, LOAD_INCREMENTAL, PIPELINE_CHECKPOINTS, DIMENSION_BUILD_MODE, \
+    DIMENSION_BUILD_BATCH, \
+    STATION_MATCH_MODE
 
 from aws_tasks import s3_single_upload, s3_multipart_upload
 
@@ -20,30 +42,65 @@ logger = _get_logger(name=__name__)
 
 db_handler = DbHandler(host='default')
 
+# columns of the per-element dimension tables (TMAX, TMIN, ..)
+DIMENSION_COL_TYPES = [("station_ID", "VARCHAR"), ("DATE", "DATE"), ("value", "REAL")]
 
-def ingest_extract_cities() -> None:
+# natural key of a dimension table row, used by the incremental upserts
+DIMENSION_KEY = ["station_ID", "DATE"]
+
+# indexes of the dimension tables, created once they are loaded
+DIMENSION_INDEXES = [("btree", ["station_ID", "DATE"]), ("btree", ["DATE"])]
+
+# checkpoint names of the per-station tasks
+EXTRACT_STATION_TASK = "extract_station_data"
+LOAD_STATION_TASK = "load_station_data"
+CITY_STATIONS_TASK = "city_nearest_stations"
+
+# checkpoint names of the cities / stations loads, keyed by the url of their file
+LOAD_CITIES_TASK = "load_cities"
+LOAD_STATIONS_TASK = "load_stations"
+
+# k nearest stations of every city, refreshed by transform_city_nearest_stations
+CITY_STATIONS_TABLE = "city_nearest_stations"
+CITY_STATIONS_COL_TYPES = [("CITY", "VARCHAR"), ("STATION_ID", "VARCHAR"), ("STATION_RANK", "INTEGER"), 
+                           ("DISTANCE", "REAL")]
+
+
+def ingest_extract_cities() -> str:
     """
     Extracts city data from a web source and saves it to a temporary CSV file.
+    Returns the download status, NOT_MODIFIED when the upstream file did not change.
     """
     
     logger.info("Extracting and loading cities..")
     url = cities_csv_url
     
     # define extractor
-    extractor = Extractor(source_type="web", source_url=url, temp_location="tmp/cities.csv")
+    extractor = Extractor(source_type="web", source_url=url, temp_location="tmp/cities.csv",
+                          manifest=DownloadManifest(EXTRACT_MANIFEST))
     
     # init extractor
     web_extractor = extractor.init()
-    web_extractor.get(chunk_size=10000)
+    status = web_extractor.get(chunk_size=10000)
     
-    logger.info("Extraction of cities: Done")
+    logger.info(f"Extraction of cities: Done ({status})")
+    return status
 
 
-def ingest_load_cities() -> None:
+def ingest_load_cities(skip_unchanged=True) -> None:
     """
     Loads city data from the temporary CSV file to the 'cities' table in the database.
+    Args:
+        skip_unchanged (bool): Skip the load when the last extraction found the file not modified
+            and the last load of that file completed (checkpointed in the 'pipeline_checkpoints' table).
     """
     
+    checkpoints = CheckpointStore(db_handler)
+    checkpoints.create()
+    if skip_unchanged and _load_completed(checkpoints, LOAD_CITIES_TASK, cities_csv_url):
+        logger.info("Cities file not modified since last load, skipping")
+        return
+    
     col_name_types = [("CITY", "VARCHAR PRIMARY KEY"), ("LATITUDE", "REAL"), ("LONGITUDE", "REAL")]
     
     cities_data = pd.read_csv("tmp/cities.csv")
@@ -56,32 +113,45 @@ def ingest_load_cities() -> None:
     
     # define loader
     loader = Loader(db_handler) 
-    loader.load_csv_to_db(cities_data, table_name = "cities", columns=col_name_types)
+    with _load_checkpoint(checkpoints, LOAD_CITIES_TASK, cities_csv_url):
+        loader.load_csv_to_db(cities_data, table_name = "cities", columns=col_name_types)
 
 
-def ingest_extract_stations() -> None:
+def ingest_extract_stations() -> str:
     """
     Extracts station data from a web source and saves it to a temporary CSV file.
+    Returns the download status, NOT_MODIFIED when the upstream file did not change.
     """
     
     logger.info("Extracting and loading cities..")
     url = station_url
     
     # define extractor
-    extractor = Extractor(source_type="web", source_url=url, temp_location="tmp/stations.csv")
+    extractor = Extractor(source_type="web", source_url=url, temp_location="tmp/stations.csv",
+                          manifest=DownloadManifest(EXTRACT_MANIFEST))
     
     # init extractor
     web_extractor = extractor.init()
-    web_extractor.get(chunk_size=10000)
+    status = web_extractor.get(chunk_size=10000)
     
-    logger.info("Extraction of stations: Done")
+    logger.info(f"Extraction of stations: Done ({status})")
+    return status
     
     
-def ingest_load_stations() -> None:
+def ingest_load_stations(skip_unchanged=True) -> None:
     """
     Loads station data from the temporary CSV file to the 'stations' table in the database.
+    Args:
+        skip_unchanged (bool): Skip the load when the last extraction found the file not modified
+            and the last load of that file completed (checkpointed in the 'pipeline_checkpoints' table).
     """
     
+    checkpoints = CheckpointStore(db_handler)
+    checkpoints.create()
+    if skip_unchanged and _load_completed(checkpoints, LOAD_STATIONS_TASK, station_url):
+        logger.info("Stations file not modified since last load, skipping")
+        return
+    
     col_name_types = [("ID", "VARCHAR"), ("LATITUDE", "REAL"), ("LONGITUDE", "REAL"), 
                 ("ELEVATION", "REAL"), ("STATE", "VARCHAR"), ("NAME", "VARCHAR"), 
                 ("GSN FLAG", "VARCHAR"), ("HCN/CRN FLAG", "VARCHAR"), 
@@ -106,19 +176,67 @@ def ingest_load_stations() -> None:
     
     # define loader
     loader = Loader(db_handler) 
-    loader.load_csv_to_db(stations_data, table_name = "stations", columns=req_col_name_type)
+    with _load_checkpoint(checkpoints, LOAD_STATIONS_TASK, station_url):
+        loader.load_csv_to_db(stations_data, table_name = "stations", columns=req_col_name_type)
 
 
-def transform_stations():
+def _load_completed(checkpoints, task, url, key=None) -> bool:
+    """
+    True when the last extraction found the file of `url` not modified and its last load under `task`
+    (checkpointed under `key`, the url by default) completed for that same content. A load that failed
+    partway is done again.
+    """
+    
+    key = key or url
+    manifest = DownloadManifest.cached(EXTRACT_MANIFEST)
+    if not manifest.is_unchanged(url):
+        return False
+    return CheckpointStore.is_done(checkpoints.completed(task, key=key), key, _station_content_hash(manifest, url))
+
+
+@contextmanager
+def _load_checkpoint(checkpoints, task, url):
+    """
+    Checkpoints the load of the file of `url` under `task`: done for its content once the block
+    completes, failed (loaded again by the next run) when it raises.
+    """
+    
+    try:
+        yield
+    except Exception as e:
+        checkpoints.mark_failed(task, url, e)
+        raise
+    checkpoints.mark_done(task, url, _station_content_hash(DownloadManifest.cached(EXTRACT_MANIFEST), url))
+
+
+def transform_stations(mode=STATION_MATCH_MODE) -> None:
     """
     Transforms the 'stations' table in the database by adding a 'city' column and updating it
     based on the closest city using latitude and longitude.
+    Args:
+        mode (str): 'INDEX' looks the closest city of every station up in a nearest neighbour index
+            of the cities (cached on disk until the cities change) and writes them back with one
+            bulk UPDATE, 'SQL' ranks every (city, station) pair inside the database.
     """
     
     db_handler.execute_query(f"""ALTER TABLE stations
-                                    ADD city VARCHAR; """)
+                                    ADD COLUMN IF NOT EXISTS city VARCHAR; """)
+    
+    if mode == "INDEX":
+        city_index = GeoIndex.from_table(db_handler, "cities", id_column="city")
+        result = db_handler.execute_query("""SELECT id, latitude, longitude FROM stations 
+                                             WHERE latitude IS NOT NULL AND longitude IS NOT NULL;""")
+        stations = pd.DataFrame(list(result), columns=["ID", "LATITUDE", "LONGITUDE"])
+        if stations.empty or not len(city_index):
+            return
+        
+        _, closest_cities = city_index.nearest(stations["LATITUDE"], stations["LONGITUDE"])
+        Loader(db_handler).update_from_frame(pd.DataFrame({"ID": stations["ID"], "CITY": closest_cities}), 
+                                             table_name="stations", columns=[("ID", "VARCHAR"), ("CITY", "VARCHAR")],
+                                             key_columns=["ID"])
+        return
     
-    db_handler.execute_query(f"""UPDATE stations
+    db_handler.execute_batch([f"""UPDATE stations
                                     SET city = closest.city
                                     FROM (
                                         SELECT
@@ -130,14 +248,102 @@ def transform_stations():
                                             CROSS JOIN stations
                                     ) AS closest
                                     WHERE stations.id = closest.id AND closest.rn = 1;
-                             """)
+                             """, DataVersions(db_handler).bump_query("stations")])
     # rows = db_handler.execute_query(f"SELECT * FROM stations LIMIT 100;")
     # print([row for row in rows])
         
         
-def ingest_extract_station_data() -> None:
+def _station_content_hash(manifest, url):
+    """
+    Hash of the last downloaded station file (sha256, or the ETag when no checksum was recorded), None if unknown.
+    """
+    
+    entry = manifest.entry(url) if manifest is not None else None
+    if entry is None:
+        return None
+    return entry.get("checksum") or entry.get("etag")
+
+
+def _extract_station(station_id, url_template=station_data_url, manifest=None, decompress=EXTRACT_DECOMPRESS,
+                     checkpoints=None, run_id=None, checksums=None) -> str:
+    """
+    Downloads the data of a single station and unzips it when `decompress` is set, raises on failure.
+    The file is verified against its sha256 in `checksums` ({file name: sha256}) when listed there.
+    The station is checkpointed as done in `checkpoints` (CheckpointStore) when given.
+    Returns the download status of the station file.
+    """
+    
+    status = _download_station(station_id, url_template, manifest, decompress, checksums)
+    if checkpoints is not None:
+        checkpoints.mark_done(EXTRACT_STATION_TASK, station_id, 
+                              _station_content_hash(manifest, url_template.format(station_id=station_id)), run_id)
+    return status
+
+
+def _download_station(station_id, url_template, manifest, decompress, checksums=None) -> str:
+    """
+    Downloads (and unzips) the station file, see `_extract_station`.
+    """
+    
+    station_data_pth = f"tmp/{station_id}.csv.gz"
+    station_csv_pth = f"tmp/{station_id}.csv"
+    
+    # define extractor
+    extractor = Extractor(source_type="web", source_url=url_template.format(station_id=station_id), 
+                          temp_location=station_data_pth, manifest=manifest,
+                          checksum=(checksums or {}).get(f"{station_id}.csv.gz"))
+    web_extractor = extractor.init()
+    status = web_extractor.get(chunk_size=10000, raise_errors=True)
+    
+    if status == NOT_MODIFIED and (not decompress or os.path.exists(station_csv_pth)):
+        return status
+    
+    if not decompress:
+        # the load reads the .gz directly, the extractor verified its size: only check the gzip framing
+        _check_gzip(station_data_pth)
+        return status
+    
+    with gzip.open(station_data_pth, 'rb') as f_in:
+        with open(station_csv_pth, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+    
+    return status
+
+
+def _check_gzip(path):
+    """
+    Raises IOError when `path` is not framed as a gzip file: magic bytes `1f 8b` in front,
+    room for the 10 bytes header and the CRC32 / ISIZE trailer. Reads 2 bytes, not the archive.
+    """
+    
+    with open(path, 'rb') as file:
+        magic = file.read(2)
+        size = file.seek(0, os.SEEK_END)
+    if magic != b'\x1f\x8b' or size < 18:
+        raise IOError(f"{path} is not a gzip file ({size} bytes)")
+
+
+def ingest_extract_station_data(mode=EXTRACT_MODE, max_workers=EXTRACT_MAX_WORKERS, 
+                                per_host_limit=EXTRACT_PER_HOST_LIMIT, url_template=station_data_url,
+                                decompress=EXTRACT_DECOMPRESS, checkpoints=PIPELINE_CHECKPOINTS,
+                                run_id=None, checksums=EXTRACT_CHECKSUMS) -> DownloadReport:
     """
     Extracts yearly data for stations from a web source and saves it to temporary CSV files.
+    Args:
+        mode (str): 'CONCURRENT' downloads stations on a bounded thread pool, 'SEQUENTIAL' one after another.
+        max_workers (int): Maximum number of downloads in flight (CONCURRENT mode).
+        per_host_limit (int): Maximum number of downloads in flight against a single host (CONCURRENT mode).
+        url_template (str): Station data url, formatted with `station_id`. Can point to a local HTTP server.
+        decompress (bool): Also write the uncompressed tmp/{station_id}.csv, only needed by the 'PG_CONN' load mode.
+        checkpoints (bool): Record every station done or failed in the 'pipeline_checkpoints' table.
+        run_id (str): Id of the pipeline run (e.g. the Airflow run_id). A retry of the same run skips the
+            stations it already downloaded and only fetches the failed ones. Stations whose last download
+            failed are retried by every run.
+        checksums (str): Published sha256 digests of the station files ('<sha256>  <file name>' lines, as written
+            by sha256sum). The files listed there are verified after download, a mismatch fails the station.
+            Without it only the size announced by the server is checked.
+    Returns:
+        DownloadReport with the succeeded, skipped (not modified upstream or already done) and failed station ids.
     """
  
     logger.info("Extracting and loading cities..")
@@ -148,72 +354,254 @@ def ingest_extract_station_data() -> None:
     
     print("stations_ids: ", station_ids)
     
-    for station_id in station_ids:
-        # define extractor
-        extractor = Extractor(source_type="web", source_url=station_data_url.format(station_id=station_id), 
-                              temp_location=f"tmp/{station_id}.csv.gz")
-        web_extractor = extractor.init()
-        web_extractor.get(chunk_size=10000)
-        
-        station_data_pth = f"tmp/{station_id}.csv.gz"
-        
-        try:
-            with gzip.open(station_data_pth, 'rb') as f_in:
-                with open(f'tmp/{station_id}.csv', 'wb') as f_out:
-                    shutil.copyfileobj(f_in, f_out)
-        except:
-            print(f"Unable to unzip : {station_id}")
-            db_handler.execute_query(f"""DELETE FROM stations where "ID"='{station_id}';""")
+    # written once when the downloads are done, not at every update of every station
+    manifest = DownloadManifest(EXTRACT_MANIFEST, autosave=False)
+    
+    checkpoint_store = None
+    done_station_ids = []
+    if checkpoints:
+        checkpoint_store = CheckpointStore(db_handler)
+        checkpoint_store.create()
+        if run_id:
+            # stations downloaded by a previous attempt of this run, whose file is still there
+            completed = checkpoint_store.completed(EXTRACT_STATION_TASK, run_id=run_id)
+            done_station_ids = [station_id for station_id in station_ids 
+                                if os.path.exists(f"tmp/{station_id}.csv.gz") and CheckpointStore.is_done(
+                                    completed, station_id,
+                                    _station_content_hash(manifest, url_template.format(station_id=station_id)))]
+            station_ids = [station_id for station_id in station_ids if station_id not in set(done_station_ids)]
+            logger.info(f"{len(done_station_ids)} stations already extracted by run {run_id}, skipping")
+    
+    extract_station = functools.partial(_extract_station, url_template=url_template, manifest=manifest, 
+                                        decompress=decompress, checkpoints=checkpoint_store, run_id=run_id,
+                                        checksums=read_checksums(checksums) if checksums else None)
+    
+    try:
+        if mode == "CONCURRENT":
+            downloader = ConcurrentDownloader(max_workers=max_workers, per_host_limit=per_host_limit)
+            report = downloader.run(
+                (station_id, url_template.format(station_id=station_id), functools.partial(extract_station, station_id))
+                for station_id in station_ids)
+        else:
+            report = DownloadReport()
+            for station_id in station_ids:
+                try:
+                    report.record(station_id, extract_station(station_id))
+                except Exception as e:
+                    report.failed[station_id] = e
+    finally:
+        manifest.flush()
+    report.skipped.extend(done_station_ids)
+    
+    for station_id, error in report.failed.items():
+        print(f"Unable to extract : {station_id}")
+        if checkpoint_store is not None:
+            checkpoint_store.mark_failed(EXTRACT_STATION_TASK, station_id, error, run_id)
              
-    logger.info("Extraction of stations yearly data: Done") 
+    logger.info(f"Extraction of stations yearly data: Done ({report})")
+    logger.info(f"HTTP request latency: {request_stats.snapshot()}")
+    return report
 
 
-def ingest_load_station_data(mode="PG_CONN") -> None:
+def ingest_load_station_data(mode=STATION_LOAD_MODE, skip_unchanged=True, url_template=station_data_url,
+                             chunksize=STATION_CHUNK_SIZE, processes=STATION_LOAD_PROCESSES, 
+                             limit=STATION_LOAD_LIMIT, incremental=LOAD_INCREMENTAL, 
+                             checkpoints=PIPELINE_CHECKPOINTS, run_id=None) -> LoadReport:
     """
     Loads yearly station data from temporary CSV files to corresponding tables in the database.
     Args:
-        mode (str): Mode for data loading, options are 'PG_CONN' for PostgreSQL connection or 'DMS' for AWS DMS.
+        mode (str): Mode for data loading, options are
+            'PG_CONN' reads the uncompressed tmp/{station_id}.csv,
+            'STREAM' gunzips tmp/{station_id}.csv.gz on the fly,
+            'WEB_STREAM' parses the HTTP body of the station file without touching the disk,
+            'DMS' for AWS DMS (not implemented yet, raises NotImplementedError).
+        skip_unchanged (bool): Skip the stations whose file was not modified upstream at the last extraction
+            and whose last load of that file completed (only without checkpoints, which already skip the
+            stations loaded from the same file). The loads are recorded in the 'pipeline_checkpoints' table.
+        url_template (str): Station data url used by the extraction, to look the stations up in the manifest.
+        chunksize (int): Number of rows parsed and loaded at a time, bounds the memory used per station.
+        processes (int): Number of worker processes loading stations in parallel, each with its own
+            database connection. 1 loads the stations one after another in this process.
+        limit (int): Only load the first `limit` stations, all of them when None.
+        incremental (bool): Only load the rows newer than the per-station, per-element watermarks
+            (last loaded date, in the 'load_watermarks' table), upserting them on their natural key.
+        checkpoints (bool): Record every station loaded or failed in the 'pipeline_checkpoints' table, with the
+            hash of the file it was loaded from. Stations already loaded from the same file are skipped, so a
+            retry only loads the failed stations and the ones whose file changed.
+        run_id (str): Id of the pipeline run (e.g. the Airflow run_id), recorded with the checkpoints.
+    Returns:
+        LoadReport with the succeeded, skipped and failed station ids.
     """
     
+    # fail the task once instead of every station
+    if mode == "DMS":
+        raise NotImplementedError("DMS ingestion of the station files is not implemented yet")
+    
     logger.info("Extracting and loading cities..")
     
     # get all station_id's
     result = db_handler.execute_query(f"""SELECT ID FROM stations;""")
-    station_ids = [row[0] for row in result]
+    station_ids = [row[0] for row in result][:limit]
+    
+    # the checkpoints of a storage say nothing about the others, skip_unchanged needs them as well
+    checkpoint_task = f"{LOAD_STATION_TASK}:{STATION_STORAGE}" if checkpoints or skip_unchanged else None
+    checkpoint_store = CheckpointStore(db_handler)
+    done_station_ids = []
+    if checkpoint_task:
+        checkpoint_store.create()
+    if checkpoints:
+        completed = checkpoint_store.completed(checkpoint_task)
+        manifest = DownloadManifest.cached(EXTRACT_MANIFEST)
+        done_station_ids = [station_id for station_id in station_ids if CheckpointStore.is_done(
+            completed, station_id, _station_content_hash(manifest, url_template.format(station_id=station_id)))]
+        station_ids = [station_id for station_id in station_ids if station_id not in set(done_station_ids)]
+        logger.info(f"{len(done_station_ids)} stations already loaded from the same file, skipping")
+    
+    load_station = functools.partial(_load_station, mode=mode, skip_unchanged=skip_unchanged and not checkpoints, 
+                                     url_template=url_template, chunksize=chunksize, incremental=incremental,
+                                     checkpoint_task=checkpoint_task, run_id=run_id)
+    
+    if incremental:
+        WatermarkStore(db_handler).create()
+    SummaryRegistry(db_handler).create()
+    
+    # shared by every worker, create them before the workers race for it (and before their indexes are
+    # built, whether any station had rows of the element or not)
+    if STATION_STORAGE == "element":
+        for element in STATION_ELEMENTS:
+            Loader(db_handler).create_table_if_not_exists(element, DIMENSION_COL_TYPES, 
+                                                          primary_key=DIMENSION_KEY if incremental else None)
+    
+    if processes > 1:
+        if STATION_STORAGE == "observations":
+            ObservationsStore(Loader(db_handler)).create()
+        report = ParallelLoader(processes=processes).run(station_ids, load_station)
+    else:
+        loader = Loader(db_handler)
+        report = LoadReport()
+        for station_id in station_ids:
+            try:
+                report.record(station_id, load_station(loader, station_id))
+            except Exception as e:
+                logger.error(f"Failed to load station {station_id} => {e}")
+                report.failed[station_id] = e
+    report.skipped.extend(done_station_ids)
+    
+    if checkpoint_task:
+        for station_id, error in report.failed.items():
+            checkpoint_store.mark_failed(checkpoint_task, station_id, error, run_id)
+    
+    # indexes are built once all the rows are in
+    if STATION_STORAGE == "element":
+        for element in STATION_ELEMENTS:
+            Loader(db_handler).create_indexes(element, DIMENSION_INDEXES, 
+                                              primary_key=DIMENSION_KEY if incremental else None)
+    elif STATION_STORAGE == "observations" and report.succeeded:
+        Loader(db_handler).create_indexes(OBSERVATIONS_TABLE, OBSERVATIONS_INDEXES)
+    
+    # the rollup cube follows the element tables, written by this load with the 'element' storage
+    if STATION_STORAGE == "element" and report.succeeded:
+        transform_refresh_summaries(elements=STATION_ELEMENTS)
+    
+    logger.info(f"Loading of stations yearly data: Done ({report})")
+    return report
+
+
+def _load_station(loader, station_id, mode=STATION_LOAD_MODE, skip_unchanged=True, url_template=station_data_url,
+                  chunksize=STATION_CHUNK_SIZE, incremental=LOAD_INCREMENTAL, checkpoint_task=None, run_id=None) -> bool:
+    """
+    Loads the data of a single station with `loader`, raises on failure.
+    The station is checkpointed as done under `checkpoint_task` once loaded, when given.
+    With `skip_unchanged` it is skipped when its file was not modified and its last load (under
+    `checkpoint_task`) completed. Returns False when the station was skipped.
+    """
     
-    loader = Loader(db_handler)
+    if mode != "WEB_STREAM" and skip_unchanged and checkpoint_task and \
+            _load_completed(CheckpointStore(loader.db_handler), checkpoint_task, 
+                            url_template.format(station_id=station_id), key=station_id):
+        logger.info(f"Station {station_id} not modified since last load, skipping")
+        return False
     
-    for station_id in station_ids[:5]:
-        # define extractor
-        if mode=="DMS":
-            print("DMS Ingestion: TBD")
-            # multipart upload -> s3_upload
-            # s3_multipart_upload(file_path=f"tmp/{station_id}.csv", 
-            #                     bucket_name="iambucketnew", 
-            #                     object_key=f"stations_data/{station_id}.csv",
-            #                     region_name='eu-central-1')
+    # define extractor
+    if mode=="DMS":
+        # multipart upload -> s3_upload
+        # s3_multipart_upload(file_path=f"tmp/{station_id}.csv", 
+        #                     bucket_name="iambucketnew", 
+        #                     object_key=f"stations_data/{station_id}.csv",
+        #                     region_name='eu-central-1')
+    
+        # create table {station_id}
         
-            # create table {station_id}
-            
-            # dms setup -> create_dms_task
-            # dms migrate -> migrate file
-            
-            continue
+        # dms setup -> create_dms_task
+        # dms migrate -> migrate file
+        raise NotImplementedError("DMS ingestion of the station files is not implemented yet")
+    elif mode=="WEB_STREAM":
+        extractor = Extractor(source_type="web", source_url=url_template.format(station_id=station_id))
+        with extractor.init().stream() as station_body:
+            _load_station_chunks(loader, station_id, station_body, chunksize, incremental=incremental)
+    elif mode=="STREAM":
+        _load_station_chunks(loader, station_id, f"tmp/{station_id}.csv.gz", chunksize, incremental=incremental)
+    else:
+        _load_station_chunks(loader, station_id, f"tmp/{station_id}.csv", chunksize, incremental=incremental)
+    
+    if checkpoint_task:
+        content_hash = _station_content_hash(DownloadManifest.cached(EXTRACT_MANIFEST), 
+                                             url_template.format(station_id=station_id))
+        CheckpointStore(loader.db_handler).mark_done(checkpoint_task, station_id, content_hash, run_id)
+    
+    return True
+
+
+def _load_station_chunks(loader, station_id, source, chunksize=STATION_CHUNK_SIZE, 
+                         elements=STATION_ELEMENTS, storage=STATION_STORAGE, incremental=LOAD_INCREMENTAL) -> None:
+    """
+    Parses a station file (path or file-like) chunk by chunk and loads every chunk, keeping only the
+    rows of `elements`. With the 'station' storage the rows go to the '{station_id}' table, with
+    the 'element' storage they are routed straight to the dimension table of their element (TMAX, TMIN, ..),
+    with the 'observations' storage they go to the partitioned 'observations' table.
+    When `incremental`, only the rows newer than the station's watermarks are loaded, as upserts on
+    their natural key, and the watermarks are advanced once the whole file is loaded.
+    The (element, year) partitions written are marked dirty for the rollup cube, with the 'station' storage
+    they are only staged until the dimension build copies them to the element tables.
+    """
+    
+    required_col_types = [("ID", "VARCHAR"), ("DATE", "DATE"), ("ELEMENT", "VARCHAR"), ("DATA_VALUE", "REAL")]
+    
+    watermark_store = WatermarkStore(loader.db_handler, storage=storage)
+    watermarks = watermark_store.get(station_id) if incremental else {}
+    last_dates = {}
+    element_years = {}
+    
+    # only the required columns are parsed, each chunk is loaded before the next one is read
+    for station_id_df in read_station_chunks(source, chunksize=chunksize, columns=[t[0] for t in required_col_types],
+                                             elements=elements):
+        if incremental:
+            station_id_df = WatermarkStore.filter(station_id_df, watermarks)
+            if station_id_df.empty:
+                continue
+            for element, last_date in station_id_df.groupby("ELEMENT", observed=True)["DATE"].max().items():
+                last_dates[str(element)] = max(last_date, last_dates.get(str(element), last_date))
+        
+        for element, dates in station_id_df.groupby("ELEMENT", observed=True)["DATE"]:
+            element_years.setdefault(str(element), set()).update(dates.dt.year.unique().tolist())
+        
+        if storage == "observations":
+            ObservationsStore(loader).load(station_id_df, upsert=incremental)
+        elif storage == "element":
+            for element, element_df in station_id_df.groupby("ELEMENT", observed=True):
+                loader.load_csv_to_db(element_df[["ID", "DATE", "DATA_VALUE"]], table_name = f"{element}", 
+                                      columns=DIMENSION_COL_TYPES, key_columns=DIMENSION_KEY if incremental else None)
         else:
-            station_csv_pth = f"tmp/{station_id}.csv"
-            
-            station_id_df = pd.read_csv(station_csv_pth, header=None)
-            columns = ["ID", "DATE", "ELEMENT", "DATA_VALUE", "M-FLAG", "Q-FLAG", "S-FLAG", "OBS-TIME"]
-            station_id_df.columns = columns
-            
-            required_col_types = [("ID", "VARCHAR"), ("DATE", "DATE"), ("ELEMENT", "VARCHAR"), ("DATA_VALUE", "REAL")]
-            
-            station_id_df = station_id_df[[t[0] for t in required_col_types]]
-                
-            loader.load_csv_to_db(station_id_df, table_name = f"{station_id}", columns=required_col_types)
+            loader.load_csv_to_db(station_id_df, table_name = f"{station_id}", columns=required_col_types,
+                                  key_columns=["DATE", "ELEMENT"] if incremental else None)
+    
+    if incremental:
+        watermark_store.advance(station_id, last_dates)
+    SummaryRegistry(loader.db_handler).mark_dirty(station_id, element_years, staged=storage == "station")
 
 
-def transform_create_dimention_tables() -> None:
+def transform_create_dimention_tables(limit=STATION_LOAD_LIMIT, mode=DIMENSION_BUILD_MODE, 
+                                      incremental=LOAD_INCREMENTAL, batch_size=DIMENSION_BUILD_BATCH) -> None:
     """
     Creates dimension tables (e.g., TMAX, TMIN) in the database for storing specific weather elements.
 
@@ -222,110 +610,178 @@ def transform_create_dimention_tables() -> None:
         SNWD = Snow depth (mm)
         TMAX = Maximum temperature (tenths of degrees C)
         TMIN = Minimum temperature (tenths of degrees C)
+    Args:
+        limit (int): Only copy the first `limit` stations, all of them when None.
+        mode (str): 'SQL' rebuilds every table with INSERT ... SELECT statements over the station tables,
+            in a single transaction inside the database, 'CLIENT' copies the rows station by station
+            through this process.
+        incremental (bool): Only add the rows newer than the last date of each station in the
+            dimension tables, as upserts, instead of rebuilding them.
+        batch_size (int): Station tables read by one INSERT ... SELECT ('SQL' mode).
     """
     dimention_tables = ['TMAX', 'TMIN']
     
+    if STATION_STORAGE == "element":
+        logger.info("Dimension tables are loaded directly by ingest_load_station_data ('element' storage), skipping")
+        return
+    
+    if STATION_STORAGE == "observations":
+        transform = Transform(db_handler)
+        for tb in dimention_tables:
+            transform.run("element_view_from_observations", element=tb)
+        logger.info(f"Dimension tables {dimention_tables} created as views on the observations partitions")
+        transform_refresh_summaries(elements=dimention_tables)
+        return
+    
     result = db_handler.execute_query(f"""SELECT ID FROM stations;""")
     station_ids = [row[0] for row in result]
     
     loader = Loader(db_handler)
     
-    req_columns = [("station_ID", "VARCHAR"), ("DATE", "DATE"), ("value", "REAL")]
+    req_columns = DIMENSION_COL_TYPES
+    
+    # the partitions staged by the station loads become dirty along with the rows copied
+    SummaryRegistry(db_handler).create()
+    publish_query = SummaryRegistry.publish_staged_query(dimention_tables)
+    
+    if mode == "SQL":
+        # stations whose data failed to load have no table
+        result = db_handler.execute_query("""SELECT table_name FROM information_schema.tables 
+                                             WHERE table_schema = current_schema();""")
+        existing_tables = {row[0] for row in result}
+        station_ids = [station for station in station_ids[:limit] if station.lower() in existing_tables]
+        
+        select_query = sql_queries.station_element_select_since if incremental else sql_queries.station_element_select
+        insert_query = sql_queries.dimension_upsert_from_station_tables if incremental \
+            else sql_queries.dimension_from_station_tables
+        
+        queries = []
+        insert_positions = {}
+        for tb in dimention_tables:
+            loader.create_table_if_not_exists(table=tb, columns=DIMENSION_COL_TYPES, 
+                                              primary_key=DIMENSION_KEY if incremental else None)
+            if not incremental:
+                queries.append(f"TRUNCATE {tb};")
+            # one statement per batch of stations, the statement size and planning time stay bounded
+            for start in range(0, len(station_ids), batch_size):
+                station_selects = "\nUNION ALL".join(
+                    select_query.format(station_id=station, element=tb) for station in station_ids[start:start + batch_size])
+                insert_positions.setdefault(tb, []).append(len(queries))
+                queries.append(insert_query.format(element=tb, station_selects=station_selects))
+        queries.append(publish_query)
+        queries.append(DataVersions(db_handler).bump_query(*dimention_tables))
+        
+        row_counts = db_handler.execute_batch(queries)
+        logger.info(f"Dimension tables {'updated' if incremental else 'rebuilt'} from {len(station_ids)} stations, "
+                    f"rows: { {tb: sum(row_counts[i] for i in positions) for tb, positions in insert_positions.items()} }")
+        
+        for tb in dimention_tables:
+            loader.create_indexes(tb, DIMENSION_INDEXES, primary_key=DIMENSION_KEY if incremental else None)
+        transform_refresh_summaries(elements=dimention_tables)
+        return
     
     for tb in dimention_tables:
-        loader.create_table_if_not_exists(table=tb, columns=[("station_ID", "VARCHAR"), ("DATE", "DATE"), ("value", "REAL")])
-        for station in station_ids[:5]:
+        loader.create_table_if_not_exists(table=tb, columns=DIMENSION_COL_TYPES, 
+                                          primary_key=DIMENSION_KEY if incremental else None)
+        for station in station_ids[:limit]:
             # get dimention values from station table
             element_data = db_handler.execute_query("""SELECT DATE, DATA_VALUE
                                                         FROM {station_id} 
                                                         WHERE {station_id}.ELEMENT = '{element_id}'; 
                                                     """.format(station_id=station, element_id=tb))
             element_data = [[station]+[str(e) for e in row] for row in element_data]
-            loader.load_list_to_db(element_data, table_name = f"{tb}", columns=req_columns)
+            loader.load_list_to_db(element_data, table_name = f"{tb}", columns=req_columns, 
+                                   key_columns=DIMENSION_KEY if incremental else None)
+        loader.create_indexes(tb, DIMENSION_INDEXES, primary_key=DIMENSION_KEY if incremental else None)
+    db_handler.execute_query(publish_query)
+    transform_refresh_summaries(elements=dimention_tables)
         
 
+def transform_refresh_summaries(elements=STATION_ELEMENTS) -> None:
+    """
+    Refreshes the rollup cube (count, sum, min, max, sum of squares per station, year and month) of
+    `elements` the summarized templates are answered from, only re-aggregating the station/year
+    partitions written by the loads since the last refresh.
+    """
+    
+    registry = SummaryRegistry(db_handler)
+    for element in elements:
+        registry.refresh_rollup(element)
+
+
+def transform_refresh_climatology(elements=("TMAX",)) -> None:
+    """
+    Refreshes the per-station, per-day-of-year climatology baselines of `elements`, only recomputing
+    the stations with new rows inside the reference period (CLIMATOLOGY_START_YEAR - CLIMATOLOGY_END_YEAR).
+    """
+    
+    climatology = Climatology(db_handler)
+    for element in elements:
+        climatology.refresh(element)
+
+
 def transform_station_monthly_temp_avg() -> None:
     """
     Computes the monthly average temperature for each station and uploads the result to both local and S3 storage.
     """
     
     transform = Transform(db_handler)
-    result_cursor = transform.run("monthly_avg_by_station", table="TMAX", start_year="1990", end_year="2000")
-    
-    result = [row for row in result_cursor]
-    print(result)
-    
-    new_dict = {}
-    
-    for row in result:
-        station_id, month, avg_temperature = row
-        # print(type(month))
-        # Initialize station entry if not exists
-        new_dict.setdefault(station_id, {"max_avg": {}})
-
-        new_dict[station_id]["max_avg"][str(month)] = avg_temperature
+    # rows come ordered by station, each station object is written as soon as its rows are read
+    rows = transform.stream("monthly_avg_by_station", table="TMAX", start_year="1990", end_year="2000")
+    stations = ((station_id, {"max_avg": {str(month): avg_temperature for _, month, avg_temperature in station_rows}})
+                for station_id, station_rows in itertools.groupby(rows, key=lambda row: row[0]))
 
     with open('tmp/stations_avg_temp.json', 'w') as fp:
-        json.dump(new_dict, fp)
+        write_json_object(stations, fp)
     
     s3_single_upload('tmp/stations_avg_temp.json', S3_BUCKET, S3_DIR+"/stations_avg_temp.json")
     
-    print(new_dict)
     
+def transform_city_nearest_stations(k:int=5, force:bool=False) -> bool:
+    """
+    Fills the 'city_nearest_stations' table with the `k` closest stations reporting TMAX of every city (rank 1
+    being the closest), with one LATERAL ... ORDER BY <-> LIMIT k query per city served by a GiST index on the
+    station locations. The table is only rebuilt when the cities, the stations or the set of stations reporting
+    TMAX changed since the last build (fingerprints kept in the 'pipeline_checkpoints' table) or when `force` is set.
+    Returns True when the table was rebuilt.
+    """
+    
+    fingerprint = hashlib.md5(":".join([GeoIndex.table_fingerprint(db_handler, "cities", id_column="city"),
+                                        GeoIndex.table_fingerprint(db_handler, "stations"),
+                                        db_handler.execute_query(sql_queries.reporting_stations_fingerprint).scalar(),
+                                        str(k)]).encode()).hexdigest()
+    checkpoints = CheckpointStore(db_handler)
+    checkpoints.create()
+    if not force and CheckpointStore.is_done(checkpoints.completed(CITY_STATIONS_TASK), CITY_STATIONS_TABLE, fingerprint):
+        logger.info(f"Cities and stations did not change, {CITY_STATIONS_TABLE} is up to date")
+        return False
+    
+    Loader(db_handler).create_table_if_not_exists(CITY_STATIONS_TABLE, CITY_STATIONS_COL_TYPES, 
+                                                  primary_key=["CITY", "STATION_RANK"])
+    db_handler.execute_query("""CREATE INDEX IF NOT EXISTS stations_location_gist 
+                                ON stations USING gist (point(latitude, longitude));""")
+    
+    row_counts = db_handler.execute_batch([f"TRUNCATE {CITY_STATIONS_TABLE};", 
+                                           Transform(db_handler).query("city_nearest_stations", k=k),
+                                           DataVersions(db_handler).bump_query(CITY_STATIONS_TABLE)])
+    checkpoints.mark_done(CITY_STATIONS_TASK, CITY_STATIONS_TABLE, fingerprint)
+    
+    logger.info(f"Rebuilt {CITY_STATIONS_TABLE}: {row_counts[1]} rows ({k} stations per city)")
+    return True
+
+
 def transform_get_avg_top5():
     """ 
     Retrieves the average TMAX values for the 5 closest stations for each city from the 'cities' table
     Execute a SQL query on a PostgreSQL database, save the result to a CSV file, and upload it to Amazon S3.
     """
     
-    rows = db_handler.execute_query("""
-                                WITH ranked_stations AS (
-                                    SELECT
-                                        c.city,
-                                        s.id AS station_id,
-                                        s.latitude AS station_lat,
-                                        s.longitude AS station_long,
-                                        t.value AS tmax,
-                                        ROW_NUMBER() OVER (PARTITION BY c.city, t.date ORDER BY point(c.latitude, c.longitude) <-> point(s.latitude, s.longitude)) AS station_rank
-                                    FROM
-                                        cities c
-                                        CROSS JOIN stations s
-                                        JOIN tmax t ON s.id = t.station_ID
-                                )
-                                , top_5_stations AS (
-                                    SELECT
-                                        city,
-                                        station_id,
-                                        station_lat,
-                                        station_long,
-                                        tmax
-                                    FROM
-                                        ranked_stations
-                                    WHERE
-                                        station_rank <= 5
-                                )
-                                , city_stats AS (
-                                    SELECT
-                                        city,
-                                        AVG(tmax) AS avg_tmax,
-                                        PERCENT_RANK() OVER (ORDER BY AVG(tmax)) AS percentile_count
-                                    FROM
-                                        top_5_stations
-                                    GROUP BY
-                                        city
-                                )
-                                SELECT
-                                    c.*,
-                                    cs.avg_tmax,
-                                    cs.percentile_count
-                                FROM
-                                    cities c
-                                    LEFT JOIN city_stats cs ON c.city = cs.city;
-                                """)
-    rows_list = [row for row in rows]
-    
-    df = pd.DataFrame(rows_list, columns=[desc for desc in rows.keys()])
-    df.to_csv('tmp/cities_avg_tmax_5_stations.csv', index=False)
+    # the 5 closest stations of every city, only recomputed when cities or stations changed
+    transform_city_nearest_stations(k=5)
+    
+    transform = Transform(db_handler)
+    # COPY ... TO STDOUT, the rows are streamed from the server straight to the file
+    transform.export("avg_tmax_top5_stations_by_city", 'tmp/cities_avg_tmax_5_stations.csv', format="csv")
     
     s3_single_upload('tmp/cities_avg_tmax_5_stations.csv', S3_BUCKET, S3_DIR+"/cities_avg_tmax_5_stations.csv")
     
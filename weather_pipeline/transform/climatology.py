@@ -0,0 +1,121 @@
+from weather_pipeline.utils import _get_logger
+from weather_pipeline.load.loader import Loader
+from weather_pipeline.load.versions import DataVersions
+from weather_pipeline.transform import sql_queries
+from weather_pipeline.transform.summaries import SummaryRegistry, LOCK_DIRTY_QUERY
+from weather_pipeline.config import CLIMATOLOGY_START_YEAR, CLIMATOLOGY_END_YEAR, CLIMATOLOGY_WINDOW_DAYS
+
+# one row per station and day of year (1 - 365)
+BASELINE_COL_TYPES = [("station_id", "VARCHAR"), ("doy", "INTEGER"), ("n", "INTEGER"),
+                      ("mean", "DOUBLE PRECISION"), ("stddev", "DOUBLE PRECISION"),
+                      ("p10", "DOUBLE PRECISION"), ("p50", "DOUBLE PRECISION"), ("p90", "DOUBLE PRECISION")]
+
+# sql_queries templates joining a baseline, by element
+CLIMATOLOGY_TEMPLATES = {
+    "temp_anomalies": "TMAX",
+    "extreme_temp_days_by_station": "TMAX",
+}
+
+
+class Climatology:
+    """Climatology
+
+    Per-station, per-day-of-year baselines of an element table (e.g.
+    `climatology_tmax` for TMAX): count, mean, standard deviation and
+    10th / 50th / 90th percentiles of the values observed over the
+    reference period, each day pooling the days within +/- `window`
+    days of it. Days of year are those of a non-leap year (see the
+    `climatology_doy` sql function), 29 February sharing the 28th.
+
+    The baselines follow the dirty (element, station, year) partitions
+    marked by the loads for the summary tables: a refresh only recomputes
+    the stations with new rows inside the reference period. Changing the
+    reference period or the window rebuilds the whole table.
+
+    Methods:
+    -------
+    is_fresh(element)
+    True when the baseline table is built and no station changed inside
+    the reference period since.
+
+    refresh(element)
+    Brings the baseline table up to date, returns the number of rows written.
+
+    ensure(element, auto_refresh)
+    Builds the baseline table when missing, refreshes it when stale and
+    `auto_refresh` is set.
+    """
+
+    def __init__(self, db_handler, start_year:int=CLIMATOLOGY_START_YEAR, end_year:int=CLIMATOLOGY_END_YEAR,
+                 window:int=CLIMATOLOGY_WINDOW_DAYS) -> None:
+        self.logger = _get_logger(name=__name__)
+        self.db_handler = db_handler
+        self.start_year = start_year
+        self.end_year = end_year
+        self.window = window
+        self.registry = SummaryRegistry(db_handler)
+        self._created = False
+
+    @staticmethod
+    def table(element) -> str:
+        return f"climatology_{element.lower()}"
+
+    def _state(self, element) -> str:
+        # a baseline built for another period / window is stale as a whole
+        return f"{self.table(element)}:{self.start_year}-{self.end_year}:{self.window}"
+
+    def create(self) -> None:
+        if self._created:
+            return
+        self.registry.create()
+        self.db_handler.execute_query(sql_queries.climatology_doy_function)
+        self._created = True
+
+    def is_fresh(self, element="TMAX") -> bool:
+        self.create()
+        last_seq = self.registry.last_seq(self._state(element))
+        return last_seq is not None and self._pending(element.upper(), last_seq)[1] is None
+
+    def _pending(self, element, last_seq):
+        # rows written outside the reference period leave the baseline as it is
+        return self.registry.pending(element, last_seq, start_year=self.start_year, end_year=self.end_year)
+
+    def refresh(self, element="TMAX") -> int:
+        element = element.upper()
+        table = self.table(element)
+        self.create()
+
+        params = dict(baseline=table, source=element, start_year=self.start_year, end_year=self.end_year,
+                      window=self.window)
+        last_seq = self.registry.last_seq(self._state(element))
+        if last_seq is None:
+            # first build, every station
+            high_seq = self.registry.max_seq()
+            Loader(self.db_handler).create_table_if_not_exists(table, BASELINE_COL_TYPES,
+                                                               primary_key=["station_id", "doy"])
+            queries = [LOCK_DIRTY_QUERY, f"TRUNCATE {table};",
+                       sql_queries.climatology_baseline.format(stations="", **params)]
+        else:
+            _, high_seq = self._pending(element, last_seq)
+            if high_seq is None:
+                return 0
+            stations = sql_queries.climatology_dirty_stations.format(
+                element=element, low_seq=last_seq, high_seq=high_seq,
+                start_year=self.start_year, end_year=self.end_year)
+            queries = [LOCK_DIRTY_QUERY,
+                       sql_queries.climatology_delete_stations.format(baseline=table, stations=stations),
+                       sql_queries.climatology_baseline.format(
+                           stations=sql_queries.climatology_dirty_join.format(stations=stations), **params)]
+
+        queries.append(self.registry.state_query(self._state(element), high_seq))
+        queries.append(DataVersions(self.db_handler).bump_query(table))
+        rows = self.db_handler.execute_batch(queries)[2]
+        self.logger.info(f"Refreshed {table} ({'full' if last_seq is None else 'incremental'}, "
+                         f"{self.start_year}-{self.end_year}): {rows} rows")
+        return rows
+
+    def ensure(self, element="TMAX", auto_refresh:bool=True) -> None:
+        if self.is_fresh(element):
+            return
+        if auto_refresh or self.registry.last_seq(self._state(element)) is None:
+            self.refresh(element)
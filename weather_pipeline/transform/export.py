@@ -0,0 +1,134 @@
+import bz2
+import gzip
+import json
+from decimal import Decimal
+
+import pandas as pd
+
+from weather_pipeline.utils import _get_logger
+from weather_pipeline.config import DB_STREAM_CHUNK_SIZE
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # parquet exports only
+    pa = pq = None
+
+logger = _get_logger(name=__name__)
+
+EXPORT_FORMATS = ("csv", "ndjson", "parquet")
+
+# compression of the csv / ndjson exports, parquet compresses its pages itself (snappy, gzip, zstd, ..)
+_OPENERS = {None: open, "gzip": gzip.open, "bz2": bz2.open}
+
+
+def _open(path, compression):
+    if compression not in _OPENERS:
+        raise ValueError(f"Unsupported compression: {compression}, expected one of {list(_OPENERS)}")
+    return _OPENERS[compression](path, "wb")
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+
+def _plain_columns(df):
+    # numeric / AVG results come back as Decimal objects, neither json nor arrow infer them consistently
+    for column in df.columns[df.dtypes == object]:
+        values = df[column].dropna()
+        if not values.empty and isinstance(values.iloc[0], Decimal):
+            df[column] = pd.to_numeric(df[column])
+    return df
+
+
+def export_csv(db_handler, query, path, compression=None) -> int:
+    """
+    Writes the result of the query to a csv file (with header) with `COPY (query) TO STDOUT`,
+    the rows are formatted by the server and streamed straight to the file.
+    Returns the number of rows written.
+    """
+    copy_query = f"COPY ({query.strip().rstrip(';')}) TO STDOUT WITH (FORMAT csv, HEADER)"
+    # profiled (and explained) as the query it copies
+    with db_handler.profiled(query) as stats, _open(path, compression) as fp, db_handler.raw_cursor() as cursor:
+        cursor.copy_expert(copy_query, fp)
+        stats["rows"] = cursor.rowcount
+    return stats["rows"]
+
+
+def export_ndjson(db_handler, query, path, compression=None, chunk_size:int=DB_STREAM_CHUNK_SIZE) -> int:
+    """
+    Writes the result of the query as newline-delimited json, one object per row,
+    `chunk_size` rows at a time read from a server-side cursor.
+    Returns the number of rows written.
+    """
+    rows = 0
+    with _open(path, compression) as fp:
+        for df in db_handler.stream_dataframes(query, chunk_size=chunk_size):
+            if df.empty:
+                continue
+            lines = _plain_columns(df).to_json(orient="records", lines=True, date_format="iso", default_handler=str)
+            # older pandas leave out the newline after the last row, the next chunk would continue its line
+            if not lines.endswith("\n"):
+                lines += "\n"
+            fp.write(lines.encode())
+            rows += len(df)
+    return rows
+
+
+def export_parquet(db_handler, query, path, compression="snappy", chunk_size:int=DB_STREAM_CHUNK_SIZE) -> int:
+    """
+    Writes the result of the query to a parquet file, one row group per `chunk_size` rows
+    read from a server-side cursor. The schema is taken from the first chunk. Needs pyarrow.
+    Returns the number of rows written.
+    """
+    if pq is None:
+        raise ImportError("Parquet exports need pyarrow, install it with `pip install pyarrow`")
+
+    rows = 0
+    writer = None
+    try:
+        for df in db_handler.stream_dataframes(query, chunk_size=chunk_size):
+            table = pa.Table.from_pandas(_plain_columns(df), preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema, compression=compression or "none")
+            elif table.schema != writer.schema:
+                table = table.cast(writer.schema)
+            writer.write_table(table)
+            rows += len(df)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+def export_query(db_handler, query, path, format="csv", compression=None, chunk_size:int=DB_STREAM_CHUNK_SIZE) -> int:
+    """
+    Streams the result of the query to `path` in `format` (csv, ndjson or parquet),
+    holding at most `chunk_size` rows in memory. Returns the number of rows written.
+    """
+    if format == "csv":
+        rows = export_csv(db_handler, query, path, compression=compression)
+    elif format == "ndjson":
+        rows = export_ndjson(db_handler, query, path, compression=compression, chunk_size=chunk_size)
+    elif format == "parquet":
+        rows = export_parquet(db_handler, query, path, compression=compression or "snappy", chunk_size=chunk_size)
+    else:
+        raise ValueError(f"Unsupported export format: {format}, expected one of {EXPORT_FORMATS}")
+
+    logger.info(f"Exported {rows} rows to {path} ({format}, compression={compression})")
+    return rows
+
+
+def write_json_object(items, fp) -> None:
+    """
+    Writes the (key, value) pairs of `items` as one json object to the text file `fp`,
+    a pair at a time, so the object is never built in memory.
+    """
+    fp.write("{")
+    for i, (key, value) in enumerate(items):
+        if i:
+            fp.write(", ")
+        fp.write(f"{json.dumps(str(key))}: {json.dumps(value, default=_json_default)}")
+    fp.write("}")
@@ -0,0 +1,159 @@
+import os
+import pickle
+from pathlib import Path
+
+import numpy as np
+
+from weather_pipeline.utils import _get_logger
+from weather_pipeline.config import GEO_INDEX_CACHE_DIR
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:  # brute force numpy search instead
+    cKDTree = None
+
+logger = _get_logger(name=__name__)
+
+# mean earth radius
+EARTH_RADIUS_KM = 6371.0088
+
+
+def to_unit_vectors(latitudes, longitudes):
+    """
+    Converts degrees of latitude / longitude to (n, 3) points on the unit sphere. The straight
+    line (chord) distance between two such points grows with their great-circle distance,
+    so an euclidean KD-tree over them answers great-circle nearest neighbour queries.
+    """
+    lat = np.radians(np.asarray(latitudes, dtype=float))
+    lon = np.radians(np.asarray(longitudes, dtype=float))
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)))
+
+
+def chord_to_km(chord):
+    """
+    Great-circle distance in km of a chord length between unit sphere points.
+    """
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(np.asarray(chord) / 2, 0, 1))
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """
+    Vectorized haversine distance in km, the arguments (degrees) are broadcast against each other.
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(a, dtype=float)) for a in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+class GeoIndex:
+    """GeoIndex
+
+    Nearest neighbour index over the coordinates of a set of points
+    (stations, cities, ..), answering nearest-1 / nearest-k queries in
+    bulk with great-circle distances. Uses a scipy KD-tree over the
+    points on the unit sphere, or a chunked brute force haversine search
+    with numpy when scipy is not installed.
+
+    An index built from a table is pickled to GEO_INDEX_CACHE_DIR with
+    a fingerprint of the table (computed by the database), the cached
+    index is reused until the rows of the table change.
+
+    Methods:
+    -------
+    query(latitudes, longitudes, k)
+    Returns (distances_km, ids), two (n, k) arrays of the k nearest
+    points of every queried coordinate, nearest first.
+
+    nearest(latitudes, longitudes)
+    Same as query with k=1, as two (n,) arrays.
+
+    from_table(db_handler, table, id_column, lat_column, lon_column)
+    Index of the rows of a table, loaded from the disk cache when the
+    table did not change since it was built.
+    """
+
+    # rows of the brute force distance matrix computed at a time
+    _chunk_size = 1024
+
+    def __init__(self, ids, latitudes, longitudes, fingerprint=None) -> None:
+        self.ids = np.asarray(ids)
+        self.latitudes = np.asarray(latitudes, dtype=float)
+        self.longitudes = np.asarray(longitudes, dtype=float)
+        self.fingerprint = fingerprint
+        self._tree = cKDTree(to_unit_vectors(self.latitudes, self.longitudes)) \
+            if cKDTree is not None and len(self.ids) else None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def query(self, latitudes, longitudes, k:int=1):
+        if not len(self.ids):
+            raise ValueError("Cannot query an empty GeoIndex")
+        k = min(k, len(self.ids))
+
+        if self._tree is not None:
+            chords, positions = self._tree.query(to_unit_vectors(latitudes, longitudes), k=k)
+            chords, positions = chords.reshape(-1, k), positions.reshape(-1, k)
+            return chord_to_km(chords), self.ids[positions]
+
+        latitudes = np.asarray(latitudes, dtype=float)
+        longitudes = np.asarray(longitudes, dtype=float)
+        distances = np.empty((len(latitudes), k))
+        positions = np.empty((len(latitudes), k), dtype=int)
+        for start in range(0, len(latitudes), self._chunk_size):
+            rows = slice(start, start + self._chunk_size)
+            matrix = haversine_km(latitudes[rows, None], longitudes[rows, None], self.latitudes, self.longitudes)
+            nearest = np.argpartition(matrix, k - 1, axis=1)[:, :k]
+            nearest_distances = np.take_along_axis(matrix, nearest, axis=1)
+            order = np.argsort(nearest_distances, axis=1)
+            positions[rows] = np.take_along_axis(nearest, order, axis=1)
+            distances[rows] = np.take_along_axis(nearest_distances, order, axis=1)
+        return distances, self.ids[positions]
+
+    def nearest(self, latitudes, longitudes):
+        distances, ids = self.query(latitudes, longitudes, k=1)
+        return distances[:, 0], ids[:, 0]
+
+    @staticmethod
+    def table_fingerprint(db_handler, table, id_column="id", lat_column="latitude", lon_column="longitude") -> str:
+        result = db_handler.execute_query(f"""SELECT md5(coalesce(string_agg(concat_ws(',', {id_column}, {lat_column}, {lon_column}),
+                                                                       ';' ORDER BY {id_column}), ''))
+                                              FROM {table};""")
+        return result.scalar()
+
+    @classmethod
+    def from_table(cls, db_handler, table, id_column="id", lat_column="latitude", lon_column="longitude",
+                   cache_dir=GEO_INDEX_CACHE_DIR):
+        fingerprint = cls.table_fingerprint(db_handler, table, id_column, lat_column, lon_column)
+        path = Path(cache_dir) / f"{table}_{id_column}.pkl"
+
+        index = cls.load(path) if path.exists() else None
+        if index is not None and index.fingerprint == fingerprint:
+            logger.info(f"Using cached geo index of {table} ({len(index)} points)")
+            return index
+
+        rows = list(db_handler.execute_query(f"""SELECT {id_column}, {lat_column}, {lon_column} FROM {table}
+                                                 WHERE {lat_column} IS NOT NULL AND {lon_column} IS NOT NULL;"""))
+        ids, latitudes, longitudes = zip(*rows) if rows else ((), (), ())
+        index = cls(ids, latitudes, longitudes, fingerprint=fingerprint)
+        index.save(path)
+        logger.info(f"Built geo index of {table} ({len(index)} points)")
+        return index
+
+    @staticmethod
+    def load(path):
+        try:
+            with open(path, "rb") as fp:
+                return pickle.load(fp)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable geo index cache {path} => {e}")
+            return None
+
+    def save(self, path) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "wb") as fp:
+            pickle.dump(self, fp)
+        os.replace(tmp_path, path)
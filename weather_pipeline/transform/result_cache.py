@@ -0,0 +1,191 @@
+import hashlib
+import json
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from weather_pipeline.utils import _get_logger
+from weather_pipeline.config import RESULT_CACHE_SIZE, RESULT_CACHE_DIR, RESULT_CACHE_MAX_BYTES, \
+    RESULT_CACHE_MEMORY_BYTES
+
+logger = _get_logger(name=__name__)
+
+
+class ResultCache:
+    """ResultCache
+
+    Two level cache of query results (sqlalchemy FrozenResult, calling
+    one gives a fresh result to read). The first level is an in-memory
+    LRU of `max_entries` results per process, holding at most
+    `max_memory_bytes` of pickled results (larger results are only
+    cached on disk), the optional second one pickles the results under
+    `cache_dir`, shared by the processes (the Airflow tasks) of the
+    host: once they take more than `max_bytes` the least recently used
+    files are evicted.
+
+    Entries are never invalidated, the keys carry everything the result
+    depends on (see key()), so a changed input simply misses.
+
+    Methods:
+    -------
+    key(name, params, versions)
+    Cache key of a template run with `params` against the data
+    `versions` of its tables.
+
+    get(key)
+    Returns the cached result or None, counted as a hit or a miss.
+
+    put(key, result)
+    Caches a result in memory and on disk.
+
+    stats()
+    Returns the counters as a dict: hits (memory_hits + disk_hits),
+    misses, hit_rate, stores, evictions and the current sizes
+    (memory_entries, memory_bytes, disk_entries, disk_bytes).
+
+    clear()
+    Drops every cached result and resets the counters.
+    """
+
+    def __init__(self, max_entries:int=RESULT_CACHE_SIZE, cache_dir=RESULT_CACHE_DIR,
+                 max_bytes:int=RESULT_CACHE_MAX_BYTES, max_memory_bytes:int=RESULT_CACHE_MEMORY_BYTES) -> None:
+        self.max_entries = max_entries
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.max_bytes = max_bytes
+        self.max_memory_bytes = max_memory_bytes
+        self._lock = threading.Lock()
+        # {key: (result, pickled size)}
+        self._entries = OrderedDict()
+        self._memory_bytes = 0
+        self._reset_stats()
+
+    def _reset_stats(self) -> None:
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    @staticmethod
+    def key(name, params, versions) -> str:
+        payload = json.dumps([name, params, versions], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return self._entries[key][0]
+
+        result, size = self._read(key)
+        with self._lock:
+            if result is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["disk_hits"] += 1
+            self._remember(key, result, size)
+        return result
+
+    def put(self, key, result) -> None:
+        # the pickled size stands for the memory held by the result
+        try:
+            data = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            logger.warning(f"Could not cache result {key} => {e}")
+            return
+        with self._lock:
+            self._stats["stores"] += 1
+            self._remember(key, result, len(data))
+        self._write(key, data)
+
+    def _remember(self, key, result, size) -> None:
+        if key in self._entries:
+            self._memory_bytes -= self._entries.pop(key)[1]
+        if size > self.max_memory_bytes:
+            return
+        self._entries[key] = (result, size)
+        self._memory_bytes += size
+        while len(self._entries) > self.max_entries or self._memory_bytes > self.max_memory_bytes:
+            self._memory_bytes -= self._entries.popitem(last=False)[1][1]
+            self._stats["evictions"] += 1
+
+    def _path(self, key):
+        return self.cache_dir / f"{key}.pkl"
+
+    def _read(self, key):
+        if self.cache_dir is None:
+            return None, 0
+        path = self._path(key)
+        try:
+            with open(path, "rb") as fp:
+                data = fp.read()
+            result = pickle.loads(data)
+        except FileNotFoundError:
+            return None, 0
+        except Exception as e:
+            logger.warning(f"Dropping unreadable cached result {path} => {e}")
+            path.unlink(missing_ok=True)
+            return None, 0
+        # the modification time orders the files for the LRU eviction
+        os.utime(path)
+        return result, len(data)
+
+    def _write(self, key, data) -> None:
+        if self.cache_dir is None:
+            return
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp_path, "wb") as fp:
+                fp.write(data)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"Could not cache result {path} => {e}")
+            tmp_path.unlink(missing_ok=True)
+            return
+        self._evict_files()
+
+    def _files(self):
+        files = []
+        for path in self.cache_dir.glob("*.pkl"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:  # evicted by another process
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def _evict_files(self) -> None:
+        files = sorted(self._files())
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            with self._lock:
+                self._stats["evictions"] += 1
+
+    def stats(self) -> dict:
+        disk_files = self._files() if self.cache_dir is not None and self.cache_dir.exists() else []
+        with self._lock:
+            stats = dict(self._stats, memory_entries=len(self._entries), memory_bytes=self._memory_bytes)
+        stats["hits"] = stats["memory_hits"] + stats["disk_hits"]
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["disk_entries"] = len(disk_files)
+        stats["disk_bytes"] = sum(size for _, size, _ in disk_files)
+        return stats
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._memory_bytes = 0
+            self._reset_stats()
+        if self.cache_dir is not None and self.cache_dir.exists():
+            for path in self.cache_dir.glob("*.pkl"):
+                path.unlink(missing_ok=True)
+
+
+# shared by the Transform instances of the process
+result_cache = ResultCache()
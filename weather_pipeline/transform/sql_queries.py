@@ -7,6 +7,96 @@ insert_query = "INSERT INTO {table} ({columns}) VALUES ({values})"
 
 delete_query = "DELETE FROM {table} WHERE {condition}"
 
+# rows of an element in a per-station table, combined with UNION ALL into station_selects
+station_element_select = """
+SELECT id, date, data_value FROM {station_id} WHERE element = '{element}'"""
+
+# set-based (re)build of an element's dimension table from the per-station tables
+dimension_from_station_tables = """
+INSERT INTO {element} (station_id, date, value)
+{station_selects}
+"""
+
+# incremental variant, only the rows newer than the last date of the station in the dimension table
+station_element_select_since = """
+SELECT id, date, data_value FROM {station_id} WHERE element = '{element}'
+    AND date > COALESCE((SELECT MAX(date) FROM {element} WHERE station_id = '{station_id}'), '-infinity'::date)"""
+
+dimension_upsert_from_station_tables = """
+INSERT INTO {element} (station_id, date, value)
+{station_selects}
+ON CONFLICT (station_id, date) DO UPDATE SET value = EXCLUDED.value
+"""
+
+# dimension table of an element as a view on the partitioned observations table,
+# the element filter prunes the scans down to the observations_{element} partition
+element_view_from_observations = """
+CREATE OR REPLACE VIEW {element} AS
+SELECT
+    station_id,
+    date,
+    data_value AS value
+FROM
+    observations
+WHERE
+    element = '{element}'
+"""
+
+# k nearest stations reporting TMAX of every city, one index-ordered (GiST, <->) scan of the stations per city
+city_nearest_stations = """
+INSERT INTO city_nearest_stations (city, station_id, station_rank, distance)
+SELECT
+    c.city,
+    nearest.id,
+    ROW_NUMBER() OVER (PARTITION BY c.city ORDER BY nearest.distance) AS station_rank,
+    nearest.distance
+FROM
+    cities c
+    CROSS JOIN LATERAL (
+        SELECT
+            s.id,
+            point(c.latitude, c.longitude) <-> point(s.latitude, s.longitude) AS distance
+        FROM
+            stations s
+        WHERE
+            EXISTS (SELECT 1 FROM tmax t WHERE t.station_id = s.id)
+        ORDER BY
+            point(s.latitude, s.longitude) <-> point(c.latitude, c.longitude)
+        LIMIT {k}
+    ) AS nearest
+"""
+
+# fingerprint of the stations reporting TMAX, the candidates of city_nearest_stations
+reporting_stations_fingerprint = """
+SELECT md5(coalesce(string_agg(s.id, ',' ORDER BY s.id), ''))
+FROM stations s
+WHERE EXISTS (SELECT 1 FROM tmax t WHERE t.station_id = s.id)
+"""
+
+# average TMAX of the 5 nearest stations of every city, from the city_nearest_stations mapping
+avg_tmax_top5_stations_by_city = """
+WITH city_stats AS (
+    SELECT
+        m.city,
+        AVG(t.value) AS avg_tmax,
+        PERCENT_RANK() OVER (ORDER BY AVG(t.value)) AS percentile_count
+    FROM
+        city_nearest_stations m
+        JOIN tmax t ON t.station_id = m.station_id
+    WHERE
+        m.station_rank <= 5
+    GROUP BY
+        m.city
+)
+SELECT
+    c.*,
+    cs.avg_tmax,
+    cs.percentile_count
+FROM
+    cities c
+    LEFT JOIN city_stats cs ON c.city = cs.city
+"""
+
 monthly_avg_by_station = """
 SELECT
     {table}.station_ID,
@@ -15,9 +105,11 @@ SELECT
 FROM
     {table}
 WHERE
-    EXTRACT(YEAR FROM date) BETWEEN {start_year} AND {end_year}
+    date >= make_date({start_year}, 1, 1) AND date < make_date({end_year} + 1, 1, 1)
 GROUP BY
     station_id, EXTRACT(MONTH FROM date)
+ORDER BY
+    station_id, month
 """
 
 yearly_max_by_station = """
@@ -31,18 +123,22 @@ GROUP BY
     station_id, EXTRACT(YEAR FROM date)
 """
 
+# compared with the baseline of the station for the day of year, no category without a baseline
 extreme_temp_days_by_station = """
 SELECT
-    station_id,
-    date,
+    t.station_id,
+    t.date,
     CASE
-        WHEN value >= (SELECT AVG(value) FROM TMAX) THEN 'Above Average'
-        ELSE 'Below Average'
+        WHEN t.value >= c.mean THEN 'Above Average'
+        WHEN t.value < c.mean THEN 'Below Average'
     END AS temperature_category
 FROM
-    TMAX
+    TMAX t
+    LEFT JOIN climatology_tmax c
+    ON c.station_id = t.station_id
+        AND c.doy = climatology_doy(t.date)
 WHERE
-    EXTRACT(YEAR FROM date) BETWEEN 1990 AND 2000
+    t.date >= DATE '1990-01-01' AND t.date < DATE '2001-01-01'
 """
 
 temp_trends_by_station = """
@@ -53,7 +149,7 @@ SELECT
 FROM
     TMAX
 WHERE
-    EXTRACT(YEAR FROM date) BETWEEN 1990 AND 2000
+    date >= DATE '1990-01-01' AND date < DATE '2001-01-01'
 """
 
 monthly_temp_variation = """
@@ -64,22 +160,156 @@ SELECT
 FROM
     TMAX
 WHERE
-    EXTRACT(YEAR FROM date) BETWEEN 1990 AND 2000
+    date >= DATE '1990-01-01' AND date < DATE '2001-01-01'
 GROUP BY
     station_id, EXTRACT(MONTH FROM date)
 """
 
+# outside the 10th - 90th percentile band of the station for the day of year
 temp_anomalies = """
 SELECT
-    station_id,
-    date,
+    t.station_id,
+    t.date,
     CASE
-        WHEN value > (SELECT MAX(value) FROM TMAX WHERE EXTRACT(YEAR FROM date) BETWEEN 1990 AND 2000) THEN 'Above Normal'
-        WHEN value < (SELECT MIN(value) FROM TMIN WHERE EXTRACT(YEAR FROM date) BETWEEN 1990 AND 2000) THEN 'Below Normal'
+        WHEN t.value > c.p90 THEN 'Above Normal'
+        WHEN t.value < c.p10 THEN 'Below Normal'
         ELSE 'Normal'
     END AS temperature_pattern
 FROM
-    TMAX
+    TMAX t
+    LEFT JOIN climatology_tmax c
+    ON c.station_id = t.station_id AND c.doy = climatology_doy(t.date)
+WHERE
+    t.date >= DATE '1990-01-01' AND t.date < DATE '2001-01-01'
+"""
+
+# rollup cube of the analytics templates, keyed by (element, station_id, year, month). `{partitions}` is
+# empty for a full build or summary_dirty_join to only aggregate the dirty (station, year) partitions
+summary_dirty_join = """
+    JOIN (
+        SELECT station_id, year FROM summary_dirty_partitions
+        WHERE element = '{element}' AND seq > {low_seq} AND seq <= {high_seq}
+    ) AS dirty
+    ON t.station_id = dirty.station_id
+        AND t.date >= make_date(dirty.year, 1, 1) AND t.date < make_date(dirty.year + 1, 1, 1)"""
+
+rollup_delete_dirty = """
+DELETE FROM {rollup} r
+USING (
+    SELECT station_id, year FROM summary_dirty_partitions
+    WHERE element = '{element}' AND seq > {low_seq} AND seq <= {high_seq}
+) AS dirty
+WHERE r.element = '{element}' AND r.station_id = dirty.station_id AND r.year = dirty.year
+"""
+
+rollup_delete_element = """
+DELETE FROM {rollup} WHERE element = '{element}'
+"""
+
+rollup_build = """
+INSERT INTO {rollup} (element, station_id, year, month, n, value_sum, value_min, value_max, value_sumsq)
+SELECT
+    '{element}',
+    t.station_id,
+    EXTRACT(YEAR FROM t.date)::int AS year,
+    EXTRACT(MONTH FROM t.date)::int AS month,
+    COUNT(t.value),
+    SUM(t.value::float8),
+    MIN(t.value),
+    MAX(t.value),
+    SUM(t.value::float8 * t.value::float8)
+FROM
+    {source} t{partitions}
+GROUP BY
+    2, 3, 4
+"""
+
+summary_monthly_avg_by_station_serve = """
+SELECT
+    station_id,
+    month,
+    SUM(value_sum) / NULLIF(SUM(n), 0) AS avg_temperature
+FROM
+    {rollup}
 WHERE
-    EXTRACT(YEAR FROM date) BETWEEN 1990 AND 2000
+    element = '{element}' AND year BETWEEN {start_year} AND {end_year}
+GROUP BY
+    station_id, month
+ORDER BY
+    station_id, month
+"""
+
+summary_yearly_max_by_station_serve = """
+SELECT
+    station_id,
+    year,
+    MAX(value_max) AS max_temperature
+FROM
+    {rollup}
+WHERE
+    element = '{element}'
+GROUP BY
+    station_id, year
+"""
+
+summary_monthly_temp_variation_serve = """
+SELECT
+    station_id,
+    month,
+    MAX(value_max) - MIN(value_min) AS temperature_variation
+FROM
+    {rollup}
+WHERE
+    element = '{element}' AND year BETWEEN 1990 AND 2000
+GROUP BY
+    station_id, month
+"""
+
+# per-station, per-day-of-year climatology baselines over a reference period, see transform.climatology
+climatology_doy_function = """
+CREATE OR REPLACE FUNCTION climatology_doy(d DATE) RETURNS INTEGER
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    -- day of year (1 - 365) of a non-leap year, 29 February shares the day of the 28th
+    SELECT EXTRACT(DOY FROM d)::int
+        - (EXTRACT(DOY FROM d) > 59 AND EXTRACT(DAY FROM make_date(EXTRACT(YEAR FROM d)::int, 3, 1) - 1) = 29)::int
+$$
+"""
+
+# stations with dirty partitions inside the reference period
+climatology_dirty_stations = """
+SELECT DISTINCT station_id FROM summary_dirty_partitions
+WHERE element = '{element}' AND seq > {low_seq} AND seq <= {high_seq}
+    AND year BETWEEN {start_year} AND {end_year}"""
+
+climatology_dirty_join = """
+    JOIN ({stations}) AS dirty
+    ON t.station_id = dirty.station_id"""
+
+climatology_delete_stations = """
+DELETE FROM {baseline} b
+USING ({stations}) AS dirty
+WHERE b.station_id = dirty.station_id
+"""
+
+# every observation counts towards the days of year within +/- {window} days of its own
+climatology_baseline = """
+INSERT INTO {baseline} (station_id, doy, n, mean, stddev, p10, p50, p90)
+SELECT
+    t.station_id,
+    MOD(t.doy - 1 + w.shift + 365, 365) + 1 AS doy,
+    COUNT(t.value),
+    AVG(t.value),
+    STDDEV_SAMP(t.value),
+    PERCENTILE_CONT(0.1) WITHIN GROUP (ORDER BY t.value),
+    PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY t.value),
+    PERCENTILE_CONT(0.9) WITHIN GROUP (ORDER BY t.value)
+FROM (
+    SELECT station_id, value, climatology_doy(date) AS doy
+    FROM {source}
+    WHERE date >= make_date({start_year}, 1, 1) AND date < make_date({end_year} + 1, 1, 1)
+        AND value IS NOT NULL
+) AS t{stations}
+    CROSS JOIN generate_series(-{window}, {window}) AS w(shift)
+GROUP BY
+    1, 2
 """
@@ -0,0 +1,230 @@
+from weather_pipeline.utils import _get_logger
+from weather_pipeline.load.loader import Loader
+from weather_pipeline.transform import sql_queries
+
+# (element, station_id, year) partitions written since the summaries were refreshed
+DIRTY_TABLE = "summary_dirty_partitions"
+
+# partitions written to the per-station tables ('station' storage), dirty once the dimension build copied them
+STAGED_TABLE = "summary_staged_partitions"
+
+# last dirty partition (seq) folded into every summary table
+STATE_TABLE = "summary_state"
+
+# taken by a refresh before it aggregates: the marks it read wait for their rows to be committed first
+LOCK_DIRTY_QUERY = f"LOCK TABLE {DIRTY_TABLE} IN SHARE MODE;"
+
+# station x year x month x element rollup cube the summarized templates are answered from
+ROLLUP_TABLE = "rollup_monthly"
+
+ROLLUP_COL_TYPES = [("element", "VARCHAR"), ("station_id", "VARCHAR"), ("year", "INTEGER"), ("month", "INTEGER"),
+                    ("n", "BIGINT"), ("value_sum", "DOUBLE PRECISION"), ("value_min", "REAL"),
+                    ("value_max", "REAL"), ("value_sumsq", "DOUBLE PRECISION")]
+
+ROLLUP_KEY = ["element", "station_id", "year", "month"]
+
+
+class Summary:
+    """Summary
+
+    sql_queries template answered from the rollup cube instead of the
+    daily rows: `summary_{name}_serve` aggregates the `{rollup}` rows of
+    `{element}` (count, sum, min, max and sum of squares of the values of
+    every station, year and month) to the result of the template.
+
+    Attributes:
+    ----------
+    name (str): name of the template it serves.
+    source (str): element table the template reads, may use the template
+        parameters, e.g. '{table}'.
+    """
+
+    def __init__(self, name, source) -> None:
+        self.name = name
+        self.source = source
+
+    def element(self, **kwargs) -> str:
+        return self.source.format(**kwargs).upper()
+
+
+# templates served from the rollup cube
+SUMMARIES = {summary.name: summary for summary in [
+    Summary("monthly_avg_by_station", "{table}"),
+    Summary("yearly_max_by_station", "TMAX"),
+    Summary("monthly_temp_variation", "TMAX"),
+]}
+
+
+class SummaryRegistry:
+    """SummaryRegistry
+
+    Keeps the rollup cube (`rollup_monthly`) the registered templates
+    are answered from up to date. The loads mark the (element, station,
+    year) partitions they wrote as dirty, each mark getting a new
+    sequence number. The cube records, per element, the last sequence
+    number it folded in: it is fresh when no newer mark exists for the
+    element, and a refresh only re-aggregates the dirty partitions
+    (delete + insert in one transaction). The first refresh of an element
+    aggregates all its rows. The marks of rows that are not in the element
+    tables yet (per-station tables, copied by the dimension build) are
+    staged until the build publishes them, a refresh running in between
+    would otherwise fold them in against the old element table.
+
+    Methods:
+    -------
+    register(summary)
+    Adds a Summary to the registry.
+
+    mark_dirty(station_id, element_years, staged)
+    Marks the {element: years} partitions of a station as changed, only
+    staged when `staged`.
+
+    publish_staged_query(elements)
+    Sql marking the staged partitions of `elements` as changed, to run
+    in the transaction writing their rows to the element tables.
+
+    is_fresh(name, **kwargs) / is_rollup_fresh(element)
+    True when the rollup of the element (read by the template) is built
+    and up to date.
+
+    refresh(name, **kwargs) / refresh_rollup(element)
+    Brings the rollup of the element up to date, returns the number of
+    rows written.
+
+    last_seq(table) / pending(element, low_seq)
+    Last dirty mark folded into a table (None before its first build),
+    (min, max) seq of the marks of the element newer than `low_seq`.
+
+    query(name, auto_refresh, **kwargs)
+    Sql answering the template from the rollup, refreshed first when
+    stale and `auto_refresh` is set. None when the template is not
+    registered or the rollup is stale.
+    """
+
+    def __init__(self, db_handler, summaries=None) -> None:
+        self.logger = _get_logger(name=__name__)
+        self.db_handler = db_handler
+        self.summaries = dict(SUMMARIES if summaries is None else summaries)
+        self._created = False
+
+    def register(self, summary) -> None:
+        self.summaries[summary.name] = summary
+
+    def create(self) -> None:
+        if self._created:
+            return
+        self.db_handler.execute_batch([
+            f"""CREATE TABLE IF NOT EXISTS {DIRTY_TABLE} (
+                    element VARCHAR,
+                    station_id VARCHAR,
+                    year INTEGER,
+                    seq BIGSERIAL,
+                    PRIMARY KEY (element, station_id, year));""",
+            f"""CREATE TABLE IF NOT EXISTS {STAGED_TABLE} (
+                    element VARCHAR,
+                    station_id VARCHAR,
+                    year INTEGER,
+                    PRIMARY KEY (element, station_id, year));""",
+            f"""CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+                    summary VARCHAR PRIMARY KEY,
+                    last_seq BIGINT NOT NULL,
+                    refreshed_at TIMESTAMP NOT NULL DEFAULT now());"""])
+        Loader(self.db_handler).create_table_if_not_exists(ROLLUP_TABLE, ROLLUP_COL_TYPES, primary_key=ROLLUP_KEY)
+        self._created = True
+
+    def mark_dirty(self, station_id, element_years, staged:bool=False) -> None:
+        values_str = ", ".join(f"('{element.upper()}', '{station_id}', {int(year)})"
+                               for element, years in element_years.items() for year in years)
+        if not values_str:
+            return
+        if staged:
+            self.db_handler.execute_query(f"""INSERT INTO {STAGED_TABLE} (element, station_id, year)
+                                              VALUES {values_str}
+                                              ON CONFLICT (element, station_id, year) DO NOTHING;""")
+            return
+        self.db_handler.execute_query(f"""INSERT INTO {DIRTY_TABLE} (element, station_id, year)
+                                          VALUES {values_str}
+                                          ON CONFLICT (element, station_id, year) DO UPDATE
+                                          SET seq = nextval(pg_get_serial_sequence('{DIRTY_TABLE}', 'seq'));""")
+
+    @staticmethod
+    def publish_staged_query(elements) -> str:
+        elements_str = ", ".join(f"'{element.upper()}'" for element in elements)
+        return f"""WITH staged AS (
+                       DELETE FROM {STAGED_TABLE} WHERE element IN ({elements_str})
+                       RETURNING element, station_id, year)
+                   INSERT INTO {DIRTY_TABLE} (element, station_id, year)
+                   SELECT element, station_id, year FROM staged
+                   ON CONFLICT (element, station_id, year) DO UPDATE
+                   SET seq = nextval(pg_get_serial_sequence('{DIRTY_TABLE}', 'seq'));"""
+
+    def last_seq(self, table):
+        return self.db_handler.execute_query(f"""SELECT last_seq FROM {STATE_TABLE}
+                                                 WHERE summary = '{table}';""").scalar()
+
+    def pending(self, element, low_seq, start_year=None, end_year=None):
+        # only the partitions of the years a summary reads, when it reads a period
+        years_str = f" AND year BETWEEN {start_year} AND {end_year}" if start_year is not None else ""
+        return self.db_handler.execute_query(f"""SELECT MIN(seq), MAX(seq) FROM {DIRTY_TABLE}
+                                                 WHERE element = '{element}' AND seq > {low_seq}{years_str};""").first()
+
+    def max_seq(self) -> int:
+        return self.db_handler.execute_query(f"SELECT COALESCE(MAX(seq), 0) FROM {DIRTY_TABLE};").scalar()
+
+    @staticmethod
+    def state_query(table, high_seq) -> str:
+        return f"""INSERT INTO {STATE_TABLE} (summary, last_seq) VALUES ('{table}', {high_seq})
+                   ON CONFLICT (summary) DO UPDATE SET last_seq = EXCLUDED.last_seq, refreshed_at = now();"""
+
+    @staticmethod
+    def _rollup_state(element) -> str:
+        return f"{ROLLUP_TABLE}:{element}"
+
+    def is_rollup_fresh(self, element) -> bool:
+        element = element.upper()
+        self.create()
+        last_seq = self.last_seq(self._rollup_state(element))
+        return last_seq is not None and self.pending(element, last_seq)[1] is None
+
+    def is_fresh(self, name, **kwargs) -> bool:
+        return self.is_rollup_fresh(self.summaries[name].element(**kwargs))
+
+    def refresh_rollup(self, element) -> int:
+        element = element.upper()
+        self.create()
+
+        last_seq = self.last_seq(self._rollup_state(element))
+        if last_seq is None:
+            # first build, every partition of the element
+            high_seq = self.max_seq()
+            queries = [LOCK_DIRTY_QUERY, sql_queries.rollup_delete_element.format(rollup=ROLLUP_TABLE, element=element),
+                       sql_queries.rollup_build.format(rollup=ROLLUP_TABLE, element=element, source=element,
+                                                       partitions="")]
+        else:
+            _, high_seq = self.pending(element, last_seq)
+            if high_seq is None:
+                return 0
+            partitions = dict(element=element, low_seq=last_seq, high_seq=high_seq)
+            queries = [LOCK_DIRTY_QUERY, sql_queries.rollup_delete_dirty.format(rollup=ROLLUP_TABLE, **partitions),
+                       sql_queries.rollup_build.format(rollup=ROLLUP_TABLE, element=element, source=element,
+                                                       partitions=sql_queries.summary_dirty_join.format(**partitions))]
+
+        queries.append(self.state_query(self._rollup_state(element), high_seq))
+        rows = self.db_handler.execute_batch(queries)[2]
+        self.logger.info(f"Refreshed {ROLLUP_TABLE} of {element} ({'full' if last_seq is None else 'incremental'}): "
+                         f"{rows} rows")
+        return rows
+
+    def refresh(self, name, **kwargs) -> int:
+        return self.refresh_rollup(self.summaries[name].element(**kwargs))
+
+    def query(self, name, auto_refresh:bool=True, **kwargs):
+        summary = self.summaries.get(name)
+        if summary is None:
+            return None
+        if not self.is_fresh(name, **kwargs):
+            if not auto_refresh:
+                return None
+            self.refresh(name, **kwargs)
+        return getattr(sql_queries, f"summary_{name}_serve").format(rollup=ROLLUP_TABLE,
+                                                                     element=summary.element(**kwargs), **kwargs)
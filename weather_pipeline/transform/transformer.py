@@ -1,21 +1,159 @@
+import contextlib
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from logging import exception
 from typing import List, Optional, Tuple
 import pandas as pd
 from pandas.io.parsers import read_fwf
 from weather_pipeline.transform import sql_queries
+from weather_pipeline.transform.export import export_query
+from weather_pipeline.transform.summaries import SummaryRegistry
+from weather_pipeline.transform.climatology import Climatology, CLIMATOLOGY_TEMPLATES
+from weather_pipeline.transform.result_cache import ResultCache, result_cache
+from weather_pipeline.load.versions import DataVersions
+from weather_pipeline.config import DB_STREAM_CHUNK_SIZE, TRANSFORM_SUMMARIES, SUMMARY_AUTO_REFRESH, RESULT_CACHE, \
+    TRANSFORM_BATCH_WORKERS
+
+# relations a template reads from
+_TABLE_PATTERN = re.compile(r"\b(?:FROM|JOIN)\s+([A-Za-z_][\w.]*)", re.IGNORECASE)
+
+# FROM keywords not followed by a relation, removed before matching _TABLE_PATTERN
+_NOT_RELATION_PATTERN = re.compile(r"\bEXTRACT\s*\(\s*\w+\s+FROM\b|\bDISTINCT\s+FROM\b", re.IGNORECASE)
+
+# names of the common table expressions of a template, read like relations but not versioned
+_CTE_PATTERN = re.compile(r"(?:\bWITH(?:\s+RECURSIVE)?|,)\s*([A-Za-z_]\w*)\s+AS\s*(?:(?:NOT\s+)?MATERIALIZED\s*)?\(",
+                          re.IGNORECASE)
 
 class Transform:
-    def __init__(self, db_handler):
+    def __init__(self, db_handler, summaries:bool=TRANSFORM_SUMMARIES, auto_refresh:bool=SUMMARY_AUTO_REFRESH,
+                 cache:bool=RESULT_CACHE):
         self.db_handler = db_handler
         self.queries = []
+        # templates registered there are answered from the rollup cube
+        self.summaries = SummaryRegistry(db_handler) if summaries else None
+        self.auto_refresh = auto_refresh
+        # baselines joined by the anomaly templates
+        self.climatology = Climatology(db_handler)
+        # results of run, shared by the Transform instances of the process
+        self.cache = result_cache if cache else None
+        self.versions = DataVersions(db_handler)
 
     def run(self, query_name, **kwargs):
         # Check if the query_name is valid
         # if query_name not in self.queries:
         #     raise ValueError(f"Invalid query name: {query_name}")
 
-        query_str = getattr(sql_queries, query_name)
-        result = self.db_handler.execute_query(query_str.format(**kwargs))
+        key, frozen = self._cached(query_name, kwargs)
+        if frozen is not None:
+            return frozen()
         
-        return result
+        return self._execute(self.query(query_name, **kwargs), key, label=(query_name, kwargs))
+
+    def run_batch(self, queries, max_workers:int=TRANSFORM_BATCH_WORKERS):
+        """
+        Runs the (query_name, kwargs) pairs of `queries` concurrently, at most `max_workers` at a time,
+        each on its own pooled connection, and yields (query_name, kwargs, result) as each one finishes,
+        cached results first. The batch takes about as long as its slowest query.
+        The sql (and the refresh of a stale rollup / baseline it needs) is prepared one query at a time,
+        only the reads run concurrently. A failing query raises, the queries not started yet are cancelled.
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            cached = []
+            futures = {}
+            try:
+                for query_name, kwargs in queries:
+                    key, frozen = self._cached(query_name, kwargs)
+                    if frozen is not None:
+                        cached.append((query_name, kwargs, frozen()))
+                        continue
+                    future = executor.submit(self._execute, self.query(query_name, **kwargs), key,
+                                             label=(query_name, kwargs))
+                    futures[future] = (query_name, kwargs)
+                
+                yield from cached
+                for future in as_completed(futures):
+                    query_name, kwargs = futures[future]
+                    yield query_name, kwargs, future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    def _cached(self, query_name, kwargs):
+        # looked up before the query is prepared, summaries included: only the data versions are read
+        if self.cache is None:
+            return None, None
+        key = ResultCache.key(query_name, kwargs, self.versions.get(self.tables(query_name, **kwargs)))
+        return key, self.cache.get(key)
+
+    def _labelled(self, label):
+        # profiled under the template and its parameters when the handler profiles its statements
+        profiler = getattr(self.db_handler, "profiler", None)
+        if profiler is None or label is None:
+            return contextlib.nullcontext()
+        return profiler.labelled(*label)
+
+    def _execute(self, query, key=None, label=None):
+        with self._labelled(label):
+            result = self.db_handler.execute_query(query)
+        # statements without rows (DDL, ..) are never cached
+        if key is None or not getattr(result, "returns_rows", True):
+            return result
+        
+        frozen = result.freeze()
+        self.cache.put(key, frozen)
+        return frozen()
+
+    def tables(self, query_name, **kwargs) -> list:
+        """
+        Returns the relations the `query_name` template reads from, whose data versions key its cached results.
+        """
+        query = _NOT_RELATION_PATTERN.sub(" ", getattr(sql_queries, query_name).format(**kwargs))
+        ctes = {name.lower() for name in _CTE_PATTERN.findall(query)}
+        return sorted({table.lower() for table in _TABLE_PATTERN.findall(query)} - ctes)
+
+    def query(self, query_name, **kwargs) -> str:
+        """
+        Returns the sql of the `query_name` template formatted with kwargs, reading
+        the rollup cube instead when the template is served from a fresh one. The climatology
+        baseline of the templates joining one is built (or refreshed) first.
+        """
+        if query_name in CLIMATOLOGY_TEMPLATES:
+            self.climatology.ensure(CLIMATOLOGY_TEMPLATES[query_name], auto_refresh=self.auto_refresh)
+        if self.summaries is not None:
+            summary_query = self.summaries.query(query_name, auto_refresh=self.auto_refresh, **kwargs)
+            if summary_query is not None:
+                return summary_query
+        return getattr(sql_queries, query_name).format(**kwargs)
+
+    def stream(self, query_name, chunk_size:int=DB_STREAM_CHUNK_SIZE, **kwargs):
+        """
+        Same as run, the rows being read `chunk_size` at a time from a server-side cursor.
+        """
+        return self._stream(self.query(query_name, **kwargs), chunk_size, label=(query_name, kwargs))
+
+    def _stream(self, query, chunk_size, label):
+        with self._labelled(label):
+            yield from self.db_handler.stream_results(query, chunk_size=chunk_size)
+
+    def export(self, query_name, path, format:str="csv", compression=None, 
+               chunk_size:int=DB_STREAM_CHUNK_SIZE, **kwargs) -> int:
+        """
+        Streams the result of the `query_name` template to `path` without holding it in memory:
+        'csv' through COPY ... TO STDOUT, 'ndjson' and 'parquet' (pyarrow) `chunk_size` rows
+        (one parquet row group) at a time. `compression` is 'gzip' or 'bz2' for csv / ndjson,
+        a parquet codec ('snappy' by default, 'zstd', 'gzip', ..) for parquet.
+        Returns the number of rows written.
+        """
+        query = self.query(query_name, **kwargs)
+        with self._labelled((query_name, kwargs)):
+            return export_query(self.db_handler, query, path, format=format, compression=compression,
+                                chunk_size=chunk_size)
 
+    def explain(self, query_name, analyze:bool=False, **kwargs) -> str:
+        """
+        Returns the query plan of the `query_name` template (EXPLAIN, with ANALYZE when
+        `analyze`, which runs the query), e.g. to check which indexes the planner uses.
+        """
+        options = "ANALYZE, BUFFERS" if analyze else "COSTS"
+        result = self.db_handler.execute_query(f"EXPLAIN ({options}) {self.query(query_name, **kwargs)}")
+        return "\n".join(row[0] for row in result)